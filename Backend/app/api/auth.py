@@ -1,7 +1,8 @@
 # app/api/auth.py
 from fastapi import APIRouter, Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordRequestForm
-from sqlalchemy.orm import Session
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from datetime import datetime
 
 from app.database import get_db, User, Login
@@ -11,7 +12,8 @@ from app.core.security import (
     get_password_hash, 
     verify_password, 
     create_access_token, 
-    validate_token
+    validate_token,
+    token_cache
 )
 from app.utils.validators import validate_user_input
 
@@ -20,16 +22,16 @@ router = APIRouter(tags=["authentication"])
 @router.post("/register", response_model=UserResponse, status_code=status.HTTP_201_CREATED)
 async def register_user(
     user_data: UserCreate,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
     """
     Register a new user with the system.
     """
     # Check if username or email already exists
-    existing_user = db.query(User).filter(
+    existing_user = (await db.execute(select(User).filter(
         (User.username == user_data.username) | 
         (User.email == user_data.email)
-    ).first()
+    ))).scalars().first()
     
     if existing_user:
         raise HTTPException(
@@ -57,15 +59,15 @@ async def register_user(
     db.add(new_user)
     
     # Create login entry
-    hashed_password = get_password_hash(user_data.password)
+    hashed_password = await get_password_hash(user_data.password)
     new_login = Login(
         username=user_data.username,
         password=hashed_password
     )
     db.add(new_login)
     
-    db.commit()
-    db.refresh(new_user)
+    await db.commit()
+    await db.refresh(new_user)
     
     return new_user
 
@@ -73,34 +75,45 @@ async def register_user(
 @router.post("/login", response_model=Token)
 async def login_for_access_token(
     login_data: LoginRequest,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
-    user = db.query(Login).filter(Login.username == login_data.username).first()
+    user = (await db.execute(select(Login).filter(Login.username == login_data.username))).scalars().first()
     
-    if not user or not verify_password(login_data.password, user.password):
+    if user:
+        is_valid, new_hash = await verify_password(login_data.password, user.password)
+    else:
+        is_valid, new_hash = False, None
+    
+    if not is_valid:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Incorrect username or password",
             headers={"WWW-Authenticate": "Bearer"},
         )
     
+    # Rehash with the current work factor
+    if new_hash:
+        user.password = new_hash
+    
     access_token = create_access_token(data={"sub": user.username})
     
     # Update user's JWT and last login time
     user.jwt = access_token
     user.last_login_time = datetime.utcnow()
-    db.commit()
+    await db.commit()
+    # The previous token is no longer the stored one
+    token_cache.invalidate(user.username)
     
     return {"access_token": access_token, "token_type": "bearer"}
 @router.post("/validate-token", response_model=TokenValidationResponse)
 async def validate_token_endpoint(
     request: TokenValidationRequest,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
     """
     Validate a JWT token for a specific username.
     """
-    is_valid, message = validate_token(request.username, request.token, db)
+    is_valid, message = await validate_token(request.username, request.token, db)
     
     if not is_valid:
         raise HTTPException(
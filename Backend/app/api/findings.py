@@ -0,0 +1,77 @@
+# app/api/findings.py
+from fastapi import APIRouter, Depends, Response
+from typing import List, Optional
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.database import get_db
+from app.core.findings import get_port_findings, get_tls_findings, get_technology_findings
+from app.models.scan import PortFinding, TLSFinding, TechnologyFinding
+
+router = APIRouter(tags=["findings"])
+
+@router.get("/ports", response_model=List[PortFinding])
+async def list_port_findings(
+    api_key: str,
+    response: Response,
+    port: Optional[int] = None,
+    service: Optional[str] = None,
+    state: Optional[str] = "open",
+    host: Optional[str] = None,
+    limit: int = 100,
+    cursor: Optional[str] = None,
+    db: AsyncSession = Depends(get_db)
+):
+    """
+    Get ports found by nmap scans, newest first, e.g. `?port=3306` for every
+    host with MySQL exposed. Only open ports are listed unless `state` is given.
+    """
+    findings, next_cursor = await get_port_findings(
+        api_key, db, port=port, service=service, state=state, host=host, limit=limit, cursor=cursor
+    )
+    if next_cursor is not None:
+        response.headers["X-Next-Cursor"] = next_cursor
+    return findings
+
+@router.get("/tls", response_model=List[TLSFinding])
+async def list_tls_findings(
+    api_key: str,
+    response: Response,
+    protocol: Optional[str] = None,
+    cipher: Optional[str] = None,
+    host: Optional[str] = None,
+    limit: int = 100,
+    cursor: Optional[str] = None,
+    db: AsyncSession = Depends(get_db)
+):
+    """
+    Get TLS protocols and ciphers found by sslscan scans, newest first,
+    e.g. `?protocol=TLSv1.0` for every host that still accepts TLS 1.0.
+    """
+    findings, next_cursor = await get_tls_findings(
+        api_key, db, protocol=protocol, cipher=cipher, host=host, limit=limit, cursor=cursor
+    )
+    if next_cursor is not None:
+        response.headers["X-Next-Cursor"] = next_cursor
+    return findings
+
+@router.get("/technologies", response_model=List[TechnologyFinding])
+async def list_technology_findings(
+    api_key: str,
+    response: Response,
+    name: Optional[str] = None,
+    version: Optional[str] = None,
+    host: Optional[str] = None,
+    limit: int = 100,
+    cursor: Optional[str] = None,
+    db: AsyncSession = Depends(get_db)
+):
+    """
+    Get web technologies found by whatweb scans, newest first,
+    e.g. `?name=wordpress` for every host running WordPress.
+    """
+    findings, next_cursor = await get_technology_findings(
+        api_key, db, name=name, version=version, host=host, limit=limit, cursor=cursor
+    )
+    if next_cursor is not None:
+        response.headers["X-Next-Cursor"] = next_cursor
+    return findings
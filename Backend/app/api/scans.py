@@ -1,15 +1,71 @@
 # app/api/scans.py
-from app.core.apikey import verify_api_key_exists
-from fastapi import APIRouter, Depends, HTTPException, status
-from typing import List
-from sqlalchemy.orm import Session
+import json
+import re
+from app.core.apikey import authenticate_api_key, verify_api_key_exists
+from datetime import datetime
+from fastapi import APIRouter, Depends, HTTPException, Query, Response, status
+from fastapi.responses import PlainTextResponse, StreamingResponse
+from typing import List, Optional
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 
+from app.config import settings
 from app.database import get_db, ScanResult
-from app.core.scanner import execute_scan, get_scan_history, get_available_tools
-from app.models.scan import ScanRequest, ScanResponse, ScanHistoryItem, ScanHistoryDetailItem, ToolInfo
+from app.core.scanner import (
+    execute_scan,
+    get_scan_history,
+    get_available_tools,
+    get_scanner_tool,
+    stream_scan,
+    scan_cache
+)
+from app.core.security import authenticate_admin
+from app.core.blobstore import load_output, storage_stats
+from app.core.diff import DIFF_DEFAULT_CONTEXT, diff_scans, unified_diff
+from app.core.export import export_scan_history, validate_export_format
+from app.core.jobs import job_queue, get_job, get_jobs
+from app.core.retention import retention_compactor
+from app.core.schedules import (
+    scan_scheduler,
+    create_schedule,
+    get_schedule,
+    get_schedules,
+    update_schedule,
+    delete_schedule
+)
+from app.core.search import search_index
+from app.core.pipeline import (
+    validate_pipeline,
+    create_pipeline_run,
+    run_pipeline,
+    get_pipeline_run,
+    pipeline_parallelism
+)
+from app.models.scan import (
+    ScanRequest,
+    ScanResponse,
+    ScanHistoryItem,
+    ScanHistoryDetailItem,
+    ScanSearchItem,
+    ScanDiffResponse,
+    ScanJobResponse,
+    ScheduleRequest,
+    ScheduleUpdate,
+    ScheduleResponse,
+    SchedulerStats,
+    ScanCacheStats,
+    ScanStorageStats,
+    RetentionStats,
+    PipelineRequest,
+    PipelineRunResponse,
+    ToolInfo
+)
 
 router = APIRouter(tags=["scanning tools"])
 
+# SSE treats any of these as the end of a data line
+SSE_LINE_BREAK = re.compile(r"\r\n|\r|\n")
+
 @router.get("/tools", response_model=List[ToolInfo])
 async def list_available_tools():
     """
@@ -21,12 +77,12 @@ async def list_available_tools():
 async def run_scan(
     tool_name: str,
     scan_request: ScanRequest,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
     """
     Execute a scan using the specified tool.
     """
-    result = execute_scan(
+    result = await execute_scan(
         tool_name=tool_name,
         domain=scan_request.domain,
         api_key=scan_request.api_key,
@@ -35,105 +91,374 @@ async def run_scan(
     
     return result
 
+@router.post("/stream/{tool_name}")
+async def stream_scan_output(
+    tool_name: str,
+    scan_request: ScanRequest,
+    db: AsyncSession = Depends(get_db)
+):
+    """
+    Execute a scan and stream its output as Server-Sent Events.
+
+    Each stdout line is sent as an `output` event while the tool runs, with one
+    `data` field per carriage-return-separated piece of the line. The stream
+    ends with a `done` event carrying the stored scan id, or an `error` event.
+    """
+    tool = get_scanner_tool(tool_name)
+    await authenticate_api_key(scan_request.api_key, db, cost=tool.cost)
+
+    async def event_stream():
+        async for event, data in stream_scan(tool, scan_request.domain, scan_request.api_key):
+            if event == "output":
+                lines = SSE_LINE_BREAK.split(data)
+                if len(lines) > 1 and lines[-1] == "":
+                    lines.pop()
+            else:
+                lines = [json.dumps(data)]
+            # One data field per line; clients join them back with newlines
+            fields = "".join(f"data: {line}\n" for line in lines)
+            yield f"event: {event}\n{fields}\n"
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
 @router.post("/scan/dig", response_model=ScanResponse)
 async def dig_scan(
     scan_request: ScanRequest,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
     """
     Execute a DNS lookup scan using dig.
     """
-    return execute_scan("dig", scan_request.domain, scan_request.api_key, db)
+    return await execute_scan("dig", scan_request.domain, scan_request.api_key, db)
 
 @router.post("/scan/nmap", response_model=ScanResponse)
 async def nmap_scan(
     scan_request: ScanRequest,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
     """
     Execute a network scan using nmap.
     """
-    return execute_scan("nmap", scan_request.domain, scan_request.api_key, db)
+    return await execute_scan("nmap", scan_request.domain, scan_request.api_key, db)
 
 @router.post("/scan/whatweb", response_model=ScanResponse)
 async def whatweb_scan(
     scan_request: ScanRequest,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
     """
     Execute a web technology scan using whatweb.
     """
-    return execute_scan("whatweb", scan_request.domain, scan_request.api_key, db)
+    return await execute_scan("whatweb", scan_request.domain, scan_request.api_key, db)
 
 @router.post("/scan/sslscan", response_model=ScanResponse)
 async def sslscan_scan(
     scan_request: ScanRequest,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
     """
     Execute an SSL/TLS scan using sslscan.
     """
-    return execute_scan("sslscan", scan_request.domain, scan_request.api_key, db)
+    return await execute_scan("sslscan", scan_request.domain, scan_request.api_key, db)
 
 @router.post("/scan/subfinder", response_model=ScanResponse)
 async def subfinder_scan(
     scan_request: ScanRequest,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
     """
     Execute a subdomain discovery scan using subfinder.
     """
-    return execute_scan("subfinder", scan_request.domain, scan_request.api_key, db)
+    return await execute_scan("subfinder", scan_request.domain, scan_request.api_key, db)
 
 @router.post("/scan/wpscan", response_model=ScanResponse)
 async def wpscan_scan(
     scan_request: ScanRequest,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
     """
     Execute a WordPress security scan using wpscan.
     """
-    return execute_scan("wpscan", scan_request.domain, scan_request.api_key, db)
+    return await execute_scan("wpscan", scan_request.domain, scan_request.api_key, db)
 
 @router.post("/scan/nuclei", response_model=ScanResponse)
 async def nuclei_scan(
     scan_request: ScanRequest,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
     """
     Execute a vulnerability scan using nuclei.
     """
-    return execute_scan("nuclei", scan_request.domain, scan_request.api_key, db)
+    return await execute_scan("nuclei", scan_request.domain, scan_request.api_key, db)
+
+@router.post("/jobs/{tool_name}", response_model=ScanJobResponse, status_code=status.HTTP_202_ACCEPTED)
+async def submit_scan_job(
+    tool_name: str,
+    scan_request: ScanRequest,
+    db: AsyncSession = Depends(get_db)
+):
+    """
+    Queue a scan to run in the background and return the job immediately.
+    """
+    return await job_queue.submit(tool_name, scan_request.domain, scan_request.api_key, db)
+
+@router.get("/jobs", response_model=List[ScanJobResponse])
+async def list_scan_jobs(
+    api_key: str,
+    limit: int = 20,
+    db: AsyncSession = Depends(get_db)
+):
+    """
+    Get the most recent scan jobs for a specific API key (at most 100).
+    """
+    return await get_jobs(api_key, db, limit)
+
+@router.get("/jobs/{job_id}", response_model=ScanJobResponse)
+async def get_scan_job(
+    job_id: int,
+    api_key: str,
+    db: AsyncSession = Depends(get_db)
+):
+    """
+    Get the status of a background scan job.
+    """
+    return await get_job(job_id, api_key, db)
+
+@router.post("/schedules", response_model=ScheduleResponse, status_code=status.HTTP_201_CREATED)
+async def create_scan_schedule(
+    schedule_request: ScheduleRequest,
+    db: AsyncSession = Depends(get_db)
+):
+    """
+    Run a scan every `interval_seconds`. Each run is charged to the API key
+    like a regular scan and stored in its history. Run times are jittered
+    slightly so schedules created together don't fire at the same moment.
+    """
+    return await create_schedule(
+        db,
+        schedule_request.api_key,
+        schedule_request.tool,
+        schedule_request.domain,
+        schedule_request.interval_seconds
+    )
+
+@router.get("/schedules", response_model=List[ScheduleResponse])
+async def list_scan_schedules(
+    api_key: str,
+    db: AsyncSession = Depends(get_db)
+):
+    """
+    Get every scan schedule of a specific API key.
+    """
+    return await get_schedules(api_key, db)
+
+@router.get("/schedules/stats", response_model=SchedulerStats)
+async def get_scheduler_stats(admin_secret_key: str):
+    """
+    Admin only: Get the scan scheduler's queue and dispatch counters.
+    """
+    authenticate_admin(admin_secret_key)
+    return scan_scheduler.stats()
+
+@router.get("/schedules/{schedule_id}", response_model=ScheduleResponse)
+async def get_scan_schedule(
+    schedule_id: int,
+    api_key: str,
+    db: AsyncSession = Depends(get_db)
+):
+    """
+    Get a scan schedule with the outcome of its last run.
+    """
+    return await get_schedule(schedule_id, api_key, db)
+
+@router.patch("/schedules/{schedule_id}", response_model=ScheduleResponse)
+async def update_scan_schedule(
+    schedule_id: int,
+    schedule_update: ScheduleUpdate,
+    db: AsyncSession = Depends(get_db)
+):
+    """
+    Change a scan schedule's interval, or pause and resume it with `enabled`.
+    """
+    return await update_schedule(
+        schedule_id,
+        schedule_update.api_key,
+        db,
+        interval_seconds=schedule_update.interval_seconds,
+        enabled=schedule_update.enabled
+    )
+
+@router.delete("/schedules/{schedule_id}", status_code=status.HTTP_204_NO_CONTENT)
+async def delete_scan_schedule(
+    schedule_id: int,
+    api_key: str,
+    db: AsyncSession = Depends(get_db)
+):
+    """
+    Delete a scan schedule. Scans it already ran stay in the history.
+    """
+    await delete_schedule(schedule_id, api_key, db)
+
+@router.post("/pipelines")
+async def run_pipeline_endpoint(
+    pipeline_request: PipelineRequest,
+    db: AsyncSession = Depends(get_db)
+):
+    """
+    Run a pipeline of chained scans and stream node results as NDJSON.
+
+    Stages without `after` run against the requested domain. A stage with
+    `after` runs on every host found in the output of that stage. Each node is
+    stored as a regular scan result linked to the pipeline run, and the stream
+    ends with a `done` event carrying the pipeline id.
+    """
+    validate_pipeline(pipeline_request.stages)
+    await verify_api_key_exists(pipeline_request.api_key, db)
+    run = await create_pipeline_run(
+        db, pipeline_request.api_key, pipeline_request.domain, pipeline_request.stages
+    )
+
+    events = run_pipeline(
+        run.id,
+        pipeline_request.stages,
+        pipeline_request.domain,
+        pipeline_request.api_key,
+        pipeline_parallelism(pipeline_request.max_parallel)
+    )
+
+    async def ndjson_stream():
+        async for event in events:
+            yield json.dumps(event) + "\n"
+
+    return StreamingResponse(
+        ndjson_stream(),
+        media_type="application/x-ndjson",
+        headers={"X-Pipeline-Id": str(run.id), "X-Accel-Buffering": "no"}
+    )
+
+@router.get("/pipelines/{pipeline_id}", response_model=PipelineRunResponse)
+async def get_pipeline_run_endpoint(
+    pipeline_id: int,
+    api_key: str,
+    db: AsyncSession = Depends(get_db)
+):
+    """
+    Get a pipeline run with the scans it produced.
+    """
+    return await get_pipeline_run(pipeline_id, api_key, db)
+
+@router.get("/cache/stats", response_model=ScanCacheStats)
+async def get_scan_cache_stats(admin_secret_key: str):
+    """
+    Admin only: Get hit/miss counters for the scan result cache.
+    """
+    authenticate_admin(admin_secret_key)
+    return scan_cache.stats()
 
 @router.get("/history/{api_key}", response_model=List[ScanHistoryItem])
 async def get_scan_history_endpoint(
     api_key: str,
+    response: Response,
+    limit: int = 20,
+    cursor: Optional[str] = None,
+    tool: Optional[str] = None,
+    domain: Optional[str] = None,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    db: AsyncSession = Depends(get_db)
+):
+    """
+    Get scan history for a specific API key, newest first.
+
+    When more results exist, the X-Next-Cursor response header holds an opaque
+    cursor; pass it back as `cursor` to fetch the next page.
+    """
+    scan_results, next_cursor = await get_scan_history(
+        api_key, db, limit, cursor, tool=tool, domain=domain, since=since, until=until
+    )
+    if next_cursor is not None:
+        response.headers["X-Next-Cursor"] = next_cursor
+    return scan_results
+
+@router.get("/export/{api_key}")
+async def export_scan_history_endpoint(
+    api_key: str,
+    format: str = "ndjson",
+    include_output: bool = False,
+    gzip: bool = False,
+    tool: Optional[str] = None,
+    domain: Optional[str] = None,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    db: AsyncSession = Depends(get_db)
+):
+    """
+    Download the entire scan history of an API key, oldest first, as NDJSON
+    or CSV. Set `include_output` to add each scan's output and `gzip` to
+    receive a gzip-compressed file. The export is streamed as it is read.
+    """
+    media_type = validate_export_format(format)
+    await verify_api_key_exists(api_key, db)
+
+    filename = f"scan-history.{format}" + (".gz" if gzip else "")
+    return StreamingResponse(
+        export_scan_history(
+            api_key, format, include_output, gzip, tool=tool, domain=domain, since=since, until=until
+        ),
+        media_type="application/gzip" if gzip else media_type,
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'}
+    )
+
+@router.get("/search", response_model=List[ScanSearchItem])
+async def search_scans(
+    api_key: str,
+    q: str,
+    response: Response,
     limit: int = 20,
-    db: Session = Depends(get_db)
+    cursor: Optional[str] = None,
+    tool: Optional[str] = None,
+    domain: Optional[str] = None,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    db: AsyncSession = Depends(get_db)
 ):
     """
-    Get scan history for a specific API key.
+    Full-text search over the output of an API key's scans, best matches first.
+
+    Each word of `q` must appear in the output; use "quotes" for a phrase, a
+    trailing * for a prefix and OR/NOT between words. Matches are marked with
+    ** in the snippet. Pass the X-Next-Cursor response header back as `cursor`
+    for the next page.
     """
-    return get_scan_history(api_key, db, limit)
+    await verify_api_key_exists(api_key, db)
+    results, next_cursor = await search_index.search(
+        api_key, q, db, tool=tool, domain=domain, since=since, until=until, limit=limit, cursor=cursor
+    )
+    if next_cursor is not None:
+        response.headers["X-Next-Cursor"] = next_cursor
+    return results
 
 @router.get("/result/{scan_id}", response_model=ScanHistoryDetailItem)
 async def get_scan_result(
     scan_id: int,
     api_key: str,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
     """
     Get detailed result for a specific scan.
     """        
-    verify_api_key_exists(api_key, db)
+    # Served from the API key cache, so the scan lookup is the only query
+    await verify_api_key_exists(api_key, db)
 
-    # Verify that the API key is valid and the scan belongs to this API key
-    scan_result = db.query(ScanResult).filter(
+    # The scan must belong to this API key
+    scan_result = (await db.execute(select(ScanResult).filter(
         ScanResult.id == scan_id,
         ScanResult.apikey == api_key
-    ).first()
-    
-    # Verify that the API key exists without incrementing the counter
+    ))).scalars().first()
     
     if not scan_result:
         raise HTTPException(
@@ -141,4 +466,72 @@ async def get_scan_result(
             detail="Scan result not found or you don't have permission to access it"
         )
     
-    return scan_result
+    # The output is only decompressed here, never for history listings
+    return {
+        "id": scan_result.id,
+        "domain": scan_result.domain,
+        "tool": scan_result.tool,
+        "scan_time": scan_result.scan_time,
+        "status": scan_result.status,
+        "result": await load_output(db, scan_result)
+    }
+
+@router.get("/diff", response_model=ScanDiffResponse)
+async def diff_scan_results(
+    api_key: str,
+    from_id: int = Query(..., alias="from"),
+    to_id: int = Query(..., alias="to"),
+    context: int = DIFF_DEFAULT_CONTEXT,
+    format: str = "json",
+    db: AsyncSession = Depends(get_db)
+):
+    """
+    Compare two results of the same tool and domain: the changed output lines
+    in hunks with `context` lines around them, and the findings added and
+    removed. Pass `format=unified` for a plain unified diff.
+    """
+    if format not in ("json", "unified"):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Diff format must be one of: json, unified"
+        )
+    diff = await diff_scans(api_key, from_id, to_id, db, context)
+    if format == "unified":
+        return PlainTextResponse(unified_diff(diff), media_type="text/x-diff")
+    return diff
+
+@router.get("/storage/stats", response_model=ScanStorageStats)
+async def get_scan_storage_stats(
+    admin_secret_key: str,
+    db: AsyncSession = Depends(get_db)
+):
+    """
+    Admin only: Get compression and deduplication ratios of stored scan output.
+    """
+    authenticate_admin(admin_secret_key)
+    return await storage_stats(db)
+
+@router.get("/retention/stats", response_model=RetentionStats)
+async def get_retention_stats(
+    admin_secret_key: str,
+    db: AsyncSession = Depends(get_db)
+):
+    """
+    Admin only: Get the size of the scan output archive and compaction counters.
+    """
+    authenticate_admin(admin_secret_key)
+    return await retention_compactor.stats(db)
+
+@router.post("/retention/run", status_code=status.HTTP_202_ACCEPTED)
+async def run_retention(admin_secret_key: str):
+    """
+    Admin only: Start a compaction pass now instead of waiting for the next interval.
+    """
+    authenticate_admin(admin_secret_key)
+    if not settings.RETENTION_ENABLED:
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail="Retention is disabled"
+        )
+    retention_compactor.trigger()
+    return {"message": "Compaction started"}
@@ -1,10 +1,15 @@
 # app/api/users.py
-from fastapi import APIRouter, Depends, HTTPException, status
-from typing import List
-from sqlalchemy.orm import Session
+from datetime import datetime
+from fastapi import APIRouter, Depends, HTTPException, Response, status
+from fastapi.responses import StreamingResponse
+from typing import List, Optional
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 
 from app.database import get_db, User
-from app.models.user import UserResponse, UserInDB
+from app.models.user import UserResponse, UserInDB, UserCounts, UserListResponse
+from app.core.apikey import api_key_cache
+from app.core.users import user_filters, count_users, get_users_page, stream_users
 from app.core.security import validate_token, authenticate_admin, get_current_user
 from app.models.scan import PaymentRequest
 
@@ -13,7 +18,7 @@ router = APIRouter(tags=["users"])
 @router.get("/me", response_model=UserResponse)
 async def get_current_user_info(
     current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
     """
     Get information about the currently authenticated user.
@@ -23,19 +28,19 @@ async def get_current_user_info(
 @router.post("/make-payment")
 async def make_payment(
     request: PaymentRequest,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
     """
     Process a payment for a user to upgrade to paid status.
     """
-    is_valid, message = validate_token(request.username, request.jwt_token, db)
+    is_valid, message = await validate_token(request.username, request.jwt_token, db)
     if not is_valid:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail=message
         )
     
-    user = db.query(User).filter(User.username == request.username).first()
+    user = (await db.execute(select(User).filter(User.username == request.username))).scalars().first()
     if not user:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -51,7 +56,8 @@ async def make_payment(
     # Update user's paid status and bill amount
     user.is_paid = True
     user.bill_amount = request.amount
-    db.commit()
+    await db.commit()
+    api_key_cache.invalidate_user(request.username)
     
     return {"message": "Payment processed successfully"}
 
@@ -59,19 +65,19 @@ async def make_payment(
 async def get_paid_status(
     username: str,
     jwt_token: str,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
     """
     Check if a user has paid status.
     """
-    is_valid, message = validate_token(username, jwt_token, db)
+    is_valid, message = await validate_token(username, jwt_token, db)
     if not is_valid:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail=message
         )
     
-    user = db.query(User).filter(User.username == username).first()
+    user = (await db.execute(select(User).filter(User.username == username))).scalars().first()
     if not user:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -84,19 +90,19 @@ async def get_paid_status(
 async def get_bill_amount(
     username: str,
     jwt_token: str,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
     """
     Get the bill amount for a user.
     """
-    is_valid, message = validate_token(username, jwt_token, db)
+    is_valid, message = await validate_token(username, jwt_token, db)
     if not is_valid:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail=message
         )
     
-    user = db.query(User).filter(User.username == username).first()
+    user = (await db.execute(select(User).filter(User.username == username))).scalars().first()
     if not user:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -109,12 +115,83 @@ async def get_bill_amount(
 @router.get("/fetch-all-users", response_model=List[UserInDB])
 async def fetch_all_users(
     admin_secret_key: str,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
     """
     Admin only: Get information about all users in the system.
     """
     authenticate_admin(admin_secret_key)
     
-    users = db.query(User).all()
-    return users
\ No newline at end of file
+    users = (await db.execute(select(User))).scalars().all()
+    return users
+
+@router.get("/list", response_model=UserListResponse)
+async def list_users(
+    admin_secret_key: str,
+    response: Response,
+    limit: int = 100,
+    cursor: Optional[str] = None,
+    is_paid: Optional[bool] = None,
+    has_api_key: Optional[bool] = None,
+    created_since: Optional[datetime] = None,
+    created_until: Optional[datetime] = None,
+    db: AsyncSession = Depends(get_db)
+):
+    """
+    Admin only: Get a page of users, newest first, with total/paid/free counts
+    of all users matching the filters.
+
+    When more users exist, the X-Next-Cursor response header holds an opaque
+    cursor; pass it back as `cursor` to fetch the next page.
+    """
+    authenticate_admin(admin_secret_key)
+    
+    filters = user_filters(is_paid, has_api_key, created_since, created_until)
+    users, next_cursor = await get_users_page(db, filters, limit, cursor)
+    if next_cursor is not None:
+        response.headers["X-Next-Cursor"] = next_cursor
+    return {**await count_users(db, filters), "users": users}
+
+@router.get("/counts", response_model=UserCounts)
+async def get_user_counts(
+    admin_secret_key: str,
+    is_paid: Optional[bool] = None,
+    has_api_key: Optional[bool] = None,
+    created_since: Optional[datetime] = None,
+    created_until: Optional[datetime] = None,
+    db: AsyncSession = Depends(get_db)
+):
+    """
+    Admin only: Count total, paid and free users matching the filters.
+    """
+    authenticate_admin(admin_secret_key)
+    
+    return await count_users(db, user_filters(is_paid, has_api_key, created_since, created_until))
+
+@router.get("/stream")
+async def stream_all_users(
+    admin_secret_key: str,
+    is_paid: Optional[bool] = None,
+    has_api_key: Optional[bool] = None,
+    created_since: Optional[datetime] = None,
+    created_until: Optional[datetime] = None,
+    db: AsyncSession = Depends(get_db)
+):
+    """
+    Admin only: Stream all users matching the filters as NDJSON, newest first.
+    The counts are sent up front in the X-Total-Count, X-Paid-Count and
+    X-Free-Count headers.
+    """
+    authenticate_admin(admin_secret_key)
+    
+    filters = user_filters(is_paid, has_api_key, created_since, created_until)
+    counts = await count_users(db, filters)
+    return StreamingResponse(
+        stream_users(filters),
+        media_type="application/x-ndjson",
+        headers={
+            "X-Total-Count": str(counts["total"]),
+            "X-Paid-Count": str(counts["paid"]),
+            "X-Free-Count": str(counts["free"])
+        }
+    )
\ No newline at end of file
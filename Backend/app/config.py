@@ -1,5 +1,6 @@
 # app/config.py
 import os
+from typing import Dict
 from pydantic_settings import BaseSettings
 from dotenv import load_dotenv
 
@@ -12,17 +13,101 @@ class Settings(BaseSettings):
     
     # Database
     DATABASE_URL: str = "sqlite:///./api_data.db"
+    DB_POOL_SIZE: int = 20  # should cover the request threadpool plus SCAN_JOB_WORKERS
+    DB_MAX_OVERFLOW: int = 20
+    DB_POOL_TIMEOUT: int = 30
+    
+    # SQLite storage profile (WAL journal, busy timeout, larger caches)
+    SQLITE_PRODUCTION_PROFILE: bool = True
+    SQLITE_SYNCHRONOUS: str = "NORMAL"
+    SQLITE_BUSY_TIMEOUT_MS: int = 5000
+    SQLITE_CACHE_SIZE_KB: int = 64 * 1024
+    SQLITE_MMAP_SIZE: int = 256 * 1024 * 1024
     
     # Security
     SECRET_KEY: str = os.getenv("SECRET_KEY", "default-secret-key-for-dev")
     ALGORITHM: str = "HS256"
     ACCESS_TOKEN_EXPIRE_MINUTES: int = 720
+    BCRYPT_ROUNDS: int = 12  # existing hashes are upgraded on next login when this changes
+    PASSWORD_HASH_WORKERS: int = 4
+    PASSWORD_HASH_MAX_QUEUE: int = 64
+    TOKEN_CACHE_SIZE: int = 10000
+    TOKEN_CACHE_TTL: int = 300  # seconds a validated token is trusted without a query
     
     # Admin
     ADMIN_SECRET_KEY: str = os.getenv("ADMIN_SECRET_KEY", "admin-secret")
     
     # API settings
     API_FREE_LIMIT: int = 15
+    API_KEY_CACHE_SIZE: int = 10000
+    API_KEY_CACHE_TTL: int = 60  # seconds
+    
+    # Token-bucket rate limits per API key tier; each run takes its tool's cost in tokens
+    RATE_LIMIT_ENABLED: bool = True
+    RATE_LIMIT_REFILL_PER_MINUTE: Dict[str, float] = {"free": 10, "paid": 120}
+    RATE_LIMIT_BURST: Dict[str, int] = {"free": 20, "paid": 60}
+    
+    # Prometheus metrics at /metrics
+    METRICS_ENABLED: bool = True
+    
+    # Request profiling: every request, or those sending the admin key in PROFILING_HEADER
+    PROFILING_ENABLED: bool = False
+    PROFILING_HEADER_ENABLED: bool = False
+    PROFILING_HEADER: str = "X-Profile"
+    SLOW_REQUEST_MS: int = 1000
+    PROFILING_SAMPLE_INTERVAL_MS: int = 0  # stack sampling for profiled requests; 0 disables it
+    PROFILING_DUMP_DIR: str = "profiles"
+    
+    # Group commits of usage counters and scan results
+    WRITER_FLUSH_INTERVAL_MS: int = 5
+    WRITER_MAX_BATCH: int = 500
+    
+    # Tool output capture: kept in memory up to the spool size, then in a temp file, up to the max size
+    SCAN_OUTPUT_SPOOL_BYTES: int = 1024 * 1024
+    SCAN_OUTPUT_MAX_BYTES: int = 8 * 1024 * 1024
+    SCAN_OUTPUT_TOOL_MAX_BYTES: Dict[str, int] = {"nuclei": 32 * 1024 * 1024, "wpscan": 32 * 1024 * 1024}
+    
+    # Repeated scans of a target stored as line deltas against the last full output
+    SCAN_DELTA_ENABLED: bool = True
+    SCAN_DELTA_KEYFRAME_INTERVAL: int = 20  # every so many deltas the full output is stored again
+    SCAN_DELTA_MAX_RATIO: float = 0.5  # a delta bigger than this share of the compressed output is stored whole
+    SCAN_DELTA_MAX_BYTES: int = 4 * 1024 * 1024  # larger outputs are never line-diffed on write
+    
+    # Background scan jobs
+    SCAN_JOB_WORKERS: int = 16
+    SCAN_JOB_DEFAULT_TOOL_LIMIT: int = 4
+    SCAN_JOB_TOOL_LIMITS: Dict[str, int] = {"nmap": 2, "wpscan": 2, "nuclei": 2}
+    
+    # Recurring scan schedules, run in-process with jitter under their own concurrency budget
+    SCHEDULES_ENABLED: bool = True
+    SCHEDULE_MIN_INTERVAL_SECONDS: int = 300
+    SCHEDULE_MAX_PER_KEY: Dict[str, int] = {"free": 3, "paid": 100}
+    SCHEDULE_MAX_CONCURRENT: int = 4  # scheduled scans running at once; keep below SCAN_JOB_WORKERS
+    SCHEDULE_JITTER_RATIO: float = 0.1  # each run moves by up to this fraction of its interval
+    SCHEDULE_MAX_JITTER_SECONDS: int = 300
+    SCHEDULE_CATCHUP_WINDOW_SECONDS: int = 600  # runs missed while down are spread over this window
+    
+    # Scan result cache; tools without a TTL are never served from cache
+    SCAN_CACHE_MAX_BYTES: int = 64 * 1024 * 1024
+    SCAN_CACHE_TTLS: Dict[str, int] = {"dig": 300, "whatweb": 900, "sslscan": 3600, "subfinder": 3600}
+    
+    # Tool pipelines
+    PIPELINE_MAX_STAGES: int = 8
+    PIPELINE_MAX_PARALLEL: int = 8
+    PIPELINE_MAX_FANOUT: int = 100
+    
+    # Full-text search over scan output (SQLite FTS5)
+    SEARCH_ENABLED: bool = True
+    
+    # Retention: outputs older than the hot window move to archive segments on disk
+    RETENTION_ENABLED: bool = True
+    RETENTION_HOT_DAYS: int = 30
+    RETENTION_ARCHIVE_DAYS: int = 0  # scans older than this are deleted; 0 keeps archives forever
+    RETENTION_INTERVAL_SECONDS: int = 3600
+    RETENTION_BATCH_SIZE: int = 500
+    RETENTION_BATCH_PAUSE_MS: int = 200  # pause between batches so compaction yields to live traffic
+    ARCHIVE_DIR: str = "archive"
+    ARCHIVE_SEGMENT_MAX_BYTES: int = 64 * 1024 * 1024
 
     class Config:
         env_file = ".env"
@@ -1,28 +1,130 @@
 # app/core/apikey.py
+import time
 import uuid
+from collections import OrderedDict
 from fastapi import HTTPException, status
-from sqlalchemy.orm import Session
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 
 from app.database import ApiKey, User
 from app.core.security import validate_token
+from app.core.profiling import profile_span
+from app.core.ratelimit import rate_limiter
+from app.core.writer import db_writer
 from app.config import settings
 
+class ApiKeyInfo:
+    """Snapshot of an API key record, as kept in the API key cache"""
+
+    def __init__(self, apikey: str, username: str, api_type: str, count: int):
+        self.apikey = apikey
+        self.username = username
+        self.api_type = api_type
+        self.count = count
+
+    @classmethod
+    def from_record(cls, key_record):
+        return cls(key_record.apikey, key_record.username, key_record.api_type, key_record.count or 0)
+
+class ApiKeyCache:
+    """
+    Process-local TTL/LRU cache of API key records, so authenticating a key on
+    hot endpoints is a dict lookup instead of a database round trip. Entries
+    are invalidated explicitly when keys or their owner change.
+    """
+
+    def __init__(self, max_entries: int, ttl: int):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()  # apikey -> (expires_at, ApiKeyInfo)
+
+    def get(self, api_key: str):
+        entry = self._entries.get(api_key)
+        if entry is None or entry[0] <= time.monotonic():
+            self.misses += 1
+            return None
+        self._entries.move_to_end(api_key)
+        self.hits += 1
+        return entry[1]
+
+    def put(self, info: ApiKeyInfo):
+        """Cache a key and return the cached snapshot, keeping one that is already live"""
+        if self.ttl <= 0:
+            return info
+        entry = self._entries.get(info.apikey)
+        if entry is not None and entry[0] > time.monotonic():
+            # Another request loaded the key meanwhile; its reservations must not be lost
+            return entry[1]
+        self._entries[info.apikey] = (time.monotonic() + self.ttl, info)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+        return info
+
+    def invalidate(self, api_key: str):
+        self._entries.pop(api_key, None)
+
+    def invalidate_user(self, username: str):
+        for api_key in [key for key, (_, info) in self._entries.items() if info.username == username]:
+            del self._entries[api_key]
+
+    def clear(self):
+        self._entries.clear()
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / lookups if lookups else 0.0,
+            "entries": len(self._entries),
+            "max_entries": self.max_entries
+        }
+
+api_key_cache = ApiKeyCache(max_entries=settings.API_KEY_CACHE_SIZE, ttl=settings.API_KEY_CACHE_TTL)
+
+async def _load_api_key(api_key: str, db: AsyncSession):
+    """
+    The key's columns as a row. Not an ApiKey entity: a reload in the same
+    session would return the identity-mapped object with its stale count.
+    """
+    return (await db.execute(select(
+        ApiKey.apikey, ApiKey.username, ApiKey.api_type, ApiKey.count
+    ).filter(ApiKey.apikey == api_key))).first()
+
+async def lookup_api_key(api_key: str, db: AsyncSession):
+    """Get an API key from the cache, loading it from the database on a miss; None if it doesn't exist"""
+    with profile_span("auth_api_key"):
+        info = api_key_cache.get(api_key)
+        if info is not None:
+            return info
+
+        # Count increments that are reserved but not committed yet
+        key_record, pending = await db_writer.read_usage(api_key, lambda: _load_api_key(api_key, db))
+        if not key_record:
+            return None
+
+        info = ApiKeyInfo.from_record(key_record)
+        info.count += pending
+        return api_key_cache.put(info)
+
 def generate_api_key():
     """Generate a unique API key"""
     return str(uuid.uuid4())
 
-def generate_and_store_api_key(username: str, api_type: str, jwt_token: str, db: Session):
+async def generate_and_store_api_key(username: str, api_type: str, jwt_token: str, db: AsyncSession):
     """Generate and store API key for a user"""
     # Validate JWT token
-    is_valid, message = validate_token(username, jwt_token, db)
+    is_valid, message = await validate_token(username, jwt_token, db)
     if not is_valid:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail=message)
     
     # Check if API key already exists for this type
-    existing_key = db.query(ApiKey).filter(
+    existing_key = (await db.execute(select(ApiKey).filter(
         ApiKey.username == username, 
         ApiKey.api_type == api_type
-    ).first()
+    ))).scalars().first()
     
     if existing_key:
         raise HTTPException(
@@ -39,13 +141,13 @@ def generate_and_store_api_key(username: str, api_type: str, jwt_token: str, db:
         db.add(new_key)
         
         # Update user record
-        user = db.query(User).filter(User.username == username).first()
+        user = (await db.execute(select(User).filter(User.username == username))).scalars().first()
         if user:
             user.is_api_key_generated = True
         
     elif api_type == 'paid':
         # Paid tier logic - check if user is paid
-        user = db.query(User).filter(User.username == username).first()
+        user = (await db.execute(select(User).filter(User.username == username))).scalars().first()
         if not user or not user.is_paid:
             raise HTTPException(
                 status_code=status.HTTP_400_BAD_REQUEST, 
@@ -62,16 +164,17 @@ def generate_and_store_api_key(username: str, api_type: str, jwt_token: str, db:
             detail="Invalid API type. Use 'free' or 'paid'"
         )
     
-    db.commit()
+    await db.commit()
+    api_key_cache.invalidate_user(username)
     return api_key
 
-def get_user_api_keys(username: str, jwt_token: str, db: Session):
+async def get_user_api_keys(username: str, jwt_token: str, db: AsyncSession):
     """Get all API keys for a user"""
-    is_valid, message = validate_token(username, jwt_token, db)
+    is_valid, message = await validate_token(username, jwt_token, db)
     if not is_valid:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail=message)
     
-    api_keys = db.query(ApiKey).filter(ApiKey.username == username).all()
+    api_keys = (await db.execute(select(ApiKey).filter(ApiKey.username == username))).scalars().all()
     
     if not api_keys:
         raise HTTPException(
@@ -81,9 +184,9 @@ def get_user_api_keys(username: str, jwt_token: str, db: Session):
     
     return api_keys
 
-def authenticate_api_key(api_key: str, db: Session):
-    """Authenticate an API key and increment usage count"""
-    key_record = db.query(ApiKey).filter(ApiKey.apikey == api_key).first()
+async def authenticate_api_key(api_key: str, db: AsyncSession, cost: int = 1):
+    """Authenticate an API key, charge cost to its rate limit and increment usage count"""
+    key_record = await lookup_api_key(api_key, db)
     
     if not key_record:
         raise HTTPException(
@@ -98,15 +201,20 @@ def authenticate_api_key(api_key: str, db: Session):
             detail=f"Usage limit of {settings.API_FREE_LIMIT} exceeded for free API"
         )
     
-    # Increment usage count
+    if settings.RATE_LIMIT_ENABLED:
+        rate_limiter.acquire(api_key, key_record.api_type, cost)
+    
+    # Reserve the usage in memory; the group-commit writer persists it shortly.
+    # There is no await between the limit check and the reservation, so
+    # concurrent requests cannot both take the last free scan.
     key_record.count += 1
-    db.commit()
+    db_writer.add_usage(api_key)
     
     return key_record
 
-def verify_api_key_exists(api_key: str, db: Session):
+async def verify_api_key_exists(api_key: str, db: AsyncSession):
     """Verify an API key exists without incrementing usage count"""
-    key_record = db.query(ApiKey).filter(ApiKey.apikey == api_key).first()
+    key_record = await lookup_api_key(api_key, db)
     
     if not key_record:
         raise HTTPException(
@@ -116,9 +224,9 @@ def verify_api_key_exists(api_key: str, db: Session):
     
     return key_record
 
-def get_api_key_count(api_key: str, db: Session):
+async def get_api_key_count(api_key: str, db: AsyncSession):
     """Get usage count for an API key"""
-    key_record = db.query(ApiKey).filter(ApiKey.apikey == api_key).first()
+    key_record, pending = await db_writer.read_usage(api_key, lambda: _load_api_key(api_key, db))
     
     if not key_record:
         raise HTTPException(
@@ -126,4 +234,4 @@ def get_api_key_count(api_key: str, db: Session):
             detail="API key not found"
         )
     
-    return key_record.count
\ No newline at end of file
+    return key_record.count + pending
\ No newline at end of file
@@ -0,0 +1,203 @@
+# app/core/archive.py
+import mmap
+import os
+import struct
+import threading
+from collections import OrderedDict
+
+from app.config import settings
+
+# Sidecar index entry: scan id, data offset, data length, codec; sorted by scan id
+INDEX_ENTRY = struct.Struct("<QQIB3x")
+CODECS = ("zlib", "zstd")
+MAX_OPEN_SEGMENTS = 64
+
+class ArchiveSegmentReader:
+    """
+    An open segment: the memory-mapped sidecar index and the data file
+    descriptor. users and retired are guarded by the store's lock; a reader
+    dropped from the store is closed once its last read finishes.
+    """
+
+    def __init__(self, index_path: str, data_path: str):
+        self.users = 0
+        self.retired = False
+        self.index_inode = os.stat(index_path).st_ino
+        self.data_fd = os.open(data_path, os.O_RDONLY)
+        self.index_map = None
+        with open(index_path, "rb") as f:
+            if os.fstat(f.fileno()).st_size:
+                self.index_map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def find(self, scan_id: int):
+        """Binary search the index for a scan; returns (offset, length, codec) or None"""
+        if self.index_map is None:
+            return None
+        low, high = 0, len(self.index_map) // INDEX_ENTRY.size
+        while low < high:
+            middle = (low + high) // 2
+            entry_id, offset, length, codec = INDEX_ENTRY.unpack_from(self.index_map, middle * INDEX_ENTRY.size)
+            if entry_id == scan_id:
+                return offset, length, CODECS[codec]
+            if entry_id < scan_id:
+                low = middle + 1
+            else:
+                high = middle
+        return None
+
+    def close(self):
+        if self.index_map is not None:
+            self.index_map.close()
+        os.close(self.data_fd)
+
+class ArchiveStore:
+    """
+    Append-only archive segments for scan output moved out of the database.
+
+    A segment is a data file of compressed outputs written back to back and a
+    sidecar index of fixed-width (scan id, offset, length, codec) entries
+    sorted by scan id. Readers memory-map the index, so fetching an archived
+    output is a binary search in memory plus one positioned read. Outputs
+    shared by several scans in a batch are written once. The data file is
+    only ever appended to; the index is rewritten whole and swapped in with
+    a rename, so readers never see a partial index. Open readers are cached
+    and shared by threads; replacing or evicting one never closes it under a
+    read in progress.
+    """
+
+    def __init__(self, directory: str, max_open: int = MAX_OPEN_SEGMENTS):
+        self.directory = directory
+        self.max_open = max_open
+        self._readers = OrderedDict()  # segment id -> ArchiveSegmentReader
+        self._lock = threading.Lock()
+
+    def data_path(self, segment_id: int):
+        return os.path.join(self.directory, f"segment-{segment_id:08d}.dat")
+
+    def index_path(self, segment_id: int):
+        return os.path.join(self.directory, f"segment-{segment_id:08d}.idx")
+
+    def append(self, segment_id: int, records):
+        """
+        Append (scan id, digest, codec, compressed data) records to a segment
+        and return the number of data bytes written. Blocking; run it in the
+        threadpool. Only one process may append to a segment at a time.
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        entries = {}
+        index_path = self.index_path(segment_id)
+        if os.path.exists(index_path):
+            with open(index_path, "rb") as f:
+                for entry in INDEX_ENTRY.iter_unpack(f.read()):
+                    entries[entry[0]] = entry
+
+        written = 0
+        with open(self.data_path(segment_id), "ab") as f:
+            offset = f.tell()
+            positions = {}  # digest -> (offset, length) within this batch
+            for scan_id, digest, codec, data in records:
+                position = positions.get(digest) if digest is not None else None
+                if position is None:
+                    f.write(data)
+                    position = (offset, len(data))
+                    offset += len(data)
+                    written += len(data)
+                    if digest is not None:
+                        positions[digest] = position
+                entries[scan_id] = (scan_id, position[0], position[1], CODECS.index(codec))
+            f.flush()
+            os.fsync(f.fileno())
+
+        # A scan archived twice after a crash keeps its latest entry
+        temporary_path = index_path + ".tmp"
+        with open(temporary_path, "wb") as f:
+            f.write(b"".join(INDEX_ENTRY.pack(*entries[scan_id]) for scan_id in sorted(entries)))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temporary_path, index_path)
+        self._swap_reader(segment_id)
+        return written
+
+    def _acquire(self, segment_id: int, refresh: bool = False):
+        """A reader for a segment, held until _release()"""
+        with self._lock:
+            reader = self._readers.get(segment_id)
+            if reader is not None and refresh:
+                # The index may have been replaced since it was mapped, possibly by another process
+                if os.stat(self.index_path(segment_id)).st_ino != reader.index_inode:
+                    self._retire(self._readers.pop(segment_id))
+                    reader = None
+            if reader is None:
+                reader = ArchiveSegmentReader(self.index_path(segment_id), self.data_path(segment_id))
+                self._readers[segment_id] = reader
+                if len(self._readers) > self.max_open:
+                    self._retire(self._readers.popitem(last=False)[1])
+            else:
+                self._readers.move_to_end(segment_id)
+            reader.users += 1
+            return reader
+
+    def _release(self, reader: ArchiveSegmentReader):
+        with self._lock:
+            reader.users -= 1
+            if reader.retired and not reader.users:
+                reader.close()
+
+    def _retire(self, reader: ArchiveSegmentReader):
+        """Close a reader dropped from the cache once no read uses it. Call with the lock held."""
+        reader.retired = True
+        if not reader.users:
+            reader.close()
+
+    def _swap_reader(self, segment_id: int):
+        """Replace a cached reader after its index was rewritten; reads still using the old one finish first"""
+        with self._lock:
+            reader = self._readers.get(segment_id)
+            if reader is not None:
+                self._readers[segment_id] = ArchiveSegmentReader(
+                    self.index_path(segment_id), self.data_path(segment_id)
+                )
+                self._retire(reader)
+
+    def _read(self, segment_id: int, scan_id: int, refresh: bool = False):
+        reader = self._acquire(segment_id, refresh)
+        try:
+            location = reader.find(scan_id)
+            if location is None:
+                return None
+            offset, length, codec = location
+            return codec, os.pread(reader.data_fd, length, offset)
+        finally:
+            self._release(reader)
+
+    def read(self, segment_id: int, scan_id: int):
+        """Return (codec, compressed data) of an archived scan. Blocking; run it in the threadpool."""
+        record = self._read(segment_id, scan_id)
+        if record is None:
+            record = self._read(segment_id, scan_id, refresh=True)
+        if record is None:
+            raise LookupError(f"Scan {scan_id} is not in archive segment {segment_id}")
+        return record
+
+    def delete(self, segment_id: int):
+        """Remove a segment's files"""
+        self._close_reader(segment_id)
+        for path in (self.data_path(segment_id), self.index_path(segment_id)):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    def _close_reader(self, segment_id: int):
+        with self._lock:
+            reader = self._readers.pop(segment_id, None)
+            if reader is not None:
+                self._retire(reader)
+
+    def close(self):
+        with self._lock:
+            readers, self._readers = self._readers, OrderedDict()
+            for reader in readers.values():
+                self._retire(reader)
+
+archive_store = ArchiveStore(settings.ARCHIVE_DIR)
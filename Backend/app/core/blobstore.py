@@ -0,0 +1,306 @@
+# app/core/blobstore.py
+import difflib
+import hashlib
+import json
+import logging
+import zlib
+from typing import Optional
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import func, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import aliased
+
+from app.config import settings
+from app.database import AsyncSessionLocal, ScanBlob, ScanResult
+from app.core.archive import archive_store
+
+try:
+    import zstandard
+except ImportError:  # zstd is optional; zlib is always available
+    zstandard = None
+
+logger = logging.getLogger(__name__)
+
+ZSTD_LEVEL = 10
+ZLIB_LEVEL = 6
+MIGRATION_BATCH_SIZE = 500
+
+# The keyframe of a delta blob. Queries that decode output select BLOB_COLUMNS
+# through join_blobs() and pass the row to decode_blob().
+BaseBlob = aliased(ScanBlob, name="base_blobs")
+BLOB_COLUMNS = [
+    ScanBlob.codec,
+    ScanBlob.data,
+    ScanBlob.base_digest,
+    BaseBlob.codec.label("base_codec"),
+    BaseBlob.data.label("base_data")
+]
+
+def compress(data: bytes):
+    """Compress with the best available codec and return (codec, compressed data)"""
+    if zstandard is not None:
+        return "zstd", zstandard.ZstdCompressor(level=ZSTD_LEVEL).compress(data)
+    return "zlib", zlib.compress(data, ZLIB_LEVEL)
+
+def decompress(codec: str, data: bytes):
+    """Decompress data written by compress()"""
+    if codec == "zstd":
+        if zstandard is None:
+            raise RuntimeError("zstandard is required to read zstd-compressed scan output")
+        return zstandard.ZstdDecompressor().decompress(data)
+    if codec == "zlib":
+        return zlib.decompress(data)
+    raise ValueError(f"Unknown codec '{codec}'")
+
+def make_delta(base: str, output: str):
+    """
+    Line delta that turns base into output, as a list of ops: [start, end]
+    copies base lines start:end, a list of strings inserts those lines.
+    Base lines that are not copied are dropped.
+    """
+    base_lines = base.splitlines(keepends=True)
+    lines = output.splitlines(keepends=True)
+    ops = []
+    for tag, i1, i2, j1, j2 in difflib.SequenceMatcher(None, base_lines, lines).get_opcodes():
+        if tag == "equal":
+            ops.append([i1, i2])
+        elif j2 > j1:
+            ops.append(lines[j1:j2])
+    return ops
+
+def apply_delta(base: str, ops):
+    """Rebuild the output a delta was made from"""
+    base_lines = base.splitlines(keepends=True)
+    return "".join(
+        "".join(base_lines[op[0]:op[1]]) if isinstance(op[0], int) else "".join(op)
+        for op in ops
+    )
+
+def decode_delta(codec: str, data: bytes):
+    return json.loads(decompress(codec, data))
+
+def decode_blob(row):
+    """Output bytes of a row selected with BLOB_COLUMNS, applying a delta blob to its keyframe"""
+    if row.base_digest is None:
+        return decompress(row.codec, row.data)
+    if row.base_data is None:
+        raise LookupError(f"Missing keyframe blob {row.base_digest}")
+    base = decompress(row.base_codec, row.base_data).decode(errors="replace")
+    return apply_delta(base, decode_delta(row.codec, row.data)).encode()
+
+def join_blobs(query):
+    """Outer-join a scan_results query to each scan's blob and, for deltas, its keyframe"""
+    return query.outerjoin(
+        ScanBlob, ScanBlob.digest == ScanResult.result_digest
+    ).outerjoin(
+        BaseBlob, BaseBlob.digest == ScanBlob.base_digest
+    )
+
+def _full_blob(digest: str, raw: bytes):
+    codec, data = compress(raw)
+    return {
+        "digest": digest,
+        "codec": codec,
+        "raw_size": len(raw),
+        "stored_size": len(data),
+        "data": data,
+        "base_digest": None,
+        "delta_index": None
+    }
+
+def _compress_delta(base_codec: str, base_data: bytes, output: str):
+    base = decompress(base_codec, base_data).decode(errors="replace")
+    return compress(json.dumps(make_delta(base, output), separators=(",", ":")).encode())
+
+def _insert_ignore(db: AsyncSession):
+    """INSERT ... ON CONFLICT DO NOTHING for the session's dialect"""
+    if db.bind.dialect.name == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert
+    return insert(ScanBlob).on_conflict_do_nothing(index_elements=[ScanBlob.digest])
+
+async def previous_output_digest(db: AsyncSession, api_key: str, tool_name: str, domain: str):
+    """Blob digest of the latest hot scan of a target by an API key, or None"""
+    return await db.scalar(select(ScanResult.result_digest).filter(
+        ScanResult.apikey == api_key,
+        ScanResult.tool == tool_name,
+        ScanResult.domain == domain,
+        ScanResult.archive_segment.is_(None),
+        ScanResult.result_digest.isnot(None)
+    ).order_by(ScanResult.scan_time.desc(), ScanResult.id.desc()).limit(1))
+
+async def _delta_blob(db: AsyncSession, previous_digest: str, output: str, full_size: int):
+    """
+    Encode output as a delta against the keyframe of the previous scan's blob.
+    Returns the blob fields to use instead of the full output, or None when it
+    should be stored whole and become the next keyframe.
+    """
+    previous = (await db.execute(select(ScanBlob.base_digest, ScanBlob.delta_index).filter(
+        ScanBlob.digest == previous_digest
+    ))).first()
+    if previous is None:
+        return None
+    if previous.base_digest is None:
+        base_digest, delta_index = previous_digest, 1
+    else:
+        base_digest, delta_index = previous.base_digest, previous.delta_index + 1
+    if delta_index > settings.SCAN_DELTA_KEYFRAME_INTERVAL:
+        return None
+
+    base = (await db.execute(select(ScanBlob.codec, ScanBlob.data, ScanBlob.raw_size).filter(
+        ScanBlob.digest == base_digest,
+        ScanBlob.base_digest.is_(None)
+    ))).first()
+    if base is None or base.raw_size > settings.SCAN_DELTA_MAX_BYTES:
+        return None
+    codec, data = await run_in_threadpool(_compress_delta, base.codec, base.data, output)
+    if len(data) > full_size * settings.SCAN_DELTA_MAX_RATIO:
+        return None
+    return {
+        "codec": codec,
+        "stored_size": len(data),
+        "data": data,
+        "base_digest": base_digest,
+        "delta_index": delta_index
+    }
+
+async def encode_output(db: AsyncSession, output: str, previous_digest: Optional[str] = None):
+    """
+    Hash and compress tool output for the blob store. Returns (digest, raw size,
+    stored size, blob row), where the blob row is None if the blob already exists.
+
+    Blobs are keyed on the sha256 of the output, so identical outputs are only
+    compressed and stored once. Given the blob of the previous scan of the same
+    target, the output is stored as a line delta against that scan's keyframe
+    when the delta is small enough. Hashing, diffing and compression run in the
+    threadpool.
+    """
+    raw = output.encode()
+    digest = await run_in_threadpool(lambda: hashlib.sha256(raw).hexdigest())
+
+    stored_size = await db.scalar(select(ScanBlob.stored_size).filter(ScanBlob.digest == digest))
+    if stored_size is not None:
+        return digest, len(raw), stored_size, None
+
+    blob = await run_in_threadpool(_full_blob, digest, raw)
+    if previous_digest is not None and len(raw) <= settings.SCAN_DELTA_MAX_BYTES:
+        delta = await _delta_blob(db, previous_digest, output, blob["stored_size"])
+        if delta is not None:
+            blob.update(delta)
+    return digest, len(raw), blob["stored_size"], blob
+
+async def insert_blobs(db: AsyncSession, blobs):
+    """Insert blob rows, skipping digests that are already stored. The caller commits."""
+    if blobs:
+        await db.execute(_insert_ignore(db), blobs)
+
+async def restore_missing_blobs(db: AsyncSession, outputs: dict):
+    """
+    Store any of {digest: output} in full whose blob no longer exists, or is a
+    delta whose keyframe no longer exists. encode_output skips outputs whose
+    blob is already stored and reads keyframes outside the writer's
+    transaction, and retention may drop either before the new scan is
+    committed. Call this after the scans are flushed, so the transaction
+    already holds the write lock. The caller commits.
+    """
+    if not outputs:
+        return
+    stored = (await db.execute(select(
+        ScanBlob.digest,
+        ScanBlob.base_digest,
+        BaseBlob.digest.label("base_present")
+    ).outerjoin(
+        BaseBlob, BaseBlob.digest == ScanBlob.base_digest
+    ).filter(
+        ScanBlob.digest.in_(list(outputs))
+    ))).all()
+    intact = {row.digest for row in stored if row.base_digest is None or row.base_present is not None}
+    orphaned = {row.digest for row in stored} - intact
+
+    blobs = []
+    for digest, output in outputs.items():
+        if digest in intact:
+            continue
+        blob = await run_in_threadpool(_full_blob, digest, output.encode())
+        if digest in orphaned:
+            await db.execute(update(ScanBlob).where(ScanBlob.digest == digest).values(**blob))
+        else:
+            blobs.append(blob)
+    await insert_blobs(db, blobs)
+
+async def store_output(db: AsyncSession, output: str):
+    """Store tool output in the blob store and return (digest, raw size, stored size). The caller commits."""
+    digest, raw_size, stored_size, blob = await encode_output(db, output)
+    if blob is not None:
+        await insert_blobs(db, [blob])
+    return digest, raw_size, stored_size
+
+async def load_output(db: AsyncSession, scan_result: ScanResult):
+    """Get the full output of a scan, decompressing it from the blob store or its archive segment"""
+    if scan_result.archive_segment is not None:
+        codec, data = await run_in_threadpool(archive_store.read, scan_result.archive_segment, scan_result.id)
+        raw = await run_in_threadpool(decompress, codec, data)
+        return raw.decode()
+    if scan_result.result_digest is None:
+        return scan_result.result or ""
+
+    blob = (await db.execute(select(*BLOB_COLUMNS).outerjoin(
+        BaseBlob, BaseBlob.digest == ScanBlob.base_digest
+    ).filter(
+        ScanBlob.digest == scan_result.result_digest
+    ))).first()
+    if blob is None:
+        raise LookupError(f"Missing blob {scan_result.result_digest} for scan {scan_result.id}")
+    raw = await run_in_threadpool(decode_blob, blob)
+    return raw.decode()
+
+async def migrate_inline_results(batch_size: int = MIGRATION_BATCH_SIZE):
+    """Move output still stored inline in scan_results into the blob store, one batch per commit"""
+    migrated = 0
+    async with AsyncSessionLocal() as db:
+        while True:
+            rows = (await db.execute(select(ScanResult).filter(
+                ScanResult.result.isnot(None),
+                ScanResult.result_digest.is_(None)
+            ).order_by(ScanResult.id).limit(batch_size))).scalars().all()
+            if not rows:
+                break
+
+            for row in rows:
+                row.result_digest, row.result_size, row.stored_size = await store_output(db, row.result)
+                row.result = None
+            await db.commit()
+            migrated += len(rows)
+
+    if migrated:
+        logger.info("Moved %s inline scan outputs into the blob store", migrated)
+    return migrated
+
+async def storage_stats(db: AsyncSession):
+    """Summarize how much the blob store saves through compression and deduplication"""
+    scans, logical_bytes = (await db.execute(select(
+        func.count(ScanResult.id),
+        func.coalesce(func.sum(ScanResult.result_size), 0)
+    ).filter(
+        ScanResult.result_digest.isnot(None),
+        ScanResult.archive_segment.is_(None)
+    ))).one()
+    blobs, delta_blobs, unique_bytes, stored_bytes = (await db.execute(select(
+        func.count(ScanBlob.digest),
+        func.count(ScanBlob.base_digest),
+        func.coalesce(func.sum(ScanBlob.raw_size), 0),
+        func.coalesce(func.sum(ScanBlob.stored_size), 0)
+    ))).one()
+
+    return {
+        "scans": scans,
+        "blobs": blobs,
+        "delta_blobs": delta_blobs,
+        "logical_bytes": logical_bytes,
+        "unique_bytes": unique_bytes,
+        "stored_bytes": stored_bytes,
+        "compression_ratio": unique_bytes / stored_bytes if stored_bytes else 1.0,
+        "dedup_ratio": logical_bytes / unique_bytes if unique_bytes else 1.0,
+        "overall_ratio": logical_bytes / stored_bytes if stored_bytes else 1.0
+    }
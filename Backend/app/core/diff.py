@@ -0,0 +1,217 @@
+# app/core/diff.py
+import difflib
+from fastapi import HTTPException, status
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.database import ScanBlob, ScanResult
+from app.core.apikey import verify_api_key_exists
+from app.core.blobstore import decode_delta, load_output
+from app.core.findings import FINDING_MODELS
+
+DIFF_DEFAULT_CONTEXT = 3
+DIFF_MAX_CONTEXT = 20
+
+# Columns that identify a finding when comparing two scans
+FINDING_FIELDS = {
+    "port": ["host", "port", "protocol", "state", "service", "product", "version"],
+    "tls": ["host", "port", "protocol", "cipher", "bits", "status"],
+    "technology": ["host", "name", "version"]
+}
+
+def delta_opcodes(ops, base_length: int):
+    """
+    difflib-style opcodes from a keyframe to the output of a delta stored
+    against it, or None if the delta copies base lines out of order.
+    """
+    opcodes = []
+    i = j = inserted = 0
+    # The sentinel copy flushes a change at the end of the output
+    for op in ops + [[base_length, base_length]]:
+        if not isinstance(op[0], int):
+            inserted += len(op)
+            continue
+        start, end = op
+        if start < i:
+            return None
+        if start > i or inserted:
+            tag = "replace" if start > i and inserted else "delete" if start > i else "insert"
+            opcodes.append((tag, i, start, j, j + inserted))
+            j += inserted
+            inserted = 0
+        if end > start:
+            opcodes.append(("equal", start, end, j, j + end - start))
+            j += end - start
+        i = end
+    return opcodes
+
+def reverse_opcodes(opcodes):
+    """Opcodes for the opposite direction"""
+    swapped = {"insert": "delete", "delete": "insert"}
+    return [(swapped.get(tag, tag), j1, j2, i1, i2) for tag, i1, i2, j1, j2 in opcodes]
+
+def build_hunks(opcodes, from_lines, to_lines, context: int):
+    """
+    Group changes into hunks with up to context unchanged lines around them,
+    as in a unified diff. Changes closer than twice the context share a hunk.
+    """
+    groups = []
+    for change in opcodes:
+        if change[0] == "equal":
+            continue
+        if groups and change[1] - groups[-1][-1][2] <= 2 * context:
+            groups[-1].append(change)
+        else:
+            groups.append([change])
+
+    hunks = []
+    for group in groups:
+        _, first_i, _, first_j, _ = group[0]
+        _, _, last_i, _, last_j = group[-1]
+        before = min(context, first_i)
+        after = min(context, len(from_lines) - last_i)
+
+        lines = [" " + line for line in from_lines[first_i - before:first_i]]
+        previous = first_i
+        for _, i1, i2, j1, j2 in group:
+            lines += [" " + line for line in from_lines[previous:i1]]
+            lines += ["-" + line for line in from_lines[i1:i2]]
+            lines += ["+" + line for line in to_lines[j1:j2]]
+            previous = i2
+        lines += [" " + line for line in from_lines[last_i:last_i + after]]
+
+        hunks.append({
+            "from_start": first_i - before + 1,
+            "from_lines": last_i + after - (first_i - before),
+            "to_start": first_j - before + 1,
+            "to_lines": last_j + after - (first_j - before),
+            "lines": lines
+        })
+    return hunks
+
+def _match_lines(from_lines, to_lines):
+    return difflib.SequenceMatcher(None, from_lines, to_lines).get_opcodes()
+
+async def _stored_delta(db: AsyncSession, scan: ScanResult):
+    """(keyframe digest, delta ops) if the scan's output is stored as a delta, else None"""
+    if scan.archive_segment is not None or scan.result_digest is None:
+        return None
+    blob = (await db.execute(select(ScanBlob.codec, ScanBlob.data, ScanBlob.base_digest).filter(
+        ScanBlob.digest == scan.result_digest,
+        ScanBlob.base_digest.isnot(None)
+    ))).first()
+    if blob is None:
+        return None
+    return blob.base_digest, await run_in_threadpool(decode_delta, blob.codec, blob.data)
+
+async def _line_opcodes(db: AsyncSession, from_scan: ScanResult, to_scan: ScanResult, from_lines, to_lines):
+    """
+    Opcodes from one output to the other. When one scan is stored as a delta
+    against the other, the stored delta already is the diff; otherwise the
+    lines are matched in the threadpool.
+    """
+    to_delta = await _stored_delta(db, to_scan)
+    if to_delta is not None and to_delta[0] == from_scan.result_digest:
+        opcodes = delta_opcodes(to_delta[1], len(from_lines))
+        if opcodes is not None:
+            return opcodes
+    from_delta = await _stored_delta(db, from_scan)
+    if from_delta is not None and from_delta[0] == to_scan.result_digest:
+        opcodes = delta_opcodes(from_delta[1], len(to_lines))
+        if opcodes is not None:
+            return reverse_opcodes(opcodes)
+    return await run_in_threadpool(_match_lines, from_lines, to_lines)
+
+async def _findings_diff(db: AsyncSession, from_scan: ScanResult, to_scan: ScanResult):
+    """Findings added and removed between two scans, for each kind either scan has"""
+    diff = {}
+    for kind, model in FINDING_MODELS.items():
+        fields = FINDING_FIELDS[kind]
+        rows = (await db.execute(select(
+            model.scan_id, *[getattr(model, field) for field in fields]
+        ).filter(model.scan_id.in_([from_scan.id, to_scan.id])))).all()
+        if not rows:
+            continue
+        before = {tuple(row[1:]) for row in rows if row.scan_id == from_scan.id}
+        after = {tuple(row[1:]) for row in rows if row.scan_id == to_scan.id}
+        diff[kind] = {
+            "added": [dict(zip(fields, finding)) for finding in sorted(after - before, key=repr)],
+            "removed": [dict(zip(fields, finding)) for finding in sorted(before - after, key=repr)]
+        }
+    return diff
+
+def _scan_summary(scan: ScanResult):
+    return {
+        "id": scan.id,
+        "domain": scan.domain,
+        "tool": scan.tool,
+        "scan_time": scan.scan_time,
+        "status": scan.status
+    }
+
+async def diff_scans(api_key: str, from_id: int, to_id: int, db: AsyncSession, context: int = DIFF_DEFAULT_CONTEXT):
+    """
+    Compare the output of two scans of the same tool and domain owned by an
+    API key: changed lines grouped into hunks, plus the parsed findings added
+    and removed for tools that produce them.
+    """
+    await verify_api_key_exists(api_key, db)
+    context = max(0, min(context, DIFF_MAX_CONTEXT))
+
+    scans = {scan.id: scan for scan in (await db.execute(select(ScanResult).filter(
+        ScanResult.id.in_([from_id, to_id]),
+        ScanResult.apikey == api_key
+    ))).scalars()}
+    if from_id not in scans or to_id not in scans:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Scan result not found or you don't have permission to access it"
+        )
+    from_scan, to_scan = scans[from_id], scans[to_id]
+    if from_scan.tool != to_scan.tool or from_scan.domain != to_scan.domain:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Only scans of the same tool and domain can be compared"
+        )
+
+    hunks = []
+    if from_scan.result_digest is None or from_scan.result_digest != to_scan.result_digest:
+        from_text = await load_output(db, from_scan)
+        to_text = await load_output(db, to_scan)
+        # Lines are matched with their endings, as deltas are, and shown without
+        opcodes = await _line_opcodes(
+            db, from_scan, to_scan, from_text.splitlines(keepends=True), to_text.splitlines(keepends=True)
+        )
+        hunks = build_hunks(opcodes, from_text.splitlines(), to_text.splitlines(), context)
+
+    return {
+        "tool": from_scan.tool,
+        "domain": from_scan.domain,
+        "from_scan": _scan_summary(from_scan),
+        "to_scan": _scan_summary(to_scan),
+        "identical": not hunks,
+        "added_lines": sum(1 for hunk in hunks for line in hunk["lines"] if line.startswith("+")),
+        "removed_lines": sum(1 for hunk in hunks for line in hunk["lines"] if line.startswith("-")),
+        "hunks": hunks,
+        "findings": await _findings_diff(db, from_scan, to_scan)
+    }
+
+def _unified_range(start: int, length: int):
+    if length == 1:
+        return str(start)
+    return f"{start - 1 if length == 0 else start},{length}"
+
+def unified_diff(diff: dict):
+    """Render a diff_scans() result as unified diff text"""
+    lines = [
+        f"--- scan {diff['from_scan']['id']} {diff['from_scan']['scan_time'].isoformat()}",
+        f"+++ scan {diff['to_scan']['id']} {diff['to_scan']['scan_time'].isoformat()}"
+    ]
+    for hunk in diff["hunks"]:
+        lines.append(
+            f"@@ -{_unified_range(hunk['from_start'], hunk['from_lines'])} "
+            f"+{_unified_range(hunk['to_start'], hunk['to_lines'])} @@"
+        )
+        lines.extend(hunk["lines"])
+    return "\n".join(lines) + "\n"
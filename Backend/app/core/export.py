@@ -0,0 +1,156 @@
+# app/core/export.py
+import csv
+import io
+import json
+import zlib
+from datetime import datetime
+from typing import Optional
+from fastapi import HTTPException, status
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import select
+
+from app.database import AsyncSessionLocal, ScanResult
+from app.core.archive import archive_store
+from app.core.blobstore import BLOB_COLUMNS, decode_blob, decompress, join_blobs
+
+EXPORT_FORMATS = {"ndjson": "application/x-ndjson", "csv": "text/csv"}
+EXPORT_FIELDS = ["id", "domain", "tool", "scan_time", "status", "pipeline_id", "pipeline_stage", "result_size"]
+# Rows fetched per round trip; with outputs, a batch also bounds the decompressed text held at once
+EXPORT_BATCH_SIZE = 1000
+EXPORT_OUTPUT_BATCH_SIZE = 100
+GZIP_LEVEL = 6
+
+def validate_export_format(export_format: str):
+    if export_format not in EXPORT_FORMATS:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Export format must be one of: {', '.join(EXPORT_FORMATS)}"
+        )
+    return EXPORT_FORMATS[export_format]
+
+class ExportEncoder:
+    """
+    Encodes batches of history rows as NDJSON or CSV bytes, optionally
+    gzip-compressed as one continuous stream.
+    """
+
+    def __init__(self, export_format: str, include_output: bool, gzip: bool):
+        self.export_format = export_format
+        self.fields = EXPORT_FIELDS + ["result"] if include_output else EXPORT_FIELDS
+        self.include_output = include_output
+        # wbits=31 writes a gzip header and trailer around the deflate stream
+        self._compressor = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 31) if gzip else None
+        self._decoded = {}  # digest -> output, reset every batch
+
+    def _record(self, row):
+        record = {
+            "id": row.id,
+            "domain": row.domain,
+            "tool": row.tool,
+            "scan_time": row.scan_time.isoformat() if row.scan_time else None,
+            "status": row.status,
+            "pipeline_id": row.pipeline_id,
+            "pipeline_stage": row.pipeline_stage,
+            "result_size": row.result_size
+        }
+        if self.include_output:
+            if row.archive_segment is not None:
+                record["result"] = decompress(*archive_store.read(row.archive_segment, row.id)).decode(errors="replace")
+            elif row.data is None:
+                record["result"] = row.result or ""
+            else:
+                # Identical outputs share a blob; decompress it once per batch
+                if row.result_digest not in self._decoded:
+                    self._decoded[row.result_digest] = decode_blob(row).decode(errors="replace")
+                record["result"] = self._decoded[row.result_digest]
+        return record
+
+    def _compress(self, data: bytes):
+        if self._compressor is None:
+            return data
+        return self._compressor.compress(data)
+
+    def header(self):
+        if self.export_format != "csv":
+            return b""
+        return self._compress((",".join(self.fields) + "\r\n").encode())
+
+    def encode(self, rows):
+        """Encode one batch of rows; runs in the threadpool"""
+        self._decoded = {}
+        if self.export_format == "csv":
+            buffer = io.StringIO()
+            writer = csv.DictWriter(buffer, fieldnames=self.fields)
+            writer.writerows(self._record(row) for row in rows)
+            text = buffer.getvalue()
+        else:
+            text = "".join(json.dumps(self._record(row)) + "\n" for row in rows)
+        self._decoded = {}
+        return self._compress(text.encode())
+
+    def finish(self):
+        if self._compressor is None:
+            return b""
+        return self._compressor.flush()
+
+def export_query(api_key: str, include_output: bool, tool: Optional[str] = None, domain: Optional[str] = None,
+                 since: Optional[datetime] = None, until: Optional[datetime] = None):
+    """Oldest-first history of an API key as plain rows, never ORM objects"""
+    columns = [
+        ScanResult.id,
+        ScanResult.domain,
+        ScanResult.tool,
+        ScanResult.scan_time,
+        ScanResult.status,
+        ScanResult.pipeline_id,
+        ScanResult.pipeline_stage,
+        ScanResult.result_size
+    ]
+    if include_output:
+        columns += [
+            ScanResult.result,
+            ScanResult.result_digest,
+            ScanResult.archive_segment,
+            *BLOB_COLUMNS
+        ]
+    query = select(*columns).filter(ScanResult.apikey == api_key)
+    if include_output:
+        query = join_blobs(query)
+    if tool is not None:
+        query = query.filter(ScanResult.tool == tool)
+    if domain is not None:
+        query = query.filter(ScanResult.domain == domain)
+    if since is not None:
+        query = query.filter(ScanResult.scan_time >= since)
+    if until is not None:
+        query = query.filter(ScanResult.scan_time < until)
+    return query.order_by(ScanResult.scan_time, ScanResult.id)
+
+async def export_scan_history(api_key: str, export_format: str, include_output: bool = False,
+                              gzip: bool = False, **filters):
+    """
+    Yield an API key's scan history as NDJSON or CSV chunks.
+
+    Rows are read through a server-side cursor in fixed-size batches and each
+    batch is encoded (and compressed) in the threadpool before the next is
+    fetched, so memory stays constant however many scans are exported. The
+    caller verifies the API key first.
+    """
+    encoder = ExportEncoder(export_format, include_output, gzip)
+    batch_size = EXPORT_OUTPUT_BATCH_SIZE if include_output else EXPORT_BATCH_SIZE
+
+    header = encoder.header()
+    if header:
+        yield header
+    # The stream outlives the request's session, so it reads through its own
+    async with AsyncSessionLocal() as db:
+        result = await db.stream(
+            export_query(api_key, include_output, **filters).execution_options(yield_per=batch_size)
+        )
+        async for rows in result.partitions():
+            chunk = await run_in_threadpool(encoder.encode, rows)
+            if chunk:
+                yield chunk
+    tail = encoder.finish()
+    if tail:
+        yield tail
@@ -0,0 +1,186 @@
+# app/core/findings.py
+import json
+import logging
+from typing import Optional
+from urllib.parse import urlparse
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.database import ScanPort, ScanTLS, ScanTechnology
+from app.core.apikey import verify_api_key_exists
+from app.utils.pagination import encode_cursor, decode_cursor
+
+try:
+    from defusedxml.ElementTree import fromstring as parse_xml
+except ImportError:  # defusedxml is optional; expat already refuses external entities
+    from xml.etree.ElementTree import fromstring as parse_xml
+
+logger = logging.getLogger(__name__)
+
+MAX_REPORT_BYTES = 16 * 1024 * 1024
+MAX_FINDINGS_PER_SCAN = 10000
+FINDINGS_MAX_PAGE_SIZE = 500
+
+# whatweb plugins that describe the response rather than a technology
+WHATWEB_IGNORED_PLUGINS = {"country", "ip", "title", "redirectlocation", "uncommonheaders", "email", "meta-author"}
+
+def _tls_protocol(protocol_type: str, version: str):
+    """Normalize sslscan protocol names to the 'TLSv1.2' / 'SSLv3' form used in cipher elements"""
+    return f"{protocol_type.upper()}v{version}"
+
+def parse_nmap_xml(report: bytes, domain: str):
+    """Port/service findings from nmap -oX output"""
+    findings = []
+    for host in parse_xml(report).iter("host"):
+        hostnames = [hostname.get("name") for hostname in host.iter("hostname")]
+        address = host.find("address")
+        host_name = (hostnames[0] if hostnames else None) or (address.get("addr") if address is not None else domain)
+        for port in host.iter("port"):
+            state = port.find("state")
+            service = port.find("service")
+            findings.append(("port", {
+                "host": host_name.lower(),
+                "port": int(port.get("portid")),
+                "protocol": port.get("protocol"),
+                "state": state.get("state") if state is not None else "unknown",
+                "service": service.get("name") if service is not None else None,
+                "product": service.get("product") if service is not None else None,
+                "version": service.get("version") if service is not None else None
+            }))
+    return findings
+
+def parse_sslscan_xml(report: bytes, domain: str):
+    """Protocol and cipher findings from sslscan --xml output"""
+    findings = []
+    for test in parse_xml(report).iter("ssltest"):
+        host = (test.get("sniname") or test.get("host") or domain).lower()
+        port = int(test.get("port") or 443)
+        for protocol in test.iter("protocol"):
+            if protocol.get("enabled") == "1":
+                findings.append(("tls", {
+                    "host": host,
+                    "port": port,
+                    "protocol": _tls_protocol(protocol.get("type", "tls"), protocol.get("version", "")),
+                    "cipher": None,
+                    "bits": None,
+                    "status": "enabled"
+                }))
+        for cipher in test.iter("cipher"):
+            findings.append(("tls", {
+                "host": host,
+                "port": port,
+                "protocol": cipher.get("sslversion"),
+                "cipher": cipher.get("cipher"),
+                "bits": int(cipher.get("bits")) if cipher.get("bits", "").isdigit() else None,
+                "status": cipher.get("status", "accepted")
+            }))
+    return findings
+
+def parse_whatweb_json(report: bytes, domain: str):
+    """Technology/version findings from whatweb --log-json output"""
+    findings = []
+    for target in json.loads(report):
+        # whatweb terminates its JSON array with an empty object
+        if not target or "plugins" not in target:
+            continue
+        host = (urlparse(target.get("target", "")).hostname or domain).lower()
+        for name, plugin in target["plugins"].items():
+            if name.lower() in WHATWEB_IGNORED_PLUGINS:
+                continue
+            versions = plugin.get("version") or [None]
+            for version in versions:
+                findings.append(("technology", {"host": host, "name": name.lower(), "version": version}))
+    return findings
+
+REPORT_PARSERS = {
+    "nmap_xml": parse_nmap_xml,
+    "sslscan_xml": parse_sslscan_xml,
+    "whatweb_json": parse_whatweb_json
+}
+
+def parse_report(report_format: str, report: Optional[bytes], domain: str):
+    """
+    Parse a tool's structured report into a list of (kind, fields) findings.
+    A missing or malformed report yields no findings rather than failing the scan.
+    """
+    if not report:
+        return []
+    try:
+        findings = REPORT_PARSERS[report_format](report, domain)
+    except Exception:
+        logger.warning("Could not parse %s report for %s", report_format, domain, exc_info=True)
+        return []
+    return findings[:MAX_FINDINGS_PER_SCAN]
+
+async def parse_findings(report_format: Optional[str], report: Optional[bytes], domain: str):
+    """parse_report in the threadpool"""
+    if report_format is None or not report:
+        return []
+    return await run_in_threadpool(parse_report, report_format, report, domain)
+
+FINDING_MODELS = {"port": ScanPort, "tls": ScanTLS, "technology": ScanTechnology}
+
+def attach_findings(scan_result, findings):
+    """Add finding rows to a new scan result so they are inserted with it"""
+    collections = {"port": scan_result.ports, "tls": scan_result.tls_findings, "technology": scan_result.technologies}
+    for kind, fields in findings:
+        collections[kind].append(FINDING_MODELS[kind](apikey=scan_result.apikey, **fields))
+
+async def _findings_page(model, filters, api_key: str, db: AsyncSession, limit: int, cursor: Optional[str]):
+    """A newest-first keyset page of findings of one kind; returns (rows, next cursor)"""
+    await verify_api_key_exists(api_key, db)
+    limit = max(1, min(limit, FINDINGS_MAX_PAGE_SIZE))
+
+    query = select(model).filter(model.apikey == api_key, *filters)
+    if cursor is not None:
+        (finding_id,) = decode_cursor(cursor, int)
+        query = query.filter(model.id < finding_id)
+    rows = (await db.execute(query.order_by(model.id.desc()).limit(limit + 1))).scalars().all()
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(rows[-1].id)
+    return rows, next_cursor
+
+async def get_port_findings(api_key: str, db: AsyncSession, port: Optional[int] = None,
+                            service: Optional[str] = None, state: Optional[str] = "open",
+                            host: Optional[str] = None, limit: int = 100, cursor: Optional[str] = None):
+    """Port/service findings for an API key, e.g. every host with port 3306 open"""
+    filters = []
+    if port is not None:
+        filters.append(ScanPort.port == port)
+    if state is not None:
+        filters.append(ScanPort.state == state)
+    if service is not None:
+        filters.append(ScanPort.service == service.lower())
+    if host is not None:
+        filters.append(ScanPort.host == host.lower())
+    return await _findings_page(ScanPort, filters, api_key, db, limit, cursor)
+
+async def get_tls_findings(api_key: str, db: AsyncSession, protocol: Optional[str] = None,
+                           cipher: Optional[str] = None, host: Optional[str] = None,
+                           limit: int = 100, cursor: Optional[str] = None):
+    """TLS protocol/cipher findings for an API key, e.g. every host accepting TLSv1.0"""
+    filters = []
+    if protocol is not None:
+        filters.append(ScanTLS.protocol == protocol)
+    if cipher is not None:
+        filters.append(ScanTLS.cipher == cipher)
+    if host is not None:
+        filters.append(ScanTLS.host == host.lower())
+    return await _findings_page(ScanTLS, filters, api_key, db, limit, cursor)
+
+async def get_technology_findings(api_key: str, db: AsyncSession, name: Optional[str] = None,
+                                  version: Optional[str] = None, host: Optional[str] = None,
+                                  limit: int = 100, cursor: Optional[str] = None):
+    """Technology/version findings for an API key, e.g. every host running WordPress"""
+    filters = []
+    if name is not None:
+        filters.append(ScanTechnology.name == name.lower())
+    if version is not None:
+        filters.append(ScanTechnology.version == version)
+    if host is not None:
+        filters.append(ScanTechnology.host == host.lower())
+    return await _findings_page(ScanTechnology, filters, api_key, db, limit, cursor)
@@ -0,0 +1,216 @@
+# app/core/jobs.py
+import asyncio
+import logging
+from datetime import datetime, timedelta
+from fastapi import HTTPException, status
+from sqlalchemy import select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.config import settings
+from app.database import AsyncSessionLocal, ScanJob
+from app.core.apikey import authenticate_api_key, verify_api_key_exists
+from app.core.scanner import SCAN_TIMEOUT, SCANNER_TOOLS, get_scanner_tool, perform_scan
+
+logger = logging.getLogger(__name__)
+
+JOB_QUEUED = "queued"
+JOB_RUNNING = "running"
+JOB_DONE = "done"
+JOB_FAILED = "failed"
+
+# A running job not finished this long after it started belongs to a worker process that died
+JOB_STALE_AFTER = timedelta(seconds=SCAN_TIMEOUT + 60)
+JOB_RECOVERY_INTERVAL = 60  # seconds between sweeps for stale jobs
+JOBS_MAX_PAGE_SIZE = 100
+
+class JobQueue:
+    """
+    SQLite-backed scan job queue.
+
+    The scan_jobs table is the source of truth; the in-memory queues only hold
+    job ids. Each tool has its own queue drained by as many workers as its
+    concurrency cap, and a global semaphore bounds the total number of tools
+    running at once. Queued jobs are picked up again on start, and jobs
+    left running by a process that died are re-queued once they are stale.
+    Several worker processes can share the table: a job is claimed with a
+    compare-and-set update, so only one of them runs it.
+    """
+
+    def __init__(self, max_workers: int, tool_limits: dict, default_tool_limit: int):
+        self.max_workers = max_workers
+        self.tool_limits = tool_limits
+        self.default_tool_limit = default_tool_limit
+        self._queues = {}
+        self._workers = []
+        self._recovery = None
+        self._slots = None
+
+    def tool_limit(self, tool_name: str):
+        return self.tool_limits.get(tool_name, self.default_tool_limit)
+
+    async def start(self):
+        """Recover unfinished jobs and start the worker pool"""
+        self._slots = asyncio.Semaphore(self.max_workers)
+        for tool_name in SCANNER_TOOLS:
+            self._queues[tool_name] = asyncio.Queue()
+            for _ in range(self.tool_limit(tool_name)):
+                self._workers.append(asyncio.create_task(self._worker(tool_name)))
+
+        for job_id, tool_name in await _recover_jobs():
+            self._put(job_id, tool_name)
+        self._recovery = asyncio.create_task(self._recover_stale())
+
+    async def stop(self):
+        """Stop the worker pool; interrupted jobs are resumed once they are stale"""
+        tasks = self._workers + ([self._recovery] if self._recovery else [])
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._workers = []
+        self._recovery = None
+        self._queues = {}
+
+    async def _recover_stale(self):
+        """Periodically re-queue jobs whose worker process died mid-run"""
+        while True:
+            await asyncio.sleep(JOB_RECOVERY_INTERVAL)
+            try:
+                for job_id, tool_name in await _requeue_stale_jobs():
+                    self._put(job_id, tool_name)
+            except Exception:
+                logger.exception("Recovering stale scan jobs failed")
+
+    def _put(self, job_id: int, tool_name: str):
+        queue = self._queues.get(tool_name)
+        if queue is None:
+            logger.warning("Scan job %s references unknown tool '%s'", job_id, tool_name)
+            return
+        queue.put_nowait(job_id)
+
+    async def submit(self, tool_name: str, domain: str, api_key: str, db: AsyncSession):
+        """Authenticate the API key, persist a new job and queue it for execution"""
+        tool = get_scanner_tool(tool_name)
+        await authenticate_api_key(api_key, db, cost=tool.cost)
+        job = await _create_job(db, tool_name, domain, api_key)
+        self._put(job.id, tool_name)
+        return job
+
+    async def _worker(self, tool_name: str):
+        queue = self._queues[tool_name]
+        while True:
+            job_id = await queue.get()
+            try:
+                async with self._slots:
+                    await self._run_job(job_id)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Scan job %s crashed", job_id)
+            finally:
+                queue.task_done()
+
+    async def _run_job(self, job_id: int):
+        async with AsyncSessionLocal() as db:
+            job = await _mark_running(db, job_id)
+            if job is None:
+                return
+
+            try:
+                scan_result, _, _ = await perform_scan(
+                    SCANNER_TOOLS[job.tool], job.domain, job.apikey, db
+                )
+            except HTTPException as e:
+                await _mark_finished(db, job, JOB_FAILED, None, e.detail)
+            else:
+                await _mark_finished(db, job, JOB_DONE, scan_result.id, None)
+
+async def _reset_stale_jobs(db: AsyncSession):
+    """
+    Reset running jobs that started too long ago to still be running and
+    return their (id, tool). Jobs running in other live worker processes are
+    left alone.
+    """
+    stale = (await db.execute(select(ScanJob.id, ScanJob.tool).filter(
+        ScanJob.status == JOB_RUNNING,
+        ScanJob.started_at < datetime.utcnow() - JOB_STALE_AFTER
+    ).order_by(ScanJob.id))).all()
+    if stale:
+        await db.execute(update(ScanJob).where(
+            ScanJob.id.in_([job_id for job_id, _ in stale]),
+            ScanJob.status == JOB_RUNNING
+        ).values(status=JOB_QUEUED, started_at=None))
+        await db.commit()
+    return stale
+
+async def _recover_jobs():
+    """Reset stale running jobs to queued and return every queued job in submission order"""
+    async with AsyncSessionLocal() as db:
+        await _reset_stale_jobs(db)
+        return (await db.execute(
+            select(ScanJob.id, ScanJob.tool).filter(
+                ScanJob.status == JOB_QUEUED
+            ).order_by(ScanJob.id)
+        )).all()
+
+async def _requeue_stale_jobs():
+    async with AsyncSessionLocal() as db:
+        return await _reset_stale_jobs(db)
+
+async def _create_job(db: AsyncSession, tool_name: str, domain: str, api_key: str):
+    job = ScanJob(apikey=api_key, domain=domain, tool=tool_name, status=JOB_QUEUED)
+    db.add(job)
+    await db.commit()
+    await db.refresh(job)
+    return job
+
+async def _mark_running(db: AsyncSession, job_id: int):
+    """Claim a queued job; returns None if it is gone or another worker claimed it first"""
+    claimed = (await db.execute(update(ScanJob).where(
+        ScanJob.id == job_id,
+        ScanJob.status == JOB_QUEUED
+    ).values(status=JOB_RUNNING, started_at=datetime.utcnow()))).rowcount
+    await db.commit()
+    if not claimed:
+        return None
+    return await db.get(ScanJob, job_id)
+
+async def _mark_finished(db: AsyncSession, job: ScanJob, job_status: str, scan_result_id, error):
+    job.status = job_status
+    job.scan_result_id = scan_result_id
+    job.error = error
+    job.finished_at = datetime.utcnow()
+    await db.commit()
+
+async def get_job(job_id: int, api_key: str, db: AsyncSession):
+    """Get a scan job owned by an API key"""
+    await verify_api_key_exists(api_key, db)
+
+    job = (await db.execute(select(ScanJob).filter(
+        ScanJob.id == job_id,
+        ScanJob.apikey == api_key
+    ))).scalars().first()
+
+    if not job:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Scan job not found or you don't have permission to access it"
+        )
+
+    return job
+
+async def get_jobs(api_key: str, db: AsyncSession, limit: int = 20):
+    """Get the most recent scan jobs for an API key"""
+    await verify_api_key_exists(api_key, db)
+    limit = max(1, min(limit, JOBS_MAX_PAGE_SIZE))
+
+    return (await db.execute(select(ScanJob).filter(
+        ScanJob.apikey == api_key
+    ).order_by(
+        ScanJob.id.desc()
+    ).limit(limit))).scalars().all()
+
+job_queue = JobQueue(
+    max_workers=settings.SCAN_JOB_WORKERS,
+    tool_limits=settings.SCAN_JOB_TOOL_LIMITS,
+    default_tool_limit=settings.SCAN_JOB_DEFAULT_TOOL_LIMIT
+)
@@ -0,0 +1,181 @@
+# app/core/metrics.py
+import time
+from bisect import bisect_left
+from contextvars import ContextVar
+from sqlalchemy import event
+
+METRIC_PREFIX = "linuxoverapi_"
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+TOOL_DURATION_BUCKETS = (0.1, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)
+BYTES_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216)
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+
+# Metrics are plain dicts updated without locks: nearly every update happens on
+# the event loop thread, and a scrape only reads them.
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+def _format_labels(names, values, extra=()):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    pairs.extend(f'{name}="{_escape(value)}"' for name, value in extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return str(value)
+
+class Metric:
+    kind = None
+
+    def __init__(self, name: str, help_text: str, labels=()):
+        self.name = METRIC_PREFIX + name
+        self.help_text = help_text
+        self.labels = tuple(labels)
+        self._series = {}
+
+    def header(self):
+        return [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} {self.kind}"]
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, *label_values, amount=1):
+        self._series[label_values] = self._series.get(label_values, 0) + amount
+
+    def render(self):
+        lines = self.header()
+        for label_values, value in list(self._series.items()):
+            lines.append(f"{self.name}{_format_labels(self.labels, label_values)} {_format_value(value)}")
+        return lines
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def dec(self, *label_values, amount=1):
+        self.inc(*label_values, amount=-amount)
+
+    def set(self, value, *label_values):
+        self._series[label_values] = value
+
+class Histogram(Metric):
+    """Fixed-bucket histogram; per series: one count per bucket plus +Inf, then sum and count"""
+    kind = "histogram"
+
+    def __init__(self, name: str, help_text: str, labels=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, help_text, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, *label_values):
+        series = self._series.get(label_values)
+        if series is None:
+            series = self._series.setdefault(label_values, [0] * (len(self.buckets) + 1) + [0.0, 0])
+        series[bisect_left(self.buckets, value)] += 1
+        series[-2] += value
+        series[-1] += 1
+
+    def render(self):
+        lines = self.header()
+        for label_values, series in list(self._series.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), series):
+                cumulative += count
+                labels = _format_labels(self.labels, label_values, [("le", _format_value(float(bound)))])
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.labels, label_values)
+            lines.append(f"{self.name}_sum{labels} {_format_value(series[-2])}")
+            lines.append(f"{self.name}_count{labels} {series[-1]}")
+        return lines
+
+# Scanning tools
+TOOL_DURATION = Histogram("tool_duration_seconds", "Scanning tool run time", ["tool"], TOOL_DURATION_BUCKETS)
+TOOL_EXITS = Counter("tool_exits_total", "Scanning tool runs by exit code", ["tool", "code"])
+TOOL_OUTPUT_BYTES = Histogram("tool_output_bytes", "Scanning tool stdout size", ["tool"], BYTES_BUCKETS)
+TOOL_TIMEOUTS = Counter("tool_timeouts_total", "Scanning tool runs killed on timeout", ["tool"])
+TOOLS_IN_FLIGHT = Gauge("tool_runs_in_flight", "Scanning tool processes currently running", ["tool"])
+
+# HTTP
+REQUEST_DURATION = Histogram(
+    "http_request_duration_seconds", "Time to response start per route", ["method", "route", "status"]
+)
+REQUEST_DB_QUERIES = Histogram(
+    "http_request_db_queries", "Database queries issued per request", ["route"], COUNT_BUCKETS
+)
+
+# Database
+DB_QUERY_DURATION = Histogram("db_query_duration_seconds", "Database statement execution time")
+
+def route_label(scope):
+    """The route template of a request, including router prefixes, or 'unmatched'"""
+    route = scope.get("route")
+    if route is None:
+        return "unmatched"
+    # Depending on the FastAPI version, route.path may not include the router prefix;
+    # recover the prefix from the concrete path
+    concrete = route.path
+    for name, value in scope.get("path_params", {}).items():
+        concrete = concrete.replace("{" + name + "}", str(value))
+    path = scope["path"]
+    if path.endswith(concrete):
+        return path[:len(path) - len(concrete)] + route.path
+    return route.path
+
+_request_queries = ContextVar("request_queries", default=None)
+
+def start_request_queries():
+    """Count database queries made by the current request; returns a token for reset_request_queries"""
+    counter = [0]
+    return counter, _request_queries.set(counter)
+
+def reset_request_queries(token):
+    _request_queries.reset(token)
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_start_time", []).append(time.perf_counter())
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    DB_QUERY_DURATION.observe(time.perf_counter() - conn.info["query_start_time"].pop())
+    counter = _request_queries.get()
+    if counter is not None:
+        counter[0] += 1
+
+def instrument_engine(sync_engine):
+    """Time every statement run on an engine (pass async_engine.sync_engine for the async engine)"""
+    event.listen(sync_engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(sync_engine, "after_cursor_execute", _after_cursor_execute)
+
+def _stats_gauges(name: str, stats: dict):
+    lines = []
+    for key, value in stats.items():
+        if isinstance(value, bool) or not isinstance(value, (int, float)):
+            continue
+        metric = f"{METRIC_PREFIX}{name}_{key}"
+        lines.append(f"# TYPE {metric} gauge")
+        lines.append(f"{metric} {_format_value(value)}")
+    return lines
+
+METRICS = [
+    TOOL_DURATION,
+    TOOL_EXITS,
+    TOOL_OUTPUT_BYTES,
+    TOOL_TIMEOUTS,
+    TOOLS_IN_FLIGHT,
+    REQUEST_DURATION,
+    REQUEST_DB_QUERIES,
+    DB_QUERY_DURATION
+]
+
+def render_metrics(stats: dict):
+    """
+    Render all metrics in the Prometheus text format. stats maps a name to a
+    component's stats() dict (caches, rate limiter, ...), exported as gauges.
+    """
+    lines = []
+    for metric in METRICS:
+        lines.extend(metric.render())
+    for name, component_stats in stats.items():
+        lines.extend(_stats_gauges(name, component_stats))
+    return "\n".join(lines) + "\n"
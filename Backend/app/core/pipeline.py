@@ -0,0 +1,186 @@
+# app/core/pipeline.py
+import asyncio
+import json
+from datetime import datetime
+from typing import List
+from fastapi import HTTPException, status
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import selectinload
+
+from app.config import settings
+from app.database import AsyncSessionLocal, PipelineRun
+from app.core.apikey import authenticate_api_key, verify_api_key_exists
+from app.core.scanner import get_scanner_tool, perform_scan
+from app.utils.validators import validate_domain
+
+def validate_pipeline(stages: List):
+    """Check that stages form a DAG of known tools, each fed by an earlier stage"""
+    if not stages:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="A pipeline needs at least one stage"
+        )
+    if len(stages) > settings.PIPELINE_MAX_STAGES:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"A pipeline can have at most {settings.PIPELINE_MAX_STAGES} stages"
+        )
+
+    seen = set()
+    for stage in stages:
+        get_scanner_tool(stage.tool)
+        if stage.id in seen:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=f"Duplicate stage id '{stage.id}'"
+            )
+        # Requiring parents to be declared first rules out cycles
+        if stage.after is not None and stage.after not in seen:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=f"Stage '{stage.id}' must come after stage '{stage.after}'"
+            )
+        seen.add(stage.id)
+
+def extract_targets(output: str):
+    """Get the unique hosts listed in a tool's output, one per line, in order"""
+    targets = []
+    for line in output.splitlines():
+        host = line.strip().lower().rstrip(".")
+        if host and host not in targets and validate_domain(host):
+            targets.append(host)
+            if len(targets) == settings.PIPELINE_MAX_FANOUT:
+                break
+    return targets
+
+async def create_pipeline_run(db: AsyncSession, api_key: str, domain: str, stages: List):
+    """Persist a new pipeline run"""
+    run = PipelineRun(
+        apikey=api_key,
+        domain=domain,
+        spec=json.dumps([stage.dict() for stage in stages]),
+        status="running"
+    )
+    db.add(run)
+    await db.commit()
+    return run
+
+async def _finish_pipeline_run(run_id: int, run_status: str, node_count: int, failed_count: int):
+    async with AsyncSessionLocal() as db:
+        run = await db.get(PipelineRun, run_id)
+        run.status = run_status
+        run.node_count = node_count
+        run.failed_count = failed_count
+        run.finished_at = datetime.utcnow()
+        await db.commit()
+
+async def _run_node(run_id: int, stage, domain: str, api_key: str):
+    """Run one stage against one target; returns (event, output or None on failure)"""
+    event = {"event": "node", "stage": stage.id, "tool": stage.tool, "domain": domain}
+    try:
+        tool = get_scanner_tool(stage.tool)
+        async with AsyncSessionLocal() as db:
+            await authenticate_api_key(api_key, db, cost=tool.cost)
+            scan_result, output, cached = await perform_scan(
+                tool, domain, api_key, db,
+                pipeline_id=run_id, pipeline_stage=stage.id
+            )
+    except HTTPException as e:
+        event.update({"status": "failed", "detail": e.detail})
+        return event, None
+
+    event.update({
+        "status": "done",
+        "scan_id": scan_result.id,
+        "scan_status": scan_result.status,
+        "cached": cached,
+        "output": output
+    })
+    return event, output
+
+async def run_pipeline(run_id: int, stages: List, domain: str, api_key: str, max_parallel: int):
+    """
+    Execute a pipeline and yield one event per node as it completes.
+
+    Root stages run against the requested domain; every other stage runs once
+    per host found in each output of the stage it comes after, as soon as that
+    output is available. At most max_parallel tools run at the same time.
+    """
+    children = {stage.id: [child for child in stages if child.after == stage.id] for stage in stages}
+    slots = asyncio.Semaphore(max_parallel)
+    events = asyncio.Queue()
+    tasks = set()
+    pending = 0
+    node_count = 0
+    failed_count = 0
+
+    def launch(stage, target):
+        nonlocal pending
+        pending += 1
+        task = asyncio.create_task(node(stage, target))
+        tasks.add(task)
+        task.add_done_callback(tasks.discard)
+
+    async def node(stage, target):
+        nonlocal pending
+        try:
+            async with slots:
+                event, output = await _run_node(run_id, stage, target, api_key)
+            if output is not None:
+                for child in children[stage.id]:
+                    for host in extract_targets(output):
+                        launch(child, host)
+            events.put_nowait(event)
+        finally:
+            pending -= 1
+            if pending == 0:
+                events.put_nowait(None)
+
+    run_status = "cancelled"
+    try:
+        for stage in stages:
+            if stage.after is None:
+                launch(stage, domain)
+
+        while True:
+            event = await events.get()
+            if event is None:
+                break
+            node_count += 1
+            if event["status"] == "failed":
+                failed_count += 1
+            yield event
+
+        run_status = "done"
+        yield {"event": "done", "pipeline_id": run_id, "nodes": node_count, "failed": failed_count}
+    finally:
+        # Stop outstanding nodes if the client goes away mid-pipeline
+        for task in list(tasks):
+            task.cancel()
+        await _finish_pipeline_run(run_id, run_status, node_count, failed_count)
+
+async def get_pipeline_run(pipeline_id: int, api_key: str, db: AsyncSession):
+    """Get a pipeline run and its scans for an API key"""
+    await verify_api_key_exists(api_key, db)
+
+    run = (await db.execute(select(PipelineRun).options(
+        selectinload(PipelineRun.scans)
+    ).filter(
+        PipelineRun.id == pipeline_id,
+        PipelineRun.apikey == api_key
+    ))).scalars().first()
+
+    if not run:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Pipeline run not found or you don't have permission to access it"
+        )
+
+    return run
+
+def pipeline_parallelism(requested):
+    """Clamp the requested parallelism to the configured maximum"""
+    if not requested or requested < 1:
+        return settings.PIPELINE_MAX_PARALLEL
+    return min(requested, settings.PIPELINE_MAX_PARALLEL)
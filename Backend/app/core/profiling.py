@@ -0,0 +1,204 @@
+# app/core/profiling.py
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import nullcontext
+from contextvars import ContextVar
+from datetime import datetime
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import event
+
+from app.config import settings
+
+logger = logging.getLogger("app.slow_requests")
+
+MAX_RECORDED_STATEMENTS = 200
+STATEMENT_PREVIEW_CHARS = 300
+
+class RequestProfile:
+    """Spans recorded for one profiled request"""
+
+    def __init__(self, method: str, path: str):
+        self.method = method
+        self.path = path
+        self.started = time.perf_counter()
+        self.spans = {}  # name -> [count, seconds]
+        self.statements = []  # (seconds, statement)
+        self.statement_count = 0
+
+    def add_span(self, name: str, seconds: float):
+        span = self.spans.get(name)
+        if span is None:
+            self.spans[name] = [1, seconds]
+        else:
+            span[0] += 1
+            span[1] += seconds
+
+    def add_statement(self, statement: str, seconds: float):
+        self.add_span("db", seconds)
+        self.statement_count += 1
+        if len(self.statements) < MAX_RECORDED_STATEMENTS:
+            self.statements.append((seconds, statement[:STATEMENT_PREVIEW_CHARS]))
+
+    def server_timing(self, total: float):
+        """Spans as a Server-Timing header value"""
+        parts = [f"{name};dur={seconds * 1000:.2f}" for name, (_, seconds) in self.spans.items()]
+        parts.append(f"total;dur={total * 1000:.2f}")
+        return ", ".join(parts)
+
+    def summary(self, total: float, status_code: int):
+        slowest = sorted(self.statements, reverse=True)[:10]
+        return {
+            "method": self.method,
+            "path": self.path,
+            "status": status_code,
+            "total_ms": round(total * 1000, 2),
+            "spans": {
+                name: {"count": count, "ms": round(seconds * 1000, 2)}
+                for name, (count, seconds) in self.spans.items()
+            },
+            "statements": self.statement_count,
+            "slowest_statements": [
+                {"ms": round(seconds * 1000, 2), "sql": statement} for seconds, statement in slowest
+            ]
+        }
+
+_current_profile = ContextVar("request_profile", default=None)
+
+class _Span:
+    __slots__ = ("profile", "name", "started")
+
+    def __init__(self, profile: RequestProfile, name: str):
+        self.profile = profile
+        self.name = name
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.profile.add_span(self.name, time.perf_counter() - self.started)
+        return False
+
+_NO_SPAN = nullcontext()
+
+def profile_span(name: str):
+    """Time a block under name if the current request is being profiled; a no-op otherwise"""
+    profile = _current_profile.get()
+    if profile is None:
+        return _NO_SPAN
+    return _Span(profile, name)
+
+def start_profile(method: str, path: str):
+    """Start profiling the current request; returns (profile, token for stop_profile)"""
+    profile = RequestProfile(method, path)
+    return profile, _current_profile.set(profile)
+
+def stop_profile(token):
+    _current_profile.reset(token)
+
+class StackSampler:
+    """
+    Samples the event loop thread's stack from a background thread and counts
+    collapsed stacks (flamegraph format). Requests share the event loop, so
+    the samples show everything the loop ran while the request was in flight.
+    """
+
+    def __init__(self, interval: float):
+        self.interval = interval
+        self.stacks = Counter()
+        self._thread_id = threading.get_ident()
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="stack-sampler", daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stopped.set()
+        self._thread.join()
+
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            frame = sys._current_frames().get(self._thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+                frame = frame.f_back
+            if stack:
+                self.stacks[";".join(reversed(stack))] += 1
+
+    def dump(self, path: str):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "w") as f:
+            for stack, count in self.stacks.most_common():
+                f.write(f"{stack} {count}\n")
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if _current_profile.get() is not None:
+        conn.info.setdefault("profile_start_time", []).append(time.perf_counter())
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    profile = _current_profile.get()
+    if profile is not None:
+        started = conn.info.get("profile_start_time")
+        if started:
+            profile.add_statement(statement, time.perf_counter() - started.pop())
+
+def _profiled_serialize_response(serialize_response):
+    async def wrapper(*args, **kwargs):
+        with profile_span("serialize"):
+            return await serialize_response(*args, **kwargs)
+    return wrapper
+
+def install_profiling(sync_engine):
+    """
+    Hook statement timing into an engine and response serialization into
+    FastAPI. Only called when profiling is configured, so nothing is hooked
+    otherwise.
+    """
+    import fastapi.routing
+
+    event.listen(sync_engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(sync_engine, "after_cursor_execute", _after_cursor_execute)
+    # FastAPI has no hook around response validation/serialization; wrap the module function
+    fastapi.routing.serialize_response = _profiled_serialize_response(fastapi.routing.serialize_response)
+
+def wants_profile(headers):
+    """Whether a request should be profiled: always, or when it sends the admin key in the profiling header"""
+    if settings.PROFILING_ENABLED:
+        return True
+    return (
+        settings.PROFILING_HEADER_ENABLED
+        and headers.get(settings.PROFILING_HEADER) == settings.ADMIN_SECRET_KEY
+    )
+
+def start_sampler():
+    if settings.PROFILING_SAMPLE_INTERVAL_MS <= 0:
+        return None
+    return StackSampler(settings.PROFILING_SAMPLE_INTERVAL_MS / 1000).start()
+
+async def finish_profile(profile: RequestProfile, sampler, status_code: int):
+    """Log the profile if the request was slow and dump its stack samples; returns the total time"""
+    total = time.perf_counter() - profile.started
+    # Joining the sampler thread and writing the dump both block, so neither runs on the event loop
+    if sampler is not None:
+        await run_in_threadpool(sampler.stop)
+
+    if total * 1000 >= settings.SLOW_REQUEST_MS:
+        summary = profile.summary(total, status_code)
+        if sampler is not None and sampler.stacks:
+            dump_path = os.path.join(
+                settings.PROFILING_DUMP_DIR,
+                f"{datetime.utcnow():%Y%m%dT%H%M%S%f}-{profile.method}.folded"
+            )
+            await run_in_threadpool(sampler.dump, dump_path)
+            summary["stack_samples"] = dump_path
+        logger.warning("Slow request: %s", json.dumps(summary))
+    return total
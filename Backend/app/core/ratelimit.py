@@ -0,0 +1,87 @@
+# app/core/ratelimit.py
+import math
+import time
+from collections import OrderedDict
+from fastapi import HTTPException, status
+
+from app.config import settings
+
+MAX_TRACKED_KEYS = 100000
+
+class TokenBucketLimiter:
+    """
+    In-memory token buckets keyed by API key.
+
+    Each tier has a bucket capacity (burst) and a refill rate in tokens per
+    second; a request takes as many tokens as its cost. Buckets are refilled
+    lazily when a key is seen, so a decision is a dict lookup and never touches
+    the database. Least recently used buckets are dropped past max_keys, which
+    only ever makes a forgotten key start again from a full bucket.
+    """
+
+    def __init__(self, refill_per_second: dict, burst: dict, default_tier: str, max_keys: int = MAX_TRACKED_KEYS):
+        self.refill_per_second = refill_per_second
+        self.burst = burst
+        self.default_tier = default_tier
+        self.max_keys = max_keys
+        self.allowed = 0
+        self.rejected = 0
+        self._buckets = OrderedDict()  # apikey -> [tokens, last refill time]
+
+    def _tier_limits(self, tier: str):
+        if tier not in self.burst:
+            tier = self.default_tier
+        return self.burst[tier], self.refill_per_second[tier]
+
+    def acquire(self, api_key: str, tier: str, cost: int = 1):
+        """Take cost tokens from the key's bucket, or raise 429 with rate limit headers"""
+        capacity, rate = self._tier_limits(tier)
+        # A cost above the burst could never be paid; charge a full bucket instead
+        cost = min(cost, capacity)
+        now = time.monotonic()
+
+        bucket = self._buckets.get(api_key)
+        if bucket is None:
+            bucket = [capacity, now]
+            self._buckets[api_key] = bucket
+            if len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+        else:
+            self._buckets.move_to_end(api_key)
+            bucket[0] = min(capacity, bucket[0] + (now - bucket[1]) * rate)
+            bucket[1] = now
+
+        if bucket[0] >= cost:
+            bucket[0] -= cost
+            self.allowed += 1
+            return bucket[0]
+
+        self.rejected += 1
+        retry_after = math.ceil((cost - bucket[0]) / rate) if rate > 0 else 3600
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail=f"Rate limit exceeded, retry in {retry_after} seconds",
+            headers={
+                "Retry-After": str(retry_after),
+                "X-RateLimit-Limit": str(capacity),
+                "X-RateLimit-Remaining": str(int(bucket[0])),
+                "X-RateLimit-Reset": str(math.ceil((capacity - bucket[0]) / rate) if rate > 0 else retry_after),
+                "X-RateLimit-Cost": str(cost)
+            }
+        )
+
+    def reset(self, api_key: str):
+        self._buckets.pop(api_key, None)
+
+    def stats(self):
+        return {
+            "allowed": self.allowed,
+            "rejected": self.rejected,
+            "tracked_keys": len(self._buckets)
+        }
+
+rate_limiter = TokenBucketLimiter(
+    refill_per_second={tier: rate / 60 for tier, rate in settings.RATE_LIMIT_REFILL_PER_MINUTE.items()},
+    burst=settings.RATE_LIMIT_BURST,
+    default_tier="free"
+)
@@ -0,0 +1,288 @@
+# app/core/retention.py
+import asyncio
+import logging
+import os
+from datetime import datetime, timedelta
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import delete, exists, func, select, update
+
+from app.config import settings
+from app.database import (
+    AsyncSessionLocal,
+    ArchiveSegment,
+    ScanBlob,
+    ScanJob,
+    ScanPort,
+    ScanResult,
+    ScanSchedule,
+    ScanTechnology,
+    ScanTLS
+)
+from app.core.archive import archive_store
+from app.core.blobstore import BLOB_COLUMNS, BaseBlob, compress, decode_blob, join_blobs
+from app.core.search import search_index
+
+try:
+    import fcntl
+except ImportError:  # no cross-process lock on Windows; run a single worker there
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+LOCK_FILE = ".compaction.lock"
+
+class RetentionCompactor:
+    """
+    Background task that tiers scan output by age.
+
+    Scans older than the hot window have their output moved from the blob
+    store into archive segments, oldest first, one batch per transaction with
+    a pause in between so live traffic keeps the database. Blobs no longer
+    used by a hot scan are dropped, as are the scans' search rows; metadata
+    and findings stay in the database. With an archive window set, segments
+    whose newest scan is older than it are deleted whole, together with their
+    scans and findings.
+    """
+
+    def __init__(self, hot_days: int, archive_days: int, interval: float, batch_size: int,
+                 batch_pause: float, segment_max_bytes: int):
+        self.hot_days = hot_days
+        self.archive_days = archive_days
+        self.interval = interval
+        self.batch_size = batch_size
+        self.batch_pause = batch_pause
+        self.segment_max_bytes = segment_max_bytes
+        self.runs = 0
+        self.archived_scans = 0
+        self.expired_scans = 0
+        self.last_run_at = None
+        self._task = None
+        self._wakeup = None
+        self._running = asyncio.Lock()
+
+    def start(self):
+        if self._task is None:
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is None:
+            return
+        self._task.cancel()
+        await asyncio.gather(self._task, return_exceptions=True)
+        self._task = None
+
+    def trigger(self):
+        """Run a compaction pass now instead of at the next interval"""
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    async def _run(self):
+        while True:
+            try:
+                await self.run_once()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Scan retention pass failed")
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+
+    async def run_once(self):
+        """Archive every scan past the hot window and expire old segments; returns (archived, expired)"""
+        async with self._running:
+            lock = await run_in_threadpool(_acquire_process_lock)
+            if lock is False:
+                # Another worker process is compacting
+                return 0, 0
+            try:
+                archived = expired = 0
+                hot_cutoff = datetime.utcnow() - timedelta(days=self.hot_days)
+                while True:
+                    count = await self._archive_batch(hot_cutoff)
+                    archived += count
+                    if count < self.batch_size:
+                        break
+                    await asyncio.sleep(self.batch_pause)
+
+                if self.archive_days > 0:
+                    archive_cutoff = datetime.utcnow() - timedelta(days=self.archive_days)
+                    while True:
+                        count = await self._expire_segment(archive_cutoff)
+                        if count is None:
+                            break
+                        expired += count
+                        await asyncio.sleep(self.batch_pause)
+            finally:
+                if lock is not None:
+                    lock.close()
+
+            self.runs += 1
+            self.archived_scans += archived
+            self.expired_scans += expired
+            self.last_run_at = datetime.utcnow()
+            if archived or expired:
+                logger.info("Archived %s and expired %s scan results", archived, expired)
+            return archived, expired
+
+    async def _current_segment(self):
+        """The segment being appended to, created (and committed) if there is none"""
+        async with AsyncSessionLocal() as db:
+            segment = (await db.execute(select(ArchiveSegment).filter(
+                ArchiveSegment.sealed.is_(False)
+            ).order_by(ArchiveSegment.id.desc()).limit(1))).scalars().first()
+            if segment is None:
+                segment = ArchiveSegment(scan_count=0, raw_bytes=0, data_bytes=0, sealed=False)
+                db.add(segment)
+                await db.commit()
+            return segment
+
+    async def _archive_batch(self, cutoff: datetime):
+        """Move one batch of the oldest hot scans older than cutoff into the current segment"""
+        async with AsyncSessionLocal() as db:
+            rows = (await db.execute(join_blobs(select(
+                ScanResult.id,
+                ScanResult.scan_time,
+                ScanResult.result,
+                ScanResult.result_digest,
+                ScanResult.result_size,
+                *BLOB_COLUMNS
+            )).filter(
+                ScanResult.archive_segment.is_(None),
+                ScanResult.scan_time < cutoff
+            ).order_by(ScanResult.scan_time, ScanResult.id).limit(self.batch_size))).all()
+            await db.rollback()
+        if not rows:
+            return 0
+
+        records = await run_in_threadpool(_archive_records, rows)
+        segment = await self._current_segment()
+        # Write the files before touching the database, so the write lock is never held across an fsync
+        written = await run_in_threadpool(archive_store.append, segment.id, records)
+
+        scan_ids = [row.id for row in rows]
+        digests = {row.result_digest for row in rows if row.result_digest is not None}
+        keyframes = {row.base_digest for row in rows if row.base_digest is not None}
+        async with AsyncSessionLocal() as db:
+            await db.execute(update(ScanResult).where(
+                ScanResult.id.in_(scan_ids),
+                ScanResult.archive_segment.is_(None)
+            ).values(archive_segment=segment.id, result=None))
+            await search_index.remove(db, digests)
+            # Blobs still used by a hot scan or a delta stay; the writer re-creates any it needs later.
+            # Keyframes go second, once the deltas that needed them are gone.
+            for candidates in (digests, keyframes):
+                if candidates:
+                    await db.execute(delete(ScanBlob).where(
+                        ScanBlob.digest.in_(candidates),
+                        ~exists().where(
+                            ScanResult.result_digest == ScanBlob.digest,
+                            ScanResult.archive_segment.is_(None)
+                        ),
+                        ~exists().where(BaseBlob.base_digest == ScanBlob.digest)
+                    ))
+            data_bytes = segment.data_bytes + written
+            await db.execute(update(ArchiveSegment).where(ArchiveSegment.id == segment.id).values(
+                scan_count=ArchiveSegment.scan_count + len(rows),
+                raw_bytes=ArchiveSegment.raw_bytes + sum(row.result_size or 0 for row in rows),
+                data_bytes=data_bytes,
+                first_scan_time=func.coalesce(ArchiveSegment.first_scan_time, rows[0].scan_time),
+                last_scan_time=rows[-1].scan_time,
+                sealed=data_bytes >= self.segment_max_bytes
+            ))
+            await db.commit()
+        return len(rows)
+
+    async def _expire_segment(self, cutoff: datetime):
+        """Delete the oldest segment whose scans are all older than cutoff; returns scans deleted or None"""
+        async with AsyncSessionLocal() as db:
+            segment_id = await db.scalar(select(ArchiveSegment.id).filter(
+                ArchiveSegment.last_scan_time < cutoff
+            ).order_by(ArchiveSegment.id).limit(1))
+            if segment_id is None:
+                return None
+
+            scan_ids = select(ScanResult.id).filter(ScanResult.archive_segment == segment_id)
+            for model in (ScanPort, ScanTLS, ScanTechnology):
+                await db.execute(delete(model).where(model.scan_id.in_(scan_ids)))
+            await db.execute(update(ScanJob).where(
+                ScanJob.scan_result_id.in_(scan_ids)
+            ).values(scan_result_id=None))
+            await db.execute(update(ScanSchedule).where(
+                ScanSchedule.last_scan_result_id.in_(scan_ids)
+            ).values(last_scan_result_id=None))
+            deleted = (await db.execute(delete(ScanResult).where(
+                ScanResult.archive_segment == segment_id
+            ))).rowcount
+            await db.execute(delete(ArchiveSegment).where(ArchiveSegment.id == segment_id))
+            await db.commit()
+
+        await run_in_threadpool(archive_store.delete, segment_id)
+        return deleted
+
+    async def stats(self, db):
+        segments, scans, raw_bytes, data_bytes = (await db.execute(select(
+            func.count(ArchiveSegment.id),
+            func.coalesce(func.sum(ArchiveSegment.scan_count), 0),
+            func.coalesce(func.sum(ArchiveSegment.raw_bytes), 0),
+            func.coalesce(func.sum(ArchiveSegment.data_bytes), 0)
+        ))).one()
+        return {
+            "hot_days": self.hot_days,
+            "archive_days": self.archive_days,
+            "segments": segments,
+            "archived_scans": scans,
+            "archived_raw_bytes": raw_bytes,
+            "archived_data_bytes": data_bytes,
+            "runs": self.runs,
+            "scans_archived_since_start": self.archived_scans,
+            "scans_expired_since_start": self.expired_scans,
+            "last_run_at": self.last_run_at
+        }
+
+def _archive_records(rows):
+    """(scan id, digest, codec, compressed data) for archive_store.append"""
+    records = []
+    for row in rows:
+        if row.data is not None and row.base_digest is None:
+            records.append((row.id, row.result_digest, row.codec, row.data))
+            continue
+        if row.data is not None and row.base_data is not None:
+            # Segments hold whole outputs; deltas are rebuilt against their keyframe
+            codec, data = compress(decode_blob(row))
+            records.append((row.id, row.result_digest, codec, data))
+            continue
+        if row.result_digest is not None:
+            logger.warning("Blob %s of scan %s is missing; archiving empty output", row.result_digest, row.id)
+        codec, data = compress((row.result or "").encode())
+        records.append((row.id, None, codec, data))
+    return records
+
+def _acquire_process_lock():
+    """
+    Take the archive directory's compaction lock without blocking. Returns
+    the open lock file, None where locking is unsupported, or False if
+    another process holds it.
+    """
+    if fcntl is None:
+        return None
+    os.makedirs(archive_store.directory, exist_ok=True)
+    lock = open(os.path.join(archive_store.directory, LOCK_FILE), "w")
+    try:
+        fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        lock.close()
+        return False
+    return lock
+
+retention_compactor = RetentionCompactor(
+    hot_days=settings.RETENTION_HOT_DAYS,
+    archive_days=settings.RETENTION_ARCHIVE_DAYS,
+    interval=settings.RETENTION_INTERVAL_SECONDS,
+    batch_size=settings.RETENTION_BATCH_SIZE,
+    batch_pause=settings.RETENTION_BATCH_PAUSE_MS / 1000,
+    segment_max_bytes=settings.ARCHIVE_SEGMENT_MAX_BYTES
+)
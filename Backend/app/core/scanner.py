@@ -1,54 +1,98 @@
 # app/core/scanner.py
-import subprocess
+import asyncio
+import logging
+import os
 import shlex
+import shutil
+import tempfile
+import time
+from collections import OrderedDict
+from datetime import datetime
+from typing import Optional
 from fastapi import HTTPException, status
-from sqlalchemy.orm import Session
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import select, tuple_
+from sqlalchemy.ext.asyncio import AsyncSession
 
-from app.database import ScanResult
+from app.config import settings
+from app.database import AsyncSessionLocal, ScanResult
 from app.core.apikey import authenticate_api_key, verify_api_key_exists
+from app.core.blobstore import encode_output, previous_output_digest
+from app.core.findings import MAX_REPORT_BYTES, attach_findings, parse_findings
+from app.core.metrics import TOOL_DURATION, TOOL_EXITS, TOOL_OUTPUT_BYTES, TOOL_TIMEOUTS, TOOLS_IN_FLIGHT
+from app.core.writer import db_writer
+from app.utils.pagination import encode_cursor, decode_cursor
+
+logger = logging.getLogger(__name__)
+
+# Maximum wall-clock time a single tool run may take, in seconds
+SCAN_TIMEOUT = 300
+
+# Largest page of scan history returned by one request
+HISTORY_MAX_PAGE_SIZE = 500
+
+# Size of each read from a tool's stdout pipe, in bytes
+READ_CHUNK_SIZE = 64 * 1024
+
+# Scan result statuses
+SCAN_COMPLETED = "completed"
+SCAN_TIMED_OUT = "timed_out"
 
 class ScannerTool:
-    def __init__(self, name, command_template, description):
+    def __init__(self, name, command_template, description, cost=1, report_format=None):
         self.name = name
         self.command_template = command_template
         self.description = description
+        self.cost = cost  # rate limiter tokens taken per run
+        # Format of the structured report the tool writes to {report}, parsed into findings
+        self.report_format = report_format
 
 # Define available scanning tools
 SCANNER_TOOLS = {
     "dig": ScannerTool(
         name="dig",
         command_template="dig {domain}",
-        description="DNS lookup tool that provides information about DNS records"
+        description="DNS lookup tool that provides information about DNS records",
+        cost=1
     ),
     "nmap": ScannerTool(
         name="nmap",
-        command_template="nmap {domain}",
-        description="Network discovery and security auditing tool"
+        command_template="nmap -oX {report} {domain}",
+        description="Network discovery and security auditing tool",
+        cost=8,
+        report_format="nmap_xml"
     ),
     "subfinder": ScannerTool(
         name="subfinder",
         command_template="subfinder -d {domain}",
-        description="Subdomain discovery tool"
+        description="Subdomain discovery tool",
+        cost=3
     ),
     "wpscan": ScannerTool(
         name="wpscan",
         command_template="wpscan --url {domain}",
-        description="WordPress security scanner"
+        description="WordPress security scanner",
+        cost=5
     ),
     "whatweb": ScannerTool(
         name="whatweb",
-        command_template="whatweb {domain}",
-        description="Web scanner that identifies web technologies"
+        command_template="whatweb --log-json={report} {domain}",
+        description="Web scanner that identifies web technologies",
+        cost=2,
+        report_format="whatweb_json"
     ),
     "sslscan": ScannerTool(
         name="sslscan",
-        command_template="sslscan {domain}",
-        description="SSL/TLS scanner that tests SSL/TLS enabled services"
+        command_template="sslscan --xml={report} {domain}",
+        description="SSL/TLS scanner that tests SSL/TLS enabled services",
+        cost=2,
+        report_format="sslscan_xml"
     ),
     "nuclei": ScannerTool(
         name="nuclei",
         command_template="nuclei -u {domain} -t http/technologies/ --silent",
-        description="Fast and customizable vulnerability scanner"
+        description="Fast and customizable vulnerability scanner",
+        cost=8
     )
 }
 
@@ -57,80 +101,452 @@ def get_available_tools():
     return [
         {
             "name": tool.name,
-            "description": tool.description
+            "description": tool.description,
+            "cost": tool.cost
         }
         for tool in SCANNER_TOOLS.values()
     ]
 
-def execute_scan(tool_name: str, domain: str, api_key: str, db: Session):
-    """Execute a scan using the specified tool"""
-    # First, authenticate the API key
-    key_record = authenticate_api_key(api_key, db)
-    
-    # Check if the requested tool exists
+def get_scanner_tool(tool_name: str):
+    """Look up a scanning tool by name or raise a 404"""
     if tool_name not in SCANNER_TOOLS:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail=f"Tool '{tool_name}' not found"
         )
-    
-    tool = SCANNER_TOOLS[tool_name]
-    
-    # Format the command with the domain
-    command = tool.command_template.format(domain=shlex.quote(domain))
-    
+    return SCANNER_TOOLS[tool_name]
+
+def build_command(tool: ScannerTool, domain: str, report: Optional[str] = None):
+    """Build the argv for a tool, passing the domain (and report path) as single arguments"""
+    return [part.format(domain=domain, report=report) for part in shlex.split(tool.command_template)]
+
+def _read_report(path: str):
+    """Read a tool's report file, or None if the tool didn't write one"""
     try:
-        # Execute the command
-        process = subprocess.run(
-            command, 
-            shell=True, 
-            capture_output=True, 
-            text=True, 
-            timeout=300  # 5-minute timeout
-        )
+        with open(path, "rb") as f:
+            return f.read(MAX_REPORT_BYTES)
+    except FileNotFoundError:
+        return None
 
-        print(process)
-        
-        # Store the result
-        scan_result = ScanResult(
-            apikey=api_key,
-            domain=domain,
-            tool=tool_name,
-            result=process.stdout
+def max_output_bytes(tool: ScannerTool):
+    return settings.SCAN_OUTPUT_TOOL_MAX_BYTES.get(tool.name, settings.SCAN_OUTPUT_MAX_BYTES)
+
+class CapturedOutput:
+    """
+    A tool's stdout, kept in memory up to spool_bytes and in an anonymous temp
+    file beyond that. Output past max_bytes is counted but not kept, and
+    text() ends with a truncation marker saying how much was dropped.
+    """
+
+    def __init__(self, max_bytes: int, spool_bytes: int):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.omitted = 0
+        self._file = tempfile.SpooledTemporaryFile(max_size=spool_bytes)
+
+    @property
+    def truncated(self):
+        return self.omitted > 0
+
+    def write(self, chunk: bytes):
+        """Keep as much of chunk as fits; returns the part that was kept"""
+        kept = chunk[:max(0, self.max_bytes - self.size)]
+        if kept:
+            self._file.write(kept)
+            self.size += len(kept)
+        self.omitted += len(chunk) - len(kept)
+        return kept
+
+    def marker(self):
+        return f"\n[output truncated: {self.omitted} bytes over the {self.max_bytes} byte limit omitted]\n"
+
+    def text(self):
+        """The captured output as text, with a truncation marker if anything was dropped"""
+        self._file.seek(0)
+        text = self._file.read().decode(errors="replace")
+        if self.truncated:
+            text += self.marker()
+        return text
+
+    def close(self):
+        self._file.close()
+
+class ToolRun:
+    """
+    A scanning tool process whose stdout is consumed line by line as it is
+    produced and captured with a size cap. On timeout the process is killed,
+    timed_out is set and the output captured so far is kept.
+    """
+
+    def __init__(self, tool: ScannerTool, domain: str, timeout: int = SCAN_TIMEOUT):
+        self.tool = tool
+        self.domain = domain
+        self.timeout = timeout
+        self.returncode = None
+        self.timed_out = False
+        self.report = None  # contents of the structured report, for tools that write one
+        self.output = CapturedOutput(max_output_bytes(tool), settings.SCAN_OUTPUT_SPOOL_BYTES)
+
+    @property
+    def status(self):
+        return SCAN_TIMED_OUT if self.timed_out else SCAN_COMPLETED
+
+    async def lines(self):
+        """Start the tool and yield decoded stdout lines until it exits, is truncated or times out"""
+        TOOLS_IN_FLIGHT.inc(self.tool.name)
+        started = time.perf_counter()
+        output_bytes = 0
+        report_dir = tempfile.mkdtemp(prefix=f"{self.tool.name}-") if self.tool.report_format else None
+        report_path = os.path.join(report_dir, "report") if report_dir else None
+        try:
+            loop = asyncio.get_running_loop()
+            deadline = loop.time() + self.timeout
+            process = await asyncio.create_subprocess_exec(
+                *build_command(self.tool, self.domain, report_path),
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.DEVNULL
+            )
+            try:
+                pending = b""
+                while True:
+                    chunk = await asyncio.wait_for(
+                        process.stdout.read(READ_CHUNK_SIZE),
+                        timeout=deadline - loop.time()
+                    )
+                    if not chunk:
+                        break
+                    output_bytes += len(chunk)
+
+                    # Past the output limit the pipe is still drained so the tool can finish
+                    truncated = self.output.truncated
+                    chunk = self.output.write(chunk)
+                    if truncated:
+                        continue
+                    if self.output.truncated:
+                        yield (pending + chunk).decode(errors="replace") + self.output.marker()
+                        pending = b""
+                        continue
+
+                    # Splitting on b"\n" never cuts a UTF-8 sequence in half
+                    *complete, pending = (pending + chunk).split(b"\n")
+                    for line in complete:
+                        yield (line + b"\n").decode(errors="replace")
+
+                    # Flush overlong lines rather than buffering them indefinitely
+                    if len(pending) >= READ_CHUNK_SIZE:
+                        yield pending.decode(errors="replace")
+                        pending = b""
+
+                if pending:
+                    yield pending.decode(errors="replace")
+
+                self.returncode = await asyncio.wait_for(
+                    process.wait(),
+                    timeout=deadline - loop.time()
+                )
+                logger.debug("%s %s exited with code %s", self.tool.name, self.domain, self.returncode)
+                if report_path:
+                    self.report = await run_in_threadpool(_read_report, report_path)
+            finally:
+                if process.returncode is None:
+                    process.kill()
+                    await process.wait()
+        except asyncio.TimeoutError:
+            TOOL_TIMEOUTS.inc(self.tool.name)
+            logger.info("%s %s timed out after %s seconds", self.tool.name, self.domain, self.timeout)
+            self.timed_out = True
+        finally:
+            if report_dir:
+                shutil.rmtree(report_dir, ignore_errors=True)
+            TOOLS_IN_FLIGHT.dec(self.tool.name)
+            TOOL_DURATION.observe(time.perf_counter() - started, self.tool.name)
+            TOOL_OUTPUT_BYTES.observe(output_bytes, self.tool.name)
+            if self.returncode is not None:
+                TOOL_EXITS.inc(self.tool.name, str(self.returncode))
+
+async def run_tool(tool: ScannerTool, domain: str, timeout: int = SCAN_TIMEOUT):
+    """
+    Run a scanning tool without blocking the event loop and return (exit code,
+    stdout, findings). The exit code is None if the tool timed out, in which
+    case stdout is the output captured before it was killed.
+    """
+    run = ToolRun(tool, domain, timeout)
+    try:
+        async for _ in run.lines():
+            pass
+        output = await run_in_threadpool(run.output.text)
+    finally:
+        run.output.close()
+    findings = await parse_findings(tool.report_format, run.report, domain)
+    return run.returncode, output, findings
+
+async def store_scan_result(db: AsyncSession, api_key: str, domain: str, tool_name: str, output: str,
+                      pipeline_id: Optional[int] = None, pipeline_stage: Optional[str] = None,
+                      findings=(), scan_status: str = SCAN_COMPLETED):
+    """
+    Persist the output of a scan, storing the output itself in the blob store,
+    along with the findings parsed from the tool's report. The rows are written
+    by the group-commit writer; this returns once they are committed.
+    """
+    previous_digest = None
+    if settings.SCAN_DELTA_ENABLED:
+        # Repeat scans of a target are stored as deltas against its last full output
+        previous_digest = await previous_output_digest(db, api_key, tool_name, domain)
+    digest, result_size, stored_size, blob = await encode_output(db, output, previous_digest)
+    scan_result = ScanResult(
+        apikey=api_key,
+        domain=domain,
+        tool=tool_name,
+        status=scan_status,
+        result_digest=digest,
+        result_size=result_size,
+        stored_size=stored_size,
+        pipeline_id=pipeline_id,
+        pipeline_stage=pipeline_stage
+    )
+    attach_findings(scan_result, findings)
+    return await db_writer.add_scan_result(scan_result, blob, output)
+
+def scan_error(tool: ScannerTool, error: Exception):
+    """Translate a failure while running a tool into an HTTPException"""
+    if isinstance(error, HTTPException):
+        return error
+    if isinstance(error, FileNotFoundError):
+        return HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail=f"Tool '{tool.name}' is not installed on this server"
         )
-        db.add(scan_result)
-        db.commit()
+    return HTTPException(
+        status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+        detail=f"Error during scan execution: {str(error)}"
+    )
 
+def normalize_domain(domain: str):
+    """Normalize a scan target so equivalent spellings share a cache entry"""
+    return domain.strip().lower().rstrip(".")
 
-        
-        
+class ScanResultCache:
+    """
+    TTL cache of tool output keyed on (tool, normalized domain), evicting the
+    least recently used entries once the cached output exceeds max_bytes.
+
+    Concurrent requests for the same key are coalesced: the first caller runs
+    the tool and the others await its result instead of starting another process.
+    If that caller is cancelled, one of the waiting callers runs the tool instead.
+    """
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self._entries = OrderedDict()  # key -> (expires_at, output, findings, size)
+        self._inflight = {}  # key -> asyncio.Future of (exit code, output, findings)
+
+    def get(self, key):
+        """Return (output, findings) for a live entry, or None"""
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires_at, output, findings, _ = entry
+        if expires_at <= time.monotonic():
+            self._remove(key)
+            return None
+        self._entries.move_to_end(key)
+        return output, findings
+
+    def put(self, key, output: str, findings: list, ttl: int):
+        size = len(output.encode())
+        if ttl <= 0 or size > self.max_bytes:
+            return
+        if key in self._entries:
+            self._remove(key)
+        self._entries[key] = (time.monotonic() + ttl, output, findings, size)
+        self.size += size
+        while self.size > self.max_bytes:
+            self._remove(next(iter(self._entries)))
+
+    def clear(self):
+        self._entries.clear()
+        self.size = 0
+
+    def _remove(self, key):
+        _, _, _, size = self._entries.pop(key)
+        self.size -= size
+
+    async def get_or_run(self, key, ttl: int, run):
+        """
+        Return (exit code, output, findings, cached), calling run() -> (exit
+        code, output, findings) on a miss. Cached entries are clean exits.
+        """
+        while True:
+            entry = self.get(key)
+            if entry is not None:
+                self.hits += 1
+                return (0,) + entry + (True,)
+
+            inflight = self._inflight.get(key)
+            if inflight is None:
+                break
+            # asyncio.wait neither cancels the shared run nor raises its outcome here
+            await asyncio.wait([inflight])
+            if not inflight.cancelled():
+                self.coalesced += 1
+                return inflight.result() + (True,)
+            # The caller running the tool was cancelled; look again and take over if nobody has
+
+        self.misses += 1
+        future = asyncio.get_running_loop().create_future()
+        # Mark the exception as retrieved when nobody else was waiting on it
+        future.add_done_callback(lambda f: f.cancelled() or f.exception())
+        self._inflight[key] = future
+        try:
+            returncode, output, findings = await run()
+        except Exception as e:
+            future.set_exception(e)
+            raise
+        except BaseException:
+            # Cancellation is ours alone; waiting callers retry instead of failing with it
+            future.cancel()
+            raise
+        else:
+            future.set_result((returncode, output, findings))
+        finally:
+            del self._inflight[key]
+
+        # Failed runs may be transient, so only clean exits are cached
+        if returncode == 0:
+            self.put(key, output, findings, ttl)
+        return returncode, output, findings, False
+
+    def stats(self):
+        lookups = self.hits + self.coalesced + self.misses
         return {
-            "tool": tool_name,
-            "domain": domain,
-            "output": process.stdout
+            "hits": self.hits,
+            "coalesced": self.coalesced,
+            "misses": self.misses,
+            "hit_ratio": (self.hits + self.coalesced) / lookups if lookups else 0.0,
+            "entries": len(self._entries),
+            "bytes": self.size,
+            "max_bytes": self.max_bytes
         }
+
+scan_cache = ScanResultCache(max_bytes=settings.SCAN_CACHE_MAX_BYTES)
+
+async def perform_scan(tool: ScannerTool, domain: str, api_key: str, db: AsyncSession,
+                       pipeline_id: Optional[int] = None, pipeline_stage: Optional[str] = None):
+    """
+    Run a tool (or reuse a cached run) and persist its output. The API key
+    must already be authenticated. Returns (scan result, output, cached); a
+    run that timed out is stored with its partial output and status timed_out.
+    """
+    try:
+        returncode, output, findings, cached = await scan_cache.get_or_run(
+            (tool.name, normalize_domain(domain)),
+            settings.SCAN_CACHE_TTLS.get(tool.name, 0),
+            lambda: run_tool(tool, domain)
+        )
         
-    except subprocess.TimeoutExpired:
-        raise HTTPException(
-            status_code=status.HTTP_408_REQUEST_TIMEOUT,
-            detail="Scan timed out after 5 minutes"
+        # Store the result
+        scan_result = await store_scan_result(
+            db, api_key, domain, tool.name, output, pipeline_id, pipeline_stage, findings,
+            SCAN_TIMED_OUT if returncode is None else SCAN_COMPLETED
         )
+        return scan_result, output, cached
+        
     except Exception as e:
-        raise HTTPException(
-            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-            detail=f"Error during scan execution: {str(e)}"
-        )
+        raise scan_error(tool, e)
+
+async def stream_scan(tool: ScannerTool, domain: str, api_key: str):
+    """
+    Run a tool and yield ("output", line) events as it writes to stdout, followed
+    by a ("done", {...}) event once the result is stored or an ("error", {...}) event.
+    The API key must already be authenticated.
+    """
+    run = ToolRun(tool, domain)
+    try:
+        async for line in run.lines():
+            yield "output", line
+
+        output = await run_in_threadpool(run.output.text)
+        findings = await parse_findings(tool.report_format, run.report, domain)
+        async with AsyncSessionLocal() as db:
+            scan_result = await store_scan_result(
+                db, api_key, domain, tool.name, output, findings=findings, scan_status=run.status
+            )
+            scan_id = scan_result.id
+    except Exception as e:
+        error = scan_error(tool, e)
+        yield "error", {"status_code": error.status_code, "detail": error.detail}
+        return
+    finally:
+        run.output.close()
+
+    yield "done", {"scan_id": scan_id, "tool": tool.name, "domain": domain, "status": run.status}
 
-def get_scan_history(api_key: str, db: Session, limit: int = 20):
-    """Get scan history for a specific API key without incrementing usage count"""
+async def execute_scan(tool_name: str, domain: str, api_key: str, db: AsyncSession):
+    """Execute a scan using the specified tool"""
+    tool = get_scanner_tool(tool_name)
+
+    # Authenticate the API key and charge the tool's cost to its rate limit
+    await authenticate_api_key(api_key, db, cost=tool.cost)
+    
+    scan_result, output, cached = await perform_scan(tool, domain, api_key, db)
+    
+    return {
+        "tool": tool_name,
+        "domain": domain,
+        "output": output,
+        "cached": cached,
+        "status": scan_result.status,
+        "scan_id": scan_result.id
+    }
+
+async def get_scan_history(api_key: str, db: AsyncSession, limit: int = 20, cursor: Optional[str] = None,
+                     tool: Optional[str] = None, domain: Optional[str] = None,
+                     since: Optional[datetime] = None, until: Optional[datetime] = None):
+    """
+    Get a page of scan history for a specific API key without incrementing usage count.
+
+    Pages are ordered newest first and use keyset pagination on (scan_time, id),
+    so every page is an index range scan no matter how deep it is. Returns
+    (scan results, cursor for the next page or None).
+    """
     # Verify the API key exists but don't increment count
-    verify_api_key_exists(api_key, db)
+    await verify_api_key_exists(api_key, db)
+    limit = max(1, min(limit, HISTORY_MAX_PAGE_SIZE))
     
     # Fetch scan history
-    scan_results = db.query(ScanResult).filter(
+    query = select(
+        ScanResult.id,
+        ScanResult.domain,
+        ScanResult.tool,
+        ScanResult.scan_time,
+        ScanResult.status
+    ).filter(
         ScanResult.apikey == api_key
-    ).order_by(
-        ScanResult.scan_time.desc()
-    ).limit(limit).all()
+    )
+    if tool is not None:
+        query = query.filter(ScanResult.tool == tool)
+    if domain is not None:
+        query = query.filter(ScanResult.domain == domain)
+    if since is not None:
+        query = query.filter(ScanResult.scan_time >= since)
+    if until is not None:
+        query = query.filter(ScanResult.scan_time < until)
+    if cursor is not None:
+        scan_time, scan_id = decode_cursor(cursor, datetime, int)
+        query = query.filter(tuple_(ScanResult.scan_time, ScanResult.id) < tuple_(scan_time, scan_id))
+    
+    scan_results = (await db.execute(query.order_by(
+        ScanResult.scan_time.desc(),
+        ScanResult.id.desc()
+    ).limit(limit + 1))).all()
+    
+    next_cursor = None
+    if len(scan_results) > limit:
+        scan_results = scan_results[:limit]
+        next_cursor = encode_cursor(scan_results[-1].scan_time, scan_results[-1].id)
     
-    return scan_results
\ No newline at end of file
+    return scan_results, next_cursor
@@ -0,0 +1,343 @@
+# app/core/schedules.py
+import asyncio
+import heapq
+import logging
+import random
+from datetime import datetime, timedelta
+from typing import Optional
+from fastapi import HTTPException, status
+from sqlalchemy import delete, func, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.config import settings
+from app.database import AsyncSessionLocal, ScanSchedule
+from app.core.apikey import authenticate_api_key, verify_api_key_exists
+from app.core.scanner import SCANNER_TOOLS, get_scanner_tool, perform_scan
+from app.utils.validators import validate_domain
+
+logger = logging.getLogger(__name__)
+
+SCHEDULE_FAILED = "failed"
+
+class ScanScheduler:
+    """
+    In-process scheduler for recurring scans.
+
+    The scan_schedules table is the source of truth; a min-heap of (run at,
+    schedule id, stored next_run_at) holds what is due next. Entries are never
+    removed from the heap: one whose stored time no longer matches _due is
+    stale and skipped when it reaches the top. Before running, a schedule is
+    claimed by moving its next_run_at forward with a compare-and-set update,
+    so several worker processes never run the same schedule twice.
+
+    Each run lands up to SCHEDULE_JITTER_RATIO of its interval early or late,
+    so schedules created together drift apart instead of firing in the same
+    second. At most max_concurrent scheduled scans run at once; the scheduler
+    waits for a free slot before taking the next due schedule, leaving the
+    rest of the tool capacity to interactive scans. Runs missed while the
+    process was down are run once each, spread over the catch-up window.
+    """
+
+    def __init__(self, max_concurrent: int, jitter_ratio: float, max_jitter: float, catchup_window: float):
+        self.max_concurrent = max_concurrent
+        self.jitter_ratio = jitter_ratio
+        self.max_jitter = max_jitter
+        self.catchup_window = catchup_window
+        self.dispatched = 0
+        self.failed = 0
+        self.claimed_elsewhere = 0
+        self.caught_up = 0
+        self._heap = []
+        self._due = {}  # schedule id -> stored next_run_at of its live heap entry
+        self._running = set()
+        self._task = None
+        self._wakeup = None
+        self._slots = None
+
+    def jitter(self, interval: int):
+        spread = min(interval * self.jitter_ratio, self.max_jitter)
+        return timedelta(seconds=random.uniform(-spread, spread))
+
+    def first_run(self, interval: int, now: Optional[datetime] = None):
+        """When a new or re-enabled schedule first runs: soon, but not in lockstep with others"""
+        now = now or datetime.utcnow()
+        return now + abs(self.jitter(interval))
+
+    def next_run(self, due: datetime, interval: int, now: datetime):
+        """The run after one that was due at due"""
+        next_run_at = due + timedelta(seconds=interval) + self.jitter(interval)
+        if next_run_at < now + timedelta(seconds=interval / 2):
+            # Running late; skip the missed intervals rather than run back to back
+            next_run_at = now + timedelta(seconds=interval) + self.jitter(interval)
+        return next_run_at
+
+    async def start(self):
+        """Load every enabled schedule and start dispatching"""
+        self._slots = asyncio.Semaphore(self.max_concurrent)
+        self._wakeup = asyncio.Event()
+        now = datetime.utcnow()
+        async with AsyncSessionLocal() as db:
+            rows = (await db.execute(select(
+                ScanSchedule.id,
+                ScanSchedule.next_run_at,
+                ScanSchedule.interval_seconds
+            ).filter(ScanSchedule.enabled.is_(True)))).all()
+
+        for schedule_id, next_run_at, interval in rows:
+            run_at = next_run_at
+            if run_at <= now:
+                # However many runs were missed, run once, somewhere in the catch-up window
+                run_at = now + timedelta(seconds=random.uniform(0, min(self.catchup_window, interval)))
+                self.caught_up += 1
+            self._heap.append((run_at, schedule_id, next_run_at))
+            self._due[schedule_id] = next_run_at
+        heapq.heapify(self._heap)
+        if self.caught_up:
+            logger.info("Catching up on %s overdue scan schedules", self.caught_up)
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Stop dispatching and cancel scheduled scans still running"""
+        if self._task is None:
+            return
+        tasks = [self._task, *self._running]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._task = None
+        self._heap = []
+        self._due = {}
+
+    def add(self, schedule_id: int, next_run_at: datetime):
+        """Queue a created, edited or re-enabled schedule"""
+        if self._task is None:
+            return
+        self._push(schedule_id, next_run_at, next_run_at)
+        self._wakeup.set()
+
+    def remove(self, schedule_id: int):
+        """Forget a deleted or disabled schedule; its heap entry goes stale"""
+        self._due.pop(schedule_id, None)
+
+    def _push(self, schedule_id: int, run_at: datetime, next_run_at: datetime):
+        self._due[schedule_id] = next_run_at
+        heapq.heappush(self._heap, (run_at, schedule_id, next_run_at))
+
+    async def _next_due(self):
+        """Wait until a schedule is due and pop it"""
+        while True:
+            while self._heap and self._due.get(self._heap[0][1]) != self._heap[0][2]:
+                heapq.heappop(self._heap)
+
+            self._wakeup.clear()
+            if not self._heap:
+                await self._wakeup.wait()
+                continue
+            delay = (self._heap[0][0] - datetime.utcnow()).total_seconds()
+            if delay <= 0:
+                _, schedule_id, next_run_at = heapq.heappop(self._heap)
+                del self._due[schedule_id]
+                return schedule_id, next_run_at
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), delay)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _run(self):
+        while True:
+            await self._slots.acquire()
+            try:
+                schedule_id, next_run_at = await self._next_due()
+            except BaseException:
+                self._slots.release()
+                raise
+            task = asyncio.create_task(self._dispatch(schedule_id, next_run_at))
+            self._running.add(task)
+            task.add_done_callback(self._running.discard)
+
+    async def _dispatch(self, schedule_id: int, due: datetime):
+        try:
+            async with AsyncSessionLocal() as db:
+                schedule = await self._claim(db, schedule_id, due)
+                if schedule is not None:
+                    self.dispatched += 1
+                    await _run_schedule(db, schedule)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            self.failed += 1
+            logger.exception("Scan schedule %s crashed", schedule_id)
+        finally:
+            self._slots.release()
+
+    async def _claim(self, db: AsyncSession, schedule_id: int, due: datetime):
+        """Move the schedule's next run forward if it is still due at due; returns it or None"""
+        schedule = (await db.execute(select(ScanSchedule).filter(
+            ScanSchedule.id == schedule_id,
+            ScanSchedule.enabled.is_(True)
+        ))).scalars().first()
+        if schedule is None:
+            return None
+
+        now = datetime.utcnow()
+        next_run_at = self.next_run(due, schedule.interval_seconds, now)
+        claimed = (await db.execute(update(ScanSchedule).where(
+            ScanSchedule.id == schedule_id,
+            ScanSchedule.enabled.is_(True),
+            ScanSchedule.next_run_at == due
+        ).values(next_run_at=next_run_at))).rowcount
+        await db.commit()
+
+        if not claimed:
+            # Edited, or run by another worker process; follow its current due time
+            self.claimed_elsewhere += 1
+            await db.refresh(schedule)
+            if schedule.enabled and schedule_id not in self._due:
+                self._push(schedule_id, schedule.next_run_at, schedule.next_run_at)
+            return None
+
+        if schedule_id not in self._due:
+            self._push(schedule_id, next_run_at, next_run_at)
+        schedule.next_run_at = next_run_at
+        return schedule
+
+    def stats(self):
+        next_due_in = None
+        if self._heap:
+            next_due_in = max(0.0, (self._heap[0][0] - datetime.utcnow()).total_seconds())
+        return {
+            "schedules": len(self._due),
+            "running": len(self._running),
+            "max_concurrent": self.max_concurrent,
+            "dispatched": self.dispatched,
+            "failed": self.failed,
+            "claimed_elsewhere": self.claimed_elsewhere,
+            "caught_up": self.caught_up,
+            "next_due_in_seconds": next_due_in
+        }
+
+async def _run_schedule(db: AsyncSession, schedule: ScanSchedule):
+    """Run a claimed schedule's scan, charged to its API key like any other scan, and record the outcome"""
+    schedule.last_run_at = datetime.utcnow()
+    schedule.run_count += 1
+    try:
+        tool = SCANNER_TOOLS[schedule.tool]
+        await authenticate_api_key(schedule.apikey, db, cost=tool.cost)
+        scan_result, _, _ = await perform_scan(tool, schedule.domain, schedule.apikey, db)
+    except HTTPException as e:
+        schedule.last_status = SCHEDULE_FAILED
+        schedule.last_error = e.detail
+        if e.status_code == status.HTTP_401_UNAUTHORIZED:
+            # The API key is gone; stop scheduling
+            schedule.enabled = False
+            scan_scheduler.remove(schedule.id)
+    else:
+        schedule.last_status = scan_result.status
+        schedule.last_scan_result_id = scan_result.id
+        schedule.last_error = None
+    await db.commit()
+
+def validate_interval(interval_seconds: int):
+    if interval_seconds < settings.SCHEDULE_MIN_INTERVAL_SECONDS:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Schedule interval must be at least {settings.SCHEDULE_MIN_INTERVAL_SECONDS} seconds"
+        )
+
+async def create_schedule(db: AsyncSession, api_key: str, tool_name: str, domain: str, interval_seconds: int):
+    """Create a recurring scan for an API key; its first run is within the jitter window"""
+    get_scanner_tool(tool_name)
+    if not validate_domain(domain):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Invalid domain"
+        )
+    validate_interval(interval_seconds)
+    key_record = await verify_api_key_exists(api_key, db)
+
+    max_schedules = settings.SCHEDULE_MAX_PER_KEY.get(key_record.api_type, 0)
+    schedules = await db.scalar(select(func.count(ScanSchedule.id)).filter(ScanSchedule.apikey == api_key))
+    if schedules >= max_schedules:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail=f"Limit of {max_schedules} scan schedules reached for {key_record.api_type} API"
+        )
+
+    schedule = ScanSchedule(
+        apikey=api_key,
+        domain=domain,
+        tool=tool_name,
+        interval_seconds=interval_seconds,
+        enabled=True,
+        next_run_at=scan_scheduler.first_run(interval_seconds),
+        run_count=0
+    )
+    db.add(schedule)
+    await db.commit()
+    await db.refresh(schedule)
+    scan_scheduler.add(schedule.id, schedule.next_run_at)
+    return schedule
+
+async def get_schedule(schedule_id: int, api_key: str, db: AsyncSession):
+    """Get a scan schedule owned by an API key"""
+    await verify_api_key_exists(api_key, db)
+
+    schedule = (await db.execute(select(ScanSchedule).filter(
+        ScanSchedule.id == schedule_id,
+        ScanSchedule.apikey == api_key
+    ))).scalars().first()
+
+    if not schedule:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Scan schedule not found or you don't have permission to access it"
+        )
+
+    return schedule
+
+async def get_schedules(api_key: str, db: AsyncSession):
+    """Get every scan schedule of an API key, oldest first"""
+    await verify_api_key_exists(api_key, db)
+
+    return (await db.execute(select(ScanSchedule).filter(
+        ScanSchedule.apikey == api_key
+    ).order_by(ScanSchedule.id))).scalars().all()
+
+async def update_schedule(schedule_id: int, api_key: str, db: AsyncSession,
+                          interval_seconds: Optional[int] = None, enabled: Optional[bool] = None):
+    """Change a schedule's interval or pause/resume it"""
+    schedule = await get_schedule(schedule_id, api_key, db)
+    now = datetime.utcnow()
+
+    if interval_seconds is not None and interval_seconds != schedule.interval_seconds:
+        validate_interval(interval_seconds)
+        schedule.interval_seconds = interval_seconds
+        schedule.next_run_at = (
+            scan_scheduler.next_run(schedule.last_run_at, interval_seconds, now)
+            if schedule.last_run_at else scan_scheduler.first_run(interval_seconds, now)
+        )
+    if enabled is not None and enabled != schedule.enabled:
+        schedule.enabled = enabled
+        if enabled:
+            schedule.next_run_at = scan_scheduler.first_run(schedule.interval_seconds, now)
+    await db.commit()
+
+    if schedule.enabled:
+        scan_scheduler.add(schedule.id, schedule.next_run_at)
+    else:
+        scan_scheduler.remove(schedule.id)
+    return schedule
+
+async def delete_schedule(schedule_id: int, api_key: str, db: AsyncSession):
+    """Delete a scan schedule; scans it already ran are kept"""
+    schedule = await get_schedule(schedule_id, api_key, db)
+    await db.execute(delete(ScanSchedule).where(ScanSchedule.id == schedule.id))
+    await db.commit()
+    scan_scheduler.remove(schedule.id)
+
+scan_scheduler = ScanScheduler(
+    max_concurrent=settings.SCHEDULE_MAX_CONCURRENT,
+    jitter_ratio=settings.SCHEDULE_JITTER_RATIO,
+    max_jitter=settings.SCHEDULE_MAX_JITTER_SECONDS,
+    catchup_window=settings.SCHEDULE_CATCHUP_WINDOW_SECONDS
+)
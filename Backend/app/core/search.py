@@ -0,0 +1,258 @@
+# app/core/search.py
+import logging
+import re
+from datetime import datetime
+from typing import Optional
+from fastapi import HTTPException, status
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import bindparam, delete, exists, insert, select, text
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.config import settings
+from app.database import engine, AsyncSessionLocal, ScanResult, ScanSearchDoc
+from app.core.blobstore import BLOB_COLUMNS, decode_blob, join_blobs
+from app.utils.pagination import encode_cursor, decode_cursor
+
+logger = logging.getLogger(__name__)
+
+SEARCH_TABLE = "scan_output_fts"
+SEARCH_MAX_PAGE_SIZE = 100
+BACKFILL_BATCH_SIZE = 500
+MIN_PREFIX_CHARS = 3  # shorter prefixes expand to too many terms to rank quickly
+SNIPPET_TOKENS = 12
+SNIPPET_OPEN = "**"
+SNIPPET_CLOSE = "**"
+SNIPPET_ELLIPSIS = "…"
+
+# A "quoted phrase" or a bare word, optionally ending in * for a prefix match
+QUERY_TERM = re.compile(r'"([^"]*)"(\*?)|(\S+)')
+QUERY_OPERATORS = {"AND", "OR", "NOT"}
+
+def build_match_query(q: str):
+    """
+    Turn a user search string into an FTS5 query over the result column.
+
+    Every word is matched as a quoted phrase, so text like CVE-2023-1234 or
+    Apache/2.4.41 needs no escaping; "quoted text" matches a phrase, a
+    trailing * matches a prefix and bare AND/OR/NOT are kept as operators.
+    """
+    terms = []
+    for match in QUERY_TERM.finditer(q):
+        phrase, prefix, word = match.groups()
+        if word is not None:
+            if word in QUERY_OPERATORS:
+                terms.append(word)
+                continue
+            prefix = "*" if word.endswith("*") else ""
+            phrase = word.rstrip("*")
+        if prefix and len(phrase.strip()) < MIN_PREFIX_CHARS:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=f"Prefix searches need at least {MIN_PREFIX_CHARS} characters"
+            )
+        if phrase.strip():
+            terms.append('"' + phrase.replace('"', '""') + '"' + (" *" if prefix else ""))
+
+    # Operators need a term on both sides
+    while terms and terms[0] in QUERY_OPERATORS:
+        terms.pop(0)
+    while terms and terms[-1] in QUERY_OPERATORS:
+        terms.pop()
+    if not terms:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Search query is empty"
+        )
+    return f"result : ({' '.join(terms)})"
+
+class ScanSearchIndex:
+    """
+    SQLite FTS5 index over scan output.
+
+    Scan output lives compressed in the blob store, so the index keeps its own
+    copy of the text (needed for snippets). Repeat scans often produce the
+    same output, so each distinct output is indexed once, keyed by its blob
+    digest through scan_search_docs, and searches join back to the scans that
+    produced it to scope results to an API key. Documents are added by the
+    group-commit writer in the transaction that inserts the scans; remove()
+    drops the ones no hot scan uses any more.
+    """
+
+    def __init__(self):
+        self.available = False
+
+    def create(self):
+        """Create the FTS5 table if needed; search stays disabled on databases without FTS5"""
+        self.available = False
+        if not settings.SEARCH_ENABLED or engine.dialect.name != "sqlite":
+            return False
+        try:
+            with engine.begin() as conn:
+                table = conn.execute(text(
+                    "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = :name"
+                ), {"name": SEARCH_TABLE}).first()
+                if not table:
+                    conn.execute(text(
+                        f"CREATE VIRTUAL TABLE {SEARCH_TABLE} USING fts5("
+                        "result, tokenize = 'unicode61 remove_diacritics 2', "
+                        f"prefix = '{MIN_PREFIX_CHARS}')"
+                    ))
+        except OperationalError:
+            logger.warning("SQLite FTS5 is not available, scan search is disabled", exc_info=True)
+            return False
+        self.available = True
+        return True
+
+    async def add(self, db: AsyncSession, rows):
+        """Index (digest, output) rows whose output is not indexed yet. The caller commits."""
+        if not self.available or not rows:
+            return
+        outputs = dict(rows)
+        indexed = set((await db.execute(select(ScanSearchDoc.digest).filter(
+            ScanSearchDoc.digest.in_(list(outputs))
+        ))).scalars())
+        new = [digest for digest in outputs if digest not in indexed]
+        if not new:
+            return
+        await db.execute(insert(ScanSearchDoc), [{"digest": digest} for digest in new])
+        docs = (await db.execute(select(ScanSearchDoc.id, ScanSearchDoc.digest).filter(
+            ScanSearchDoc.digest.in_(new)
+        ))).all()
+        await db.execute(
+            text(f"INSERT INTO {SEARCH_TABLE}(rowid, result) VALUES (:id, :result)"),
+            [{"id": doc.id, "result": outputs[doc.digest]} for doc in docs]
+        )
+
+    async def remove(self, db: AsyncSession, digests):
+        """
+        Drop the outputs among digests that no hot scan has any more. Call it
+        after archiving or deleting scans; the caller commits.
+        """
+        if not self.available or not digests:
+            return
+        doc_ids = (await db.execute(select(ScanSearchDoc.id).filter(
+            ScanSearchDoc.digest.in_(list(digests)),
+            ~exists().where(
+                ScanResult.result_digest == ScanSearchDoc.digest,
+                ScanResult.archive_segment.is_(None)
+            )
+        ))).scalars().all()
+        if not doc_ids:
+            return
+        await db.execute(
+            text(f"DELETE FROM {SEARCH_TABLE} WHERE rowid IN :ids").bindparams(
+                bindparam("ids", expanding=True)
+            ),
+            {"ids": doc_ids}
+        )
+        await db.execute(delete(ScanSearchDoc).where(ScanSearchDoc.id.in_(doc_ids)))
+
+    async def backfill(self, batch_size: int = BACKFILL_BATCH_SIZE):
+        """Index outputs of scans stored before the index existed, one batch per commit"""
+        if not self.available:
+            return 0
+        indexed = 0
+        async with AsyncSessionLocal() as db:
+            while True:
+                # One row per missing output; the next batch skips the ones just indexed
+                rows = (await db.execute(join_blobs(select(
+                    ScanResult.result, ScanResult.result_digest, *BLOB_COLUMNS
+                )).filter(
+                    # Archived output is not searchable
+                    ScanResult.archive_segment.is_(None),
+                    ScanResult.result_digest.isnot(None),
+                    ~exists().where(ScanSearchDoc.digest == ScanResult.result_digest)
+                ).group_by(ScanResult.result_digest).limit(batch_size))).all()
+                if not rows:
+                    break
+
+                await self.add(db, await run_in_threadpool(_decode_rows, rows))
+                await db.commit()
+                indexed += len(rows)
+
+        if indexed:
+            logger.info("Indexed %s distinct scan outputs for search", indexed)
+        return indexed
+
+    async def search(self, api_key: str, q: str, db: AsyncSession, tool: Optional[str] = None,
+                     domain: Optional[str] = None, since: Optional[datetime] = None,
+                     until: Optional[datetime] = None, limit: int = 20, cursor: Optional[str] = None):
+        """
+        Best-matching scans of an API key for a search string, with a snippet
+        of the output around the matches. Returns (results, next cursor or None).
+        The caller verifies the API key.
+        """
+        if not self.available:
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail="Scan search is not available"
+            )
+        limit = max(1, min(limit, SEARCH_MAX_PAGE_SIZE))
+        # Ranked results have no stable keyset, so the cursor is an offset
+        offset = max(0, decode_cursor(cursor, int)[0]) if cursor is not None else 0
+
+        match = build_match_query(q)
+        filters = ["s.apikey = :apikey", "s.archive_segment IS NULL"]
+        params = {
+            "match": match,
+            "apikey": api_key,
+            "open": SNIPPET_OPEN,
+            "close": SNIPPET_CLOSE,
+            "ellipsis": SNIPPET_ELLIPSIS,
+            "tokens": SNIPPET_TOKENS,
+            "limit": limit + 1,
+            "offset": offset
+        }
+        if tool is not None:
+            filters.append("s.tool = :tool")
+            params["tool"] = tool
+        if domain is not None:
+            filters.append("s.domain = :domain")
+            params["domain"] = domain
+        typed = []
+        if since is not None:
+            filters.append("s.scan_time >= :since")
+            params["since"] = since
+            typed.append(bindparam("since", type_=ScanResult.scan_time.type))
+        if until is not None:
+            filters.append("s.scan_time < :until")
+            params["until"] = until
+            typed.append(bindparam("until", type_=ScanResult.scan_time.type))
+
+        query = text(
+            f"SELECT s.id, s.domain, s.tool, s.scan_time, s.status, "
+            f"snippet({SEARCH_TABLE}, 0, :open, :close, :ellipsis, :tokens) AS snippet, "
+            f"-{SEARCH_TABLE}.rank AS score "
+            f"FROM {SEARCH_TABLE} JOIN scan_search_docs d ON d.id = {SEARCH_TABLE}.rowid "
+            f"JOIN scan_results s ON s.result_digest = d.digest "
+            f"WHERE {SEARCH_TABLE} MATCH :match AND {' AND '.join(filters)} "
+            # Scans sharing an output tie on rank; the id keeps offsets stable
+            f"ORDER BY {SEARCH_TABLE}.rank, s.id LIMIT :limit OFFSET :offset"
+        ).bindparams(*typed).columns(scan_time=ScanResult.scan_time.type)
+        try:
+            results = (await db.execute(query, params)).all()
+        except OperationalError:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="Invalid search query"
+            )
+
+        next_cursor = None
+        if len(results) > limit:
+            results = results[:limit]
+            next_cursor = encode_cursor(offset + limit)
+        return results, next_cursor
+
+def _decode_rows(rows):
+    """(digest, output) for backfill rows"""
+    indexed = []
+    for row in rows:
+        if row.data is None:
+            output = row.result or ""
+        else:
+            output = decode_blob(row).decode(errors="replace")
+        indexed.append((row.result_digest, output))
+    return indexed
+
+search_index = ScanSearchIndex()
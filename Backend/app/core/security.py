@@ -1,28 +1,79 @@
 # app/core/security.py
+import asyncio
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
 from typing import Optional
 from jose import JWTError, jwt
 from passlib.context import CryptContext
 from fastapi import Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
-from sqlalchemy.orm import Session
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 
 from app.config import settings
 from app.database import get_db, User, Login
+from app.core.profiling import profile_span
 
-# Password hashing context
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# Password hashing context; hashes with another work factor are flagged by needs_update
+pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto", bcrypt__rounds=settings.BCRYPT_ROUNDS)
 
 # OAuth2 setup
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl=f"{settings.API_V1_PREFIX}/login")
 
-def verify_password(plain_password, hashed_password):
-    """Verify password against hashed password"""
-    return pwd_context.verify(plain_password, hashed_password)
+class PasswordHasher:
+    """
+    Runs bcrypt in a dedicated thread pool so hashing never blocks the event
+    loop or competes with the default executor. At most max_queue hash or
+    verify calls may be running or waiting; beyond that requests get a 503
+    instead of piling up behind a login burst.
+    """
 
-def get_password_hash(password):
+    def __init__(self, workers: int, max_queue: int):
+        self.workers = workers
+        self.max_queue = max_queue
+        self.rejected = 0
+        self._pending = 0
+        self._executor = None
+
+    async def run(self, func, *args):
+        if self._pending >= self.max_queue:
+            self.rejected += 1
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail="Too many login attempts in progress, please retry shortly",
+                headers={"Retry-After": "1"}
+            )
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="bcrypt")
+
+        self._pending += 1
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self._executor, func, *args)
+        finally:
+            self._pending -= 1
+
+    def stats(self):
+        return {
+            "workers": self.workers,
+            "pending": self._pending,
+            "max_queue": self.max_queue,
+            "rejected": self.rejected
+        }
+
+password_hasher = PasswordHasher(workers=settings.PASSWORD_HASH_WORKERS, max_queue=settings.PASSWORD_HASH_MAX_QUEUE)
+
+async def verify_password(plain_password, hashed_password):
+    """
+    Verify password against hashed password. Returns (valid, new hash), where
+    new hash is set when the stored hash should be replaced (work factor changed).
+    """
+    return await password_hasher.run(pwd_context.verify_and_update, plain_password, hashed_password)
+
+async def get_password_hash(password):
     """Generate password hash"""
-    return pwd_context.hash(password)
+    return await password_hasher.run(pwd_context.hash, password)
 
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     """Create JWT access token"""
@@ -35,10 +86,85 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     encoded_jwt = jwt.encode(to_encode, settings.SECRET_KEY, algorithm=settings.ALGORITHM)
     return encoded_jwt
 
-def validate_token(username: str, token: str, db: Session):
+class TokenCache:
+    """
+    Bounded cache of tokens that passed validate_token, keyed by username.
+
+    Login.jwt holds a single token per user, so an entry is the user's current
+    token and when it stops being valid: its JWT expiry, capped at max_age so
+    a token rotated by another worker process is not trusted for long. /auth/login
+    invalidates the user's entry when it issues a new token, which also bumps
+    the cache's generation: a validation that read Login.jwt before the login
+    committed captured the old generation, so its put() is dropped instead of
+    caching the replaced token. The generation is shared by all users, so a
+    login only costs concurrent validations of other users their cache write.
+    """
+
+    def __init__(self, max_entries: int, max_age: int):
+        self.max_entries = max_entries
+        self.max_age = max_age
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()  # username -> (token, valid until)
+        self._generation = 0  # bumped by every invalidate()
+
+    def get(self, username: str, token: str):
+        """True if the token was validated recently and has not expired since"""
+        entry = self._entries.get(username)
+        if entry is None or entry[0] != token:
+            self.misses += 1
+            return False
+        if entry[1] <= time.time():
+            del self._entries[username]
+            self.misses += 1
+            return False
+        self._entries.move_to_end(username)
+        self.hits += 1
+        return True
+
+    def generation(self):
+        """Capture before reading the stored token and pass to put()"""
+        return self._generation
+
+    def put(self, username: str, token: str, expires_at: float, generation: int):
+        if self.max_age <= 0 or self._generation != generation:
+            return
+        self._entries[username] = (token, min(expires_at, time.time() + self.max_age))
+        self._entries.move_to_end(username)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def invalidate(self, username: str):
+        self._entries.pop(username, None)
+        self._generation += 1
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / lookups if lookups else 0.0,
+            "entries": len(self._entries),
+            "max_entries": self.max_entries
+        }
+
+token_cache = TokenCache(max_entries=settings.TOKEN_CACHE_SIZE, max_age=settings.TOKEN_CACHE_TTL)
+
+async def validate_token(username: str, token: str, db: AsyncSession):
     """Validate JWT token for a given username"""
-    user = db.query(Login).filter(Login.username == username).first()
-    if not user:
+    with profile_span("auth_token"):
+        return await _validate_token(username, token, db)
+
+async def _validate_token(username: str, token: str, db: AsyncSession):
+    if token_cache.get(username, token):
+        return True, "Token is valid"
+
+    generation = token_cache.generation()
+    # One query gives both whether the user exists and their current token
+    stored_token = (await db.execute(
+        select(Login.jwt).filter(Login.username == username)
+    )).first()
+    if not stored_token:
         return False, "User not found"
     
     try:
@@ -48,21 +174,21 @@ def validate_token(username: str, token: str, db: Session):
             return False, "Invalid token"
     
         if username == token_username:
-            stored_token = db.query(Login).filter(Login.username == username, Login.jwt == token).first()
-            if not stored_token:
+            if stored_token.jwt != token:
                 return False, "Invalid Token, Doesn't exist in Backend"
 
             token_exp = payload.get("exp")
             if token_exp is None or datetime.utcfromtimestamp(token_exp) < datetime.utcnow():
                 return False, "Token has expired"
 
+            token_cache.put(username, token, token_exp, generation)
             return True, "Token is valid"
         else:
             return False, "Username and Token don't match"
     except JWTError:
         return False, "Invalid token"
 
-def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
+async def get_current_user(token: str = Depends(oauth2_scheme), db: AsyncSession = Depends(get_db)):
     """Get current authenticated user from token"""
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
@@ -78,7 +204,9 @@ def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(
     except JWTError:
         raise credentials_exception
         
-    user = db.query(User).join(Login).filter(User.username == username).first()
+    user = (await db.execute(
+        select(User).join(Login).filter(User.username == username)
+    )).scalars().first()
     if user is None:
         raise credentials_exception
         
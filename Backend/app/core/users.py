@@ -0,0 +1,87 @@
+# app/core/users.py
+import json
+from datetime import datetime
+from typing import Optional
+from sqlalchemy import case, func, select, tuple_
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.database import AsyncSessionLocal, User
+from app.utils.pagination import encode_cursor, decode_cursor
+
+USERS_MAX_PAGE_SIZE = 500
+USERS_STREAM_BATCH_SIZE = 1000
+
+# Columns of UserInDB, selected as plain rows so listings never build ORM objects
+USER_COLUMNS = [
+    User.id,
+    User.username,
+    User.email,
+    User.first_name,
+    User.last_name,
+    User.mobile_no,
+    User.is_api_key_generated,
+    User.is_paid,
+    User.bill_amount,
+    User.created_at
+]
+
+def user_filters(is_paid: Optional[bool] = None, has_api_key: Optional[bool] = None,
+                 created_since: Optional[datetime] = None, created_until: Optional[datetime] = None):
+    filters = []
+    if is_paid is not None:
+        filters.append(User.is_paid == is_paid)
+    if has_api_key is not None:
+        filters.append(User.is_api_key_generated == has_api_key)
+    if created_since is not None:
+        filters.append(User.created_at >= created_since)
+    if created_until is not None:
+        filters.append(User.created_at < created_until)
+    return filters
+
+async def count_users(db: AsyncSession, filters):
+    """Total, paid and free users matching the filters, counted in one aggregate query"""
+    total, paid = (await db.execute(select(
+        func.count(User.id),
+        func.coalesce(func.sum(case((User.is_paid, 1), else_=0)), 0)
+    ).filter(*filters))).one()
+    return {"total": total, "paid": paid, "free": total - paid}
+
+async def get_users_page(db: AsyncSession, filters, limit: int = 100, cursor: Optional[str] = None):
+    """
+    A newest-first page of users, using keyset pagination on (created_at, id).
+    Returns (users, cursor for the next page or None).
+    """
+    limit = max(1, min(limit, USERS_MAX_PAGE_SIZE))
+    query = select(*USER_COLUMNS).filter(*filters)
+    if cursor is not None:
+        created_at, user_id = decode_cursor(cursor, datetime, int)
+        query = query.filter(tuple_(User.created_at, User.id) < tuple_(created_at, user_id))
+
+    users = (await db.execute(query.order_by(
+        User.created_at.desc(),
+        User.id.desc()
+    ).limit(limit + 1))).all()
+
+    next_cursor = None
+    if len(users) > limit:
+        users = users[:limit]
+        next_cursor = encode_cursor(users[-1].created_at, users[-1].id)
+    return users, next_cursor
+
+def _user_json(row):
+    user = row._asdict()
+    user["created_at"] = user["created_at"].isoformat() if user["created_at"] else None
+    return json.dumps(user)
+
+async def stream_users(filters):
+    """
+    Yield every matching user as an NDJSON line, newest first, reading through a
+    server-side cursor in fixed-size batches so memory stays constant.
+    """
+    async with AsyncSessionLocal() as db:
+        result = await db.stream(select(*USER_COLUMNS).filter(*filters).order_by(
+            User.created_at.desc(),
+            User.id.desc()
+        ).execution_options(yield_per=USERS_STREAM_BATCH_SIZE))
+        async for rows in result.partitions():
+            yield "".join(_user_json(row) + "\n" for row in rows)
@@ -0,0 +1,186 @@
+# app/core/writer.py
+import asyncio
+import logging
+from sqlalchemy import bindparam, update
+
+from app.config import settings
+from app.database import AsyncSessionLocal, ApiKey, ScanResult
+from app.core.blobstore import insert_blobs, restore_missing_blobs
+from app.core.search import search_index
+
+logger = logging.getLogger(__name__)
+
+FAILURE_BACKOFF = 1.0  # seconds
+
+class GroupCommitWriter:
+    """
+    Single writer that batches usage counter increments and scan result inserts.
+
+    Requests queue their writes and the writer task commits everything that
+    arrived within the flush interval in one transaction, so SQLite pays one
+    fsync per batch instead of one per request. Usage increments for the same
+    key are merged into a single atomic UPDATE count = count + n.
+
+    Until a batch's commit is done and its increments leave _unflushed, a
+    count read from the database may or may not include them; read_usage()
+    retries reads that overlap a commit so a batch is never counted twice.
+    """
+
+    def __init__(self, flush_interval: float, max_batch: int):
+        self.flush_interval = flush_interval
+        self.max_batch = max_batch
+        self.batches = 0
+        self.rows_written = 0
+        self._usage = {}  # apikey -> increments not yet handed to a batch
+        self._unflushed = {}  # apikey -> increments not yet committed
+        self._scans = []  # (ScanResult, blob row or None, output, future)
+        self._commit_seq = 0  # bumped whenever a batch starts committing
+        self._idle = asyncio.Event()  # clear while a batch commits
+        self._idle.set()
+        self._wakeup = None
+        self._task = None
+        self._stopping = False
+
+    def start(self):
+        """Start the writer task"""
+        if self._task is None:
+            self._stopping = False
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Commit queued writes and stop the writer task"""
+        if self._task is None:
+            return
+        self._stopping = True
+        self._wakeup.set()
+        await self._task
+        self._task = None
+
+    def add_usage(self, api_key: str, amount: int = 1):
+        """Queue a usage count increment for an API key"""
+        self._usage[api_key] = self._usage.get(api_key, 0) + amount
+        self._unflushed[api_key] = self._unflushed.get(api_key, 0) + amount
+        self._wake()
+
+    def pending_usage(self, api_key: str):
+        """Increments queued for an API key that are not committed yet"""
+        return self._unflushed.get(api_key, 0)
+
+    async def read_usage(self, api_key: str, load):
+        """
+        Await load(), which reads the committed usage count, and return (its
+        result, pending_usage). A read that overlaps a batch commit is retried,
+        so the pending increments never overlap the ones it saw committed.
+        """
+        while True:
+            await self._idle.wait()
+            seq = self._commit_seq
+            result = await load()
+            if self._commit_seq == seq:
+                return result, self.pending_usage(api_key)
+
+    async def add_scan_result(self, scan_result: ScanResult, blob=None, output: str = ""):
+        """
+        Queue a scan result (and its new blob, if any) and wait until it is
+        committed. The output is added to the search index in the same transaction.
+        """
+        future = asyncio.get_running_loop().create_future()
+        self._scans.append((scan_result, blob, output, future))
+        self._wake()
+        return await future
+
+    def _wake(self):
+        self.start()
+        self._wakeup.set()
+
+    async def _run(self):
+        while True:
+            await self._wakeup.wait()
+            if not self._stopping:
+                # Give concurrent requests a moment to join the batch
+                await asyncio.sleep(self.flush_interval)
+            self._wakeup.clear()
+            if self._stopping:
+                # Drain queued scans; usage gets one last attempt with them
+                while self._scans:
+                    await self._flush()
+                await self._flush()
+                return
+            if not await self._flush():
+                # Back off instead of retrying a failing database every few ms
+                await asyncio.sleep(FAILURE_BACKOFF)
+            if self._usage or self._scans:
+                self._wakeup.set()
+
+    async def _flush(self):
+        """Commit one batch; returns False if the transaction failed"""
+        usage, self._usage = self._usage, {}
+        scans, self._scans = self._scans[:self.max_batch], self._scans[self.max_batch:]
+        if not usage and not scans:
+            return True
+
+        try:
+            async with AsyncSessionLocal() as db:
+                if usage:
+                    await db.execute(
+                        update(ApiKey.__table__).where(
+                            ApiKey.__table__.c.apikey == bindparam("b_apikey")
+                        ).values(count=ApiKey.__table__.c.count + bindparam("b_amount")),
+                        [{"b_apikey": api_key, "b_amount": amount} for api_key, amount in usage.items()]
+                    )
+                blobs = {blob["digest"]: blob for _, blob, _, _ in scans if blob is not None}
+                await insert_blobs(db, list(blobs.values()))
+                db.add_all([scan_result for scan_result, _, _, _ in scans])
+                if scans:
+                    # Flush first so blob and search checks run under the write lock
+                    await db.flush()
+                    await restore_missing_blobs(db, {
+                        scan_result.result_digest: output
+                        for scan_result, blob, output, _ in scans
+                        if blob is None or blob["base_digest"] is not None
+                    })
+                    await search_index.add(db, [
+                        (scan_result.result_digest, output) for scan_result, _, output, _ in scans
+                    ])
+                self._commit_seq += 1
+                self._idle.clear()
+                await db.commit()
+            for api_key, amount in usage.items():
+                remaining = self._unflushed.get(api_key, 0) - amount
+                if remaining > 0:
+                    self._unflushed[api_key] = remaining
+                else:
+                    self._unflushed.pop(api_key, None)
+        except Exception as e:
+            logger.exception("Group commit of %s scan results failed", len(scans))
+            # Usage is retried with the next batch so quota accounting is not lost
+            for api_key, amount in usage.items():
+                self._usage[api_key] = self._usage.get(api_key, 0) + amount
+            for _, _, _, future in scans:
+                if not future.done():
+                    future.set_exception(e)
+            return False
+        finally:
+            self._idle.set()
+
+        for scan_result, _, _, future in scans:
+            if not future.done():
+                future.set_result(scan_result)
+        self.batches += 1
+        self.rows_written += len(usage) + len(scans)
+        return True
+
+    def stats(self):
+        return {
+            "batches": self.batches,
+            "rows_written": self.rows_written,
+            "rows_per_batch": self.rows_written / self.batches if self.batches else 0.0,
+            "queued_scans": len(self._scans),
+            "queued_usage_keys": len(self._usage)
+        }
+
+db_writer = GroupCommitWriter(
+    flush_interval=settings.WRITER_FLUSH_INTERVAL_MS / 1000,
+    max_batch=settings.WRITER_MAX_BATCH
+)
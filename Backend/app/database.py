@@ -1,17 +1,95 @@
 # app/database.py
 import sqlite3
-from sqlalchemy import create_engine, Column, Integer, String, Float, Boolean, ForeignKey, DateTime, Text, UniqueConstraint
+from sqlalchemy import create_engine, event, inspect, text, Column, Integer, String, Float, Boolean, ForeignKey, DateTime, Text, LargeBinary, Index, UniqueConstraint
 from sqlalchemy.ext.declarative import declarative_base
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
 from sqlalchemy.orm import sessionmaker, relationship
 from datetime import datetime
 from app.config import settings
 
-# Create SQLAlchemy engine
-engine = create_engine(
-    settings.DATABASE_URL, connect_args={"check_same_thread": False}
-)
+def _is_file_sqlite(url):
+    return url.get_backend_name() == "sqlite" and url.database not in (None, "", ":memory:")
+
+def _apply_sqlite_profile(dbapi_connection, connection_record):
+    """Tune every new SQLite connection for concurrent readers and writers"""
+    cursor = dbapi_connection.cursor()
+    # WAL lets readers proceed while a scan result is being committed
+    cursor.execute("PRAGMA journal_mode=WAL")
+    # In WAL mode NORMAL is still crash-safe and avoids an fsync per commit
+    cursor.execute(f"PRAGMA synchronous={settings.SQLITE_SYNCHRONOUS}")
+    # Wait for the write lock instead of failing with 'database is locked'
+    cursor.execute(f"PRAGMA busy_timeout={int(settings.SQLITE_BUSY_TIMEOUT_MS)}")
+    cursor.execute(f"PRAGMA cache_size=-{int(settings.SQLITE_CACHE_SIZE_KB)}")
+    cursor.execute(f"PRAGMA mmap_size={int(settings.SQLITE_MMAP_SIZE)}")
+    cursor.execute("PRAGMA temp_store=MEMORY")
+    cursor.close()
+
+def _engine_options(url):
+    """Connection arguments and pool sizing shared by the sync and async engines"""
+    if url.get_backend_name() != "sqlite":
+        return {
+            "pool_size": settings.DB_POOL_SIZE,
+            "max_overflow": settings.DB_MAX_OVERFLOW,
+            "pool_timeout": settings.DB_POOL_TIMEOUT,
+            "pool_pre_ping": True
+        }
+    if not _is_file_sqlite(url):
+        return {"connect_args": {"check_same_thread": False}}
+    return {
+        "connect_args": {"check_same_thread": False},
+        "pool_size": settings.DB_POOL_SIZE,
+        "max_overflow": settings.DB_MAX_OVERFLOW,
+        "pool_timeout": settings.DB_POOL_TIMEOUT
+    }
+
+def _use_sqlite_profile(url):
+    return _is_file_sqlite(url) and settings.SQLITE_PRODUCTION_PROFILE
+
+def build_engine(database_url: str):
+    """
+    Create the synchronous SQLAlchemy engine, used for schema management.
+    File-backed SQLite databases get the production profile (WAL, busy
+    timeout, larger caches) when SQLITE_PRODUCTION_PROFILE is enabled.
+    """
+    url = make_url(database_url)
+    new_engine = create_engine(url, **_engine_options(url))
+    if _use_sqlite_profile(url):
+        event.listen(new_engine, "connect", _apply_sqlite_profile)
+    return new_engine
+
+def async_database_url(database_url: str):
+    """Map a database URL onto its asyncio driver (aiosqlite or asyncpg)"""
+    url = make_url(database_url)
+    backend = url.get_backend_name()
+    if backend == "sqlite":
+        return url.set(drivername="sqlite+aiosqlite")
+    if backend == "postgresql":
+        return url.set(drivername="postgresql+asyncpg")
+    return url
+
+def build_async_engine(database_url: str):
+    """
+    Create the asyncio engine used by request handlers and background tasks,
+    with the same pool sizing and SQLite profile as build_engine.
+    """
+    url = async_database_url(database_url)
+    options = _engine_options(url)
+    # aiosqlite runs each connection on its own thread already
+    options.pop("connect_args", None)
+    new_engine = create_async_engine(url, **options)
+    if _use_sqlite_profile(url):
+        event.listen(new_engine.sync_engine, "connect", _apply_sqlite_profile)
+    return new_engine
+
+# Create SQLAlchemy engines
+engine = build_engine(settings.DATABASE_URL)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+async_engine = build_async_engine(settings.DATABASE_URL)
+# Objects stay usable after commit; async sessions cannot lazy-load expired attributes
+AsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
+
 Base = declarative_base()
 
 # Define database models
@@ -32,6 +110,13 @@ class User(Base):
     # Relationships
     login = relationship("Login", back_populates="user", uselist=False)
     api_keys = relationship("ApiKey", back_populates="user")
+    
+    # Admin listings are keyset scans over (created_at, id), optionally within a paid / API key status
+    __table_args__ = (
+        Index("ix_users_created", "created_at", "id"),
+        Index("ix_users_paid_created", "is_paid", "created_at", "id"),
+        Index("ix_users_api_key_created", "is_api_key_generated", "created_at", "id"),
+    )
 
 class Login(Base):
     __tablename__ = "login"
@@ -70,20 +155,202 @@ class ScanResult(Base):
     apikey = Column(String, ForeignKey("api_keys.apikey"))
     domain = Column(String)
     tool = Column(String)
-    result = Column(Text)
+    result = Column(Text, nullable=True)  # legacy inline output, moved to scan_blobs on startup
+    result_digest = Column(String, ForeignKey("scan_blobs.digest"), nullable=True, index=True)
+    result_size = Column(Integer, nullable=True)  # uncompressed output size in bytes
+    stored_size = Column(Integer, nullable=True)  # compressed blob size in bytes
     scan_time = Column(DateTime, default=datetime.utcnow)
+    pipeline_id = Column(Integer, ForeignKey("pipeline_runs.id"), nullable=True, index=True)
+    pipeline_stage = Column(String, nullable=True)
+    archive_segment = Column(Integer, ForeignKey("archive_segments.id"), nullable=True)  # set once the output is archived
+    status = Column(String, default="completed", server_default="completed")  # or 'timed_out' (partial output)
     
     # Relationship
     api_key = relationship("ApiKey")
+    pipeline = relationship("PipelineRun", back_populates="scans")
+    # Structured findings parsed from the tool's report; written together with the scan
+    ports = relationship("ScanPort", cascade="all, delete-orphan", lazy="raise")
+    tls_findings = relationship("ScanTLS", cascade="all, delete-orphan", lazy="raise")
+    technologies = relationship("ScanTechnology", cascade="all, delete-orphan", lazy="raise")
+    
+    # History pages are keyset scans over (apikey[, tool | domain], scan_time, id)
+    __table_args__ = (
+        Index("ix_scan_results_apikey_time", "apikey", "scan_time", "id"),
+        Index("ix_scan_results_apikey_tool_time", "apikey", "tool", "scan_time", "id"),
+        Index("ix_scan_results_apikey_domain_time", "apikey", "domain", "scan_time", "id"),
+        # Retention walks hot scans oldest first and expires whole segments
+        Index("ix_scan_results_archive_time", "archive_segment", "scan_time", "id"),
+    )
+
+class ScanBlob(Base):
+    __tablename__ = "scan_blobs"
+    
+    digest = Column(String, primary_key=True)  # sha256 of the uncompressed output
+    codec = Column(String)  # 'zstd' or 'zlib'
+    raw_size = Column(Integer)
+    stored_size = Column(Integer)
+    data = Column(LargeBinary)
+    # Set when data is a line delta against this keyframe blob instead of the full output
+    base_digest = Column(String, nullable=True)
+    delta_index = Column(Integer, nullable=True)  # deltas written against the keyframe so far
+    created_at = Column(DateTime, default=datetime.utcnow)
+    
+    # Retention keeps a keyframe while any delta still needs it
+    __table_args__ = (
+        Index("ix_scan_blobs_base", "base_digest"),
+    )
+
+class ScanSearchDoc(Base):
+    __tablename__ = "scan_search_docs"
+
+    id = Column(Integer, primary_key=True)  # rowid of the output in the FTS5 table
+    digest = Column(String, unique=True)  # one document per distinct output
+
+class ArchiveSegment(Base):
+    __tablename__ = "archive_segments"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    scan_count = Column(Integer, default=0)
+    raw_bytes = Column(Integer, default=0)  # uncompressed size of the archived outputs
+    data_bytes = Column(Integer, default=0)  # size of the segment data file
+    first_scan_time = Column(DateTime, nullable=True)
+    last_scan_time = Column(DateTime, nullable=True)
+    sealed = Column(Boolean, default=False)  # full; no more scans are appended
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+class ScanPort(Base):
+    __tablename__ = "scan_ports"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    scan_id = Column(Integer, ForeignKey("scan_results.id"), index=True)
+    apikey = Column(String)  # copied from the scan so lookups stay within one index
+    host = Column(String)
+    port = Column(Integer)
+    protocol = Column(String)  # 'tcp' or 'udp'
+    state = Column(String)  # 'open', 'closed', 'filtered', ...
+    service = Column(String, nullable=True)
+    product = Column(String, nullable=True)
+    version = Column(String, nullable=True)
+    
+    __table_args__ = (
+        Index("ix_scan_ports_apikey_port", "apikey", "port", "state", "id"),
+        Index("ix_scan_ports_apikey_service", "apikey", "service", "id"),
+        Index("ix_scan_ports_apikey_host", "apikey", "host", "id"),
+    )
+
+class ScanTLS(Base):
+    __tablename__ = "scan_tls"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    scan_id = Column(Integer, ForeignKey("scan_results.id"), index=True)
+    apikey = Column(String)
+    host = Column(String)
+    port = Column(Integer)
+    protocol = Column(String)  # e.g. 'TLSv1.0'
+    cipher = Column(String, nullable=True)  # None for a bare "protocol enabled" finding
+    bits = Column(Integer, nullable=True)
+    status = Column(String)  # 'enabled', 'accepted' or 'preferred'
+    
+    __table_args__ = (
+        Index("ix_scan_tls_apikey_protocol", "apikey", "protocol", "id"),
+        Index("ix_scan_tls_apikey_cipher", "apikey", "cipher", "id"),
+        Index("ix_scan_tls_apikey_host", "apikey", "host", "id"),
+    )
+
+class ScanTechnology(Base):
+    __tablename__ = "scan_technologies"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    scan_id = Column(Integer, ForeignKey("scan_results.id"), index=True)
+    apikey = Column(String)
+    host = Column(String)
+    name = Column(String)
+    version = Column(String, nullable=True)
+    
+    __table_args__ = (
+        Index("ix_scan_technologies_apikey_name", "apikey", "name", "version", "id"),
+        Index("ix_scan_technologies_apikey_host", "apikey", "host", "id"),
+    )
+
+class PipelineRun(Base):
+    __tablename__ = "pipeline_runs"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    apikey = Column(String, ForeignKey("api_keys.apikey"), index=True)
+    domain = Column(String)
+    spec = Column(Text)  # JSON list of stages
+    status = Column(String, default="running")  # 'running', 'done' or 'cancelled'
+    node_count = Column(Integer, default=0)
+    failed_count = Column(Integer, default=0)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    finished_at = Column(DateTime, nullable=True)
+    
+    # Relationship
+    scans = relationship("ScanResult", back_populates="pipeline", order_by="ScanResult.id")
+
+class ScanJob(Base):
+    __tablename__ = "scan_jobs"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    apikey = Column(String, ForeignKey("api_keys.apikey"), index=True)
+    domain = Column(String)
+    tool = Column(String)
+    status = Column(String, default="queued", index=True)  # 'queued', 'running', 'done' or 'failed'
+    scan_result_id = Column(Integer, ForeignKey("scan_results.id"), nullable=True)
+    error = Column(String, nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    started_at = Column(DateTime, nullable=True)
+    finished_at = Column(DateTime, nullable=True)
+
+class ScanSchedule(Base):
+    __tablename__ = "scan_schedules"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    apikey = Column(String, ForeignKey("api_keys.apikey"))
+    domain = Column(String)
+    tool = Column(String)
+    interval_seconds = Column(Integer)
+    enabled = Column(Boolean, default=True)
+    next_run_at = Column(DateTime)  # claimed by the scheduler before each run
+    last_run_at = Column(DateTime, nullable=True)
+    last_status = Column(String, nullable=True)  # scan status, or 'failed'
+    last_scan_result_id = Column(Integer, ForeignKey("scan_results.id"), nullable=True)
+    last_error = Column(String, nullable=True)
+    run_count = Column(Integer, default=0)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    
+    __table_args__ = (
+        Index("ix_scan_schedules_apikey", "apikey", "id"),
+        # The scheduler loads enabled schedules by due time on start
+        Index("ix_scan_schedules_due", "enabled", "next_run_at"),
+    )
 
 # Create database dependency
-def get_db():
-    db = SessionLocal()
-    try:
+async def get_db():
+    async with AsyncSessionLocal() as db:
         yield db
-    finally:
-        db.close()
+
+def _add_missing_columns():
+    """
+    Add columns and indexes introduced after a table was first created,
+    since create_all only creates missing tables.
+    """
+    inspector = inspect(engine)
+    with engine.begin() as conn:
+        for table in Base.metadata.sorted_tables:
+            existing = {column["name"] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name not in existing:
+                    column_type = column.type.compile(dialect=engine.dialect)
+                    default = ""
+                    if column.server_default is not None:
+                        # Existing rows take the default instead of NULL
+                        default = f" DEFAULT '{column.server_default.arg}'"
+                    conn.execute(text(f"ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}{default}"))
+            for index in table.indexes:
+                index.create(bind=conn, checkfirst=True)
 
 # Initialize database
 def init_db():
-    Base.metadata.create_all(bind=engine)
\ No newline at end of file
+    Base.metadata.create_all(bind=engine)
+    _add_missing_columns()
\ No newline at end of file
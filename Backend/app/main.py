@@ -1,11 +1,42 @@
 # app/main.py
-from fastapi import FastAPI, Depends
+import time
+from fastapi import FastAPI, Depends, Request
 from fastapi.middleware.cors import CORSMiddleware
-from sqlalchemy.orm import Session
+from fastapi.responses import PlainTextResponse
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncSession
 
 from app.config import settings
-from app.database import get_db, init_db
-from app.api import auth, apikeys, users, scans
+from app.database import async_engine, get_db, init_db
+from app.api import auth, apikeys, users, scans, findings
+from app.core.apikey import api_key_cache
+from app.core.archive import archive_store
+from app.core.blobstore import migrate_inline_results
+from app.core.jobs import job_queue
+from app.core.metrics import (
+    REQUEST_DURATION,
+    REQUEST_DB_QUERIES,
+    instrument_engine,
+    render_metrics,
+    reset_request_queries,
+    route_label,
+    start_request_queries
+)
+from app.core.profiling import (
+    finish_profile,
+    install_profiling,
+    start_profile,
+    start_sampler,
+    stop_profile,
+    wants_profile
+)
+from app.core.ratelimit import rate_limiter
+from app.core.retention import retention_compactor
+from app.core.scanner import scan_cache
+from app.core.schedules import scan_scheduler
+from app.core.search import search_index
+from app.core.security import password_hasher, token_cache
+from app.core.writer import db_writer
 
 # Create FastAPI app
 app = FastAPI(
@@ -21,13 +52,63 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=[
+        "X-Next-Cursor",
+        "Retry-After",
+        "X-RateLimit-Limit",
+        "X-RateLimit-Remaining",
+        "X-RateLimit-Reset",
+        "X-RateLimit-Cost",
+        "X-Total-Count",
+        "X-Paid-Count",
+        "X-Free-Count",
+        "Server-Timing"
+    ],
 )
 
+if settings.METRICS_ENABLED:
+    instrument_engine(async_engine.sync_engine)
+
+    @app.middleware("http")
+    async def record_request_metrics(request: Request, call_next):
+        queries, token = start_request_queries()
+        started = time.perf_counter()
+        try:
+            response = await call_next(request)
+        finally:
+            reset_request_queries(token)
+        # Label by route template so path parameters don't create new series
+        route_path = route_label(request.scope)
+        REQUEST_DURATION.observe(time.perf_counter() - started, request.method, route_path, str(response.status_code))
+        REQUEST_DB_QUERIES.observe(queries[0], route_path)
+        return response
+
+if settings.PROFILING_ENABLED or settings.PROFILING_HEADER_ENABLED:
+    install_profiling(async_engine.sync_engine)
+
+    @app.middleware("http")
+    async def profile_request(request: Request, call_next):
+        if not wants_profile(request.headers):
+            return await call_next(request)
+
+        profile, token = start_profile(request.method, request.url.path)
+        sampler = start_sampler()
+        status_code = 500
+        try:
+            response = await call_next(request)
+            status_code = response.status_code
+        finally:
+            stop_profile(token)
+            total = await finish_profile(profile, sampler, status_code)
+        response.headers["Server-Timing"] = profile.server_timing(total)
+        return response
+
 # Include all API routers
 app.include_router(auth.router, prefix=f"{settings.API_V1_PREFIX}/auth")
 app.include_router(apikeys.router, prefix=f"{settings.API_V1_PREFIX}/apikeys")
 app.include_router(users.router, prefix=f"{settings.API_V1_PREFIX}/users")
 app.include_router(scans.router, prefix=f"{settings.API_V1_PREFIX}/scans")
+app.include_router(findings.router, prefix=f"{settings.API_V1_PREFIX}/findings")
 
 # Root endpoint
 @app.get("/")
@@ -40,19 +121,65 @@ async def root():
 
 # Health check endpoint
 @app.get("/health")
-async def health_check(db: Session = Depends(get_db)):
+async def health_check(db: AsyncSession = Depends(get_db)):
     try:
         # Test database connection
-        db.execute("SELECT 1")
+        await db.execute(text("SELECT 1"))
         return {"status": "healthy", "database": "connected"}
     except Exception as e:
         return {"status": "unhealthy", "database": str(e)}
 
+# Prometheus metrics endpoint
+@app.get("/metrics", response_class=PlainTextResponse, include_in_schema=False)
+async def metrics():
+    return PlainTextResponse(
+        render_metrics({
+            "api_key_cache": api_key_cache.stats(),
+            "token_cache": token_cache.stats(),
+            "scan_cache": scan_cache.stats(),
+            "rate_limiter": rate_limiter.stats(),
+            "db_writer": db_writer.stats(),
+            "scan_scheduler": scan_scheduler.stats(),
+            "password_hasher": password_hasher.stats()
+        }),
+        media_type="text/plain; version=0.0.4"
+    )
+
 # Initialize the app
 @app.on_event("startup")
 async def startup_event():
     # Initialize database
     init_db()
+    
+    # Move scan output stored inline by older versions into the blob store
+    await migrate_inline_results()
+    
+    # Create the full-text search index and index scans stored before it existed
+    search_index.create()
+    await search_index.backfill()
+    
+    # Start the group-commit writer for usage counters and scan results
+    db_writer.start()
+    
+    # Start the background scan workers and resume unfinished jobs
+    await job_queue.start()
+    
+    # Run recurring scans, catching up on those missed while the server was down
+    if settings.SCHEDULES_ENABLED:
+        await scan_scheduler.start()
+    
+    # Move output past the hot window into archive segments in the background
+    if settings.RETENTION_ENABLED:
+        retention_compactor.start()
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    await retention_compactor.stop()
+    await scan_scheduler.stop()
+    await job_queue.stop()
+    await db_writer.stop()
+    await async_engine.dispose()
+    archive_store.close()
 
 if __name__ == "__main__":
     import uvicorn
@@ -1,6 +1,6 @@
 # app/models/scan.py
 from pydantic import BaseModel, Field
-from typing import List, Optional
+from typing import Dict, List, Optional
 from datetime import datetime
 
 class ApiKeyBase(BaseModel):
@@ -32,12 +32,25 @@ class ScanResponse(BaseModel):
     tool: str
     domain: str
     output: str
+    cached: bool = False
+    status: str = "completed"  # 'timed_out' when output is partial
+    scan_id: Optional[int] = None
+
+class ScanCacheStats(BaseModel):
+    hits: int
+    coalesced: int
+    misses: int
+    hit_ratio: float
+    entries: int
+    bytes: int
+    max_bytes: int
 
 class ScanHistoryItem(BaseModel):
     id: int
     domain: str
     tool: str
     scan_time: datetime
+    status: str = "completed"
     
     class Config:
         orm_mode = True
@@ -48,6 +61,138 @@ class ScanHistoryDetailItem(ScanHistoryItem):
     class Config:
         orm_mode = True
 
+class DiffHunk(BaseModel):
+    from_start: int
+    from_lines: int
+    to_start: int
+    to_lines: int
+    lines: List[str]  # prefixed with ' ' (unchanged), '-' (removed) or '+' (added)
+
+class FindingsDiff(BaseModel):
+    added: List[dict] = []
+    removed: List[dict] = []
+
+class ScanDiffResponse(BaseModel):
+    tool: str
+    domain: str
+    from_scan: ScanHistoryItem
+    to_scan: ScanHistoryItem
+    identical: bool
+    added_lines: int
+    removed_lines: int
+    hunks: List[DiffHunk]
+    findings: Dict[str, FindingsDiff] = {}  # by finding kind: 'port', 'tls' or 'technology'
+
+class ScanSearchItem(ScanHistoryItem):
+    snippet: str
+    score: float
+    
+    class Config:
+        orm_mode = True
+
+class ScanJobResponse(BaseModel):
+    id: int
+    tool: str
+    domain: str
+    status: str
+    scan_result_id: Optional[int] = None
+    error: Optional[str] = None
+    created_at: datetime
+    started_at: Optional[datetime] = None
+    finished_at: Optional[datetime] = None
+    
+    class Config:
+        orm_mode = True
+
+class ScheduleRequest(BaseModel):
+    domain: str = Field(..., example="example.com")
+    api_key: str = Field(..., example="14f3ff2c-97e7-4ec5-8484-59953d5d3b40")
+    tool: str = Field(..., example="sslscan")
+    interval_seconds: int = Field(..., example=86400)
+
+class ScheduleUpdate(BaseModel):
+    api_key: str = Field(..., example="14f3ff2c-97e7-4ec5-8484-59953d5d3b40")
+    interval_seconds: Optional[int] = Field(None, example=3600)
+    enabled: Optional[bool] = Field(None, example=False)
+
+class ScheduleResponse(BaseModel):
+    id: int
+    tool: str
+    domain: str
+    interval_seconds: int
+    enabled: bool
+    next_run_at: datetime
+    last_run_at: Optional[datetime] = None
+    last_status: Optional[str] = None  # scan status of the last run, or 'failed'
+    last_scan_result_id: Optional[int] = None
+    last_error: Optional[str] = None
+    run_count: int
+    created_at: datetime
+    
+    class Config:
+        orm_mode = True
+
+class SchedulerStats(BaseModel):
+    schedules: int
+    running: int
+    max_concurrent: int
+    dispatched: int
+    failed: int
+    claimed_elsewhere: int
+    caught_up: int
+    next_due_in_seconds: Optional[float] = None
+
+class ScanStorageStats(BaseModel):
+    scans: int
+    blobs: int
+    delta_blobs: int
+    logical_bytes: int
+    unique_bytes: int
+    stored_bytes: int
+    compression_ratio: float
+    dedup_ratio: float
+    overall_ratio: float
+
+class RetentionStats(BaseModel):
+    hot_days: int
+    archive_days: int
+    segments: int
+    archived_scans: int
+    archived_raw_bytes: int
+    archived_data_bytes: int
+    runs: int
+    scans_archived_since_start: int
+    scans_expired_since_start: int
+    last_run_at: Optional[datetime] = None
+
+class PipelineStage(BaseModel):
+    id: str = Field(..., example="subdomains")
+    tool: str = Field(..., example="subfinder")
+    after: Optional[str] = Field(None, example=None)
+
+class PipelineRequest(BaseModel):
+    domain: str = Field(..., example="example.com")
+    api_key: str = Field(..., example="14f3ff2c-97e7-4ec5-8484-59953d5d3b40")
+    stages: List[PipelineStage] = Field(..., example=[
+        {"id": "subdomains", "tool": "subfinder"},
+        {"id": "tech", "tool": "whatweb", "after": "subdomains"},
+        {"id": "tls", "tool": "sslscan", "after": "subdomains"}
+    ])
+    max_parallel: Optional[int] = Field(None, example=4)
+
+class PipelineRunResponse(BaseModel):
+    id: int
+    domain: str
+    status: str
+    node_count: int
+    failed_count: int
+    created_at: datetime
+    finished_at: Optional[datetime] = None
+    scans: List[ScanHistoryItem] = []
+    
+    class Config:
+        orm_mode = True
+
 class PaymentRequest(BaseModel):
     username: str = Field(..., example="johndoe")
     jwt_token: str = Field(..., example="eyJhbGciOiJIUzI1NiIsInR5cCI6IkpXVCJ9...")
@@ -55,4 +200,42 @@ class PaymentRequest(BaseModel):
 
 class ToolInfo(BaseModel):
     name: str
-    description: str
\ No newline at end of file
+    description: str
+    cost: int = 1
+
+class PortFinding(BaseModel):
+    id: int
+    scan_id: int
+    host: str
+    port: int
+    protocol: Optional[str] = None
+    state: str
+    service: Optional[str] = None
+    product: Optional[str] = None
+    version: Optional[str] = None
+    
+    class Config:
+        orm_mode = True
+
+class TLSFinding(BaseModel):
+    id: int
+    scan_id: int
+    host: str
+    port: int
+    protocol: Optional[str] = None
+    cipher: Optional[str] = None
+    bits: Optional[int] = None
+    status: str
+    
+    class Config:
+        orm_mode = True
+
+class TechnologyFinding(BaseModel):
+    id: int
+    scan_id: int
+    host: str
+    name: str
+    version: Optional[str] = None
+    
+    class Config:
+        orm_mode = True
\ No newline at end of file
@@ -1,6 +1,6 @@
 # app/models/user.py
 from pydantic import BaseModel, EmailStr, Field
-from typing import Optional
+from typing import List, Optional
 from datetime import datetime
 
 # User models for requests and responses
@@ -31,3 +31,11 @@ class UserInDB(UserResponse):
     
     class Config:
         orm_mode = True
+
+class UserCounts(BaseModel):
+    total: int
+    paid: int
+    free: int
+
+class UserListResponse(UserCounts):
+    users: List[UserInDB]
\ No newline at end of file
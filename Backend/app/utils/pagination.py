@@ -0,0 +1,36 @@
+# app/utils/pagination.py
+import base64
+import json
+from datetime import datetime
+from fastapi import HTTPException, status
+
+def encode_cursor(*values):
+    """
+    Encode the sort key of the last row on a page as an opaque cursor.
+    Datetimes are encoded as ISO strings.
+    """
+    raw = json.dumps([
+        value.isoformat() if isinstance(value, datetime) else value
+        for value in values
+    ])
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+def decode_cursor(cursor: str, *types):
+    """
+    Decode a cursor produced by encode_cursor, converting each value to the given type.
+    Raises HTTPException if the cursor is malformed.
+    """
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        values = json.loads(raw)
+        if not isinstance(values, list) or len(values) != len(types):
+            raise ValueError("wrong number of values")
+        return tuple(
+            datetime.fromisoformat(value) if value_type is datetime else value_type(value)
+            for value, value_type in zip(values, types)
+        )
+    except (ValueError, TypeError):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Invalid pagination cursor"
+        )
@@ -0,0 +1,252 @@
+# benchmarks/run.py
+"""
+Load benchmark for the API, run from the Backend directory:
+
+    python -m benchmarks.run --concurrency 32 --requests 500 --output results.json
+    python -m benchmarks.run --compare results.json
+
+Starts the app under uvicorn on localhost with a fresh SQLite database and
+stub scanner binaries on PATH, drives it with concurrent clients and reports
+p50/p99 latency and requests/s per scenario. Everything runs offline.
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+import httpx
+
+from benchmarks.stubs import STUB_TOOLS, write_stubs
+
+API = "/api/v1"
+USERNAME = "benchuser"
+PASSWORD = "Bench-Passw0rd"
+SERVER_START_TIMEOUT = 30
+
+def parse_tool_values(values, default, cast):
+    """Parse ["0.05", "nmap=0.5"] into {"default": 0.05, "nmap": 0.5}"""
+    parsed = {"default": default}
+    for value in values or []:
+        tool, _, amount = value.rpartition("=")
+        parsed[tool or "default"] = cast(amount)
+    return parsed
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def start_server(workdir: str, stub_dir: str, port: int, args):
+    env = dict(os.environ)
+    env.update({
+        "PATH": stub_dir + os.pathsep + env.get("PATH", ""),
+        "DATABASE_URL": f"sqlite:///{os.path.join(workdir, 'bench.db')}",
+        "ADMIN_SECRET_KEY": "bench-admin",
+        "RATE_LIMIT_ENABLED": "false",
+        "BCRYPT_ROUNDS": str(args.bcrypt_rounds)
+    })
+    return subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app.main:app",
+         "--host", "127.0.0.1", "--port", str(port), "--log-level", "warning"],
+        env=env
+    )
+
+async def wait_for_server(client: httpx.AsyncClient):
+    deadline = time.monotonic() + SERVER_START_TIMEOUT
+    while time.monotonic() < deadline:
+        try:
+            if (await client.get("/health")).status_code == 200:
+                return
+        except httpx.TransportError:
+            pass
+        await asyncio.sleep(0.1)
+    raise RuntimeError("Server did not start")
+
+async def create_paid_key(client: httpx.AsyncClient):
+    """Register the benchmark user and return (paid API key, jwt) so usage limits don't apply"""
+    response = await client.post(f"{API}/auth/register", json={
+        "username": USERNAME,
+        "first_name": "Bench",
+        "last_name": "User",
+        "email": "bench@example.com",
+        "password": PASSWORD,
+        "mobile_no": "1234567890"
+    })
+    response.raise_for_status()
+    token = (await client.post(f"{API}/auth/login", json={
+        "username": USERNAME, "password": PASSWORD
+    })).json()["access_token"]
+    (await client.post(f"{API}/users/make-payment", json={
+        "username": USERNAME, "jwt_token": token, "amount": 1
+    })).raise_for_status()
+    response = await client.post(f"{API}/apikeys/generate-api-key", json={
+        "username": USERNAME, "api_type": "paid", "jwt_token": token
+    })
+    response.raise_for_status()
+    return response.json()["api_key"]
+
+def percentile(sorted_values, fraction):
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return None
+    index = max(0, min(len(sorted_values) - 1, int(round(fraction * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[index]
+
+async def run_scenario(client: httpx.AsyncClient, request, total: int, concurrency: int):
+    """Send total requests with concurrency workers; request(i) returns a response"""
+    latencies = []
+    errors = {}
+    next_index = 0
+
+    async def worker():
+        nonlocal next_index
+        while next_index < total:
+            index = next_index
+            next_index += 1
+            started = time.perf_counter()
+            try:
+                response = await request(index)
+                status_code = response.status_code
+            except httpx.HTTPError as e:
+                status_code = type(e).__name__
+            latencies.append(time.perf_counter() - started)
+            if status_code != 200:
+                errors[str(status_code)] = errors.get(str(status_code), 0) + 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    return {
+        "requests": total,
+        "concurrency": concurrency,
+        "errors": errors,
+        "seconds": round(elapsed, 3),
+        "requests_per_second": round(total / elapsed, 2),
+        "p50_ms": round(percentile(latencies, 0.50) * 1000, 2),
+        "p90_ms": round(percentile(latencies, 0.90) * 1000, 2),
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 2),
+        "max_ms": round(latencies[-1] * 1000, 2)
+    }
+
+async def run_benchmarks(base_url: str, args):
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=args.timeout) as client:
+        await wait_for_server(client)
+        api_key = await create_paid_key(client)
+        results = {}
+
+        def scan(tool):
+            # Unique domains so the scan result cache doesn't answer instead of the tool
+            return lambda i: client.post(f"{API}/scans/scan/{tool}", json={
+                "domain": f"host{i}.bench-{tool}.example.com", "api_key": api_key
+            })
+
+        scenarios = [(f"scan_{tool}", scan(tool), args.scan_requests) for tool in args.tools]
+        scenarios.append(("history", lambda i: client.get(
+            f"{API}/scans/history/{api_key}", params={"limit": 20}
+        ), args.requests))
+        for name, request, total in scenarios:
+            results[name] = await run_scenario(client, request, total, args.concurrency)
+            print(f"{name:>16}: {format_result(results[name])}", flush=True)
+
+        history = (await client.get(f"{API}/scans/history/{api_key}", params={"limit": 500})).json()
+        scan_ids = [item["id"] for item in history]
+        results["result"] = await run_scenario(client, lambda i: client.get(
+            f"{API}/scans/result/{scan_ids[i % len(scan_ids)]}", params={"api_key": api_key}
+        ), args.requests, args.concurrency)
+        print(f"{'result':>16}: {format_result(results['result'])}", flush=True)
+
+        results["auth_login"] = await run_scenario(client, lambda i: client.post(
+            f"{API}/auth/login", json={"username": USERNAME, "password": PASSWORD}
+        ), args.login_requests, args.concurrency)
+        print(f"{'auth_login':>16}: {format_result(results['auth_login'])}", flush=True)
+        return results
+
+def format_result(result):
+    errors = f" errors={result['errors']}" if result["errors"] else ""
+    return (f"{result['requests_per_second']:>8} req/s  p50 {result['p50_ms']:>8} ms  "
+            f"p99 {result['p99_ms']:>8} ms{errors}")
+
+def compare(previous_path: str, results: dict):
+    """Print the change in throughput and p99 latency against an earlier results file"""
+    with open(previous_path) as f:
+        previous = json.load(f)
+    print(f"\nCompared with {previous_path} (commit {previous['meta'].get('commit')}):")
+    for name, result in results.items():
+        before = previous["results"].get(name)
+        if not before:
+            continue
+        rps = (result["requests_per_second"] / before["requests_per_second"] - 1) * 100
+        p99 = (result["p99_ms"] / before["p99_ms"] - 1) * 100 if before["p99_ms"] else 0.0
+        print(f"{name:>16}: req/s {rps:+7.1f}%  p99 {p99:+7.1f}%")
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the API against stub scanner binaries")
+    parser.add_argument("--concurrency", type=int, default=16, help="concurrent clients")
+    parser.add_argument("--requests", type=int, default=500, help="requests per history/result scenario")
+    parser.add_argument("--scan-requests", type=int, default=200, help="requests per scan scenario")
+    parser.add_argument("--login-requests", type=int, default=50, help="requests for the login scenario")
+    parser.add_argument("--tools", nargs="+", default=list(STUB_TOOLS), choices=STUB_TOOLS)
+    parser.add_argument("--latency", action="append", metavar="[TOOL=]SECONDS",
+                        help="stub run time, for all tools or one tool (default 0.05)")
+    parser.add_argument("--output-bytes", action="append", metavar="[TOOL=]BYTES",
+                        help="stub output size, for all tools or one tool (default 4096)")
+    parser.add_argument("--bcrypt-rounds", type=int, default=12)
+    parser.add_argument("--timeout", type=float, default=60.0, help="per-request timeout in seconds")
+    parser.add_argument("--output", help="write results as JSON to this file")
+    parser.add_argument("--compare", help="earlier results JSON file to compare against")
+    args = parser.parse_args()
+
+    latency = parse_tool_values(args.latency, 0.05, float)
+    output_bytes = parse_tool_values(args.output_bytes, 4096, int)
+
+    with tempfile.TemporaryDirectory(prefix="linuxoverapi-bench-") as workdir:
+        stub_dir = write_stubs(os.path.join(workdir, "bin"), latency, output_bytes)
+        port = free_port()
+        server = start_server(workdir, stub_dir, port, args)
+        try:
+            results = asyncio.run(run_benchmarks(f"http://127.0.0.1:{port}", args))
+        finally:
+            server.terminate()
+            server.wait()
+
+    report = {
+        "meta": {
+            "commit": git_commit(),
+            "timestamp": datetime.utcnow().isoformat(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "concurrency": args.concurrency,
+            "stub_latency": latency,
+            "stub_output_bytes": output_bytes,
+            "bcrypt_rounds": args.bcrypt_rounds
+        },
+        "results": results
+    }
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"\nResults written to {args.output}")
+    if args.compare:
+        compare(args.compare, results)
+
+if __name__ == "__main__":
+    main()
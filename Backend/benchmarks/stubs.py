@@ -0,0 +1,30 @@
+# benchmarks/stubs.py
+import os
+import stat
+
+STUB_TOOLS = ("dig", "nmap", "subfinder", "nuclei")
+
+STUB_TEMPLATE = """#!/bin/sh
+# Benchmark stub for {tool}: waits {latency}s, then writes about {output_bytes} bytes
+sleep {latency}
+yes "{tool} $* 443/tcp open https" | head -c {output_bytes}
+echo
+"""
+
+def write_stubs(directory: str, latency: dict, output_bytes: dict, tools=STUB_TOOLS):
+    """
+    Write fake scanner executables into directory. latency and output_bytes map
+    a tool name to its value, with "default" used for tools not listed.
+    Put directory first on PATH to make the app run them instead of real tools.
+    """
+    os.makedirs(directory, exist_ok=True)
+    for tool in tools:
+        path = os.path.join(directory, tool)
+        with open(path, "w") as f:
+            f.write(STUB_TEMPLATE.format(
+                tool=tool,
+                latency=latency.get(tool, latency["default"]),
+                output_bytes=int(output_bytes.get(tool, output_bytes["default"]))
+            ))
+        os.chmod(path, os.stat(path).st_mode | stat.S_IXUSR | stat.S_IXGRP | stat.S_IXOTH)
+    return directory
@@ -0,0 +1,388 @@
+import asyncio
+import difflib
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+import zlib
+from datetime import datetime
+
+import pytest
+from sqlalchemy import event, text
+from sqlalchemy.ext.asyncio import async_sessionmaker
+
+from app.config import settings
+from app.database import Base, ScanResult, build_async_engine, build_engine
+from app.core import writer
+from app.core.apikey import _load_api_key
+from app.core.archive import ArchiveStore
+from app.core.blobstore import apply_delta, compress, decode_delta, encode_output, insert_blobs, make_delta
+from app.core.diff import build_hunks, delta_opcodes, unified_diff
+from app.core.scanner import ScanResultCache
+from app.core.writer import GroupCommitWriter
+
+
+def test_sqlite_profile_pragmas(tmp_path):
+    engine = build_engine(f"sqlite:///{tmp_path}/profile.db")
+    with engine.connect() as conn:
+        assert conn.execute(text("PRAGMA journal_mode")).scalar() == "wal"
+        assert conn.execute(text("PRAGMA synchronous")).scalar() == 1  # NORMAL
+        assert conn.execute(text("PRAGMA busy_timeout")).scalar() == 5000
+
+
+def test_readers_do_not_block_on_scan_writes(tmp_path):
+    engine = build_engine(f"sqlite:///{tmp_path}/concurrency.db")
+    Base.metadata.create_all(bind=engine)
+
+    write_started = threading.Event()
+    release_write = threading.Event()
+
+    def slow_scan_write():
+        with engine.connect() as conn:
+            conn.exec_driver_sql("BEGIN EXCLUSIVE")
+            conn.execute(text(
+                "INSERT INTO scan_results (apikey, domain, tool) VALUES ('key', 'example.com', 'nmap')"
+            ))
+            write_started.set()
+            release_write.wait(5)
+            conn.exec_driver_sql("COMMIT")
+
+    writer = threading.Thread(target=slow_scan_write)
+    writer.start()
+    try:
+        assert write_started.wait(5)
+
+        # With a rollback journal this read would wait for the writer and
+        # then fail with 'database is locked'; under WAL it returns at once
+        started = time.monotonic()
+        with engine.connect() as conn:
+            count = conn.execute(text("SELECT COUNT(*) FROM scan_results")).scalar()
+        assert count == 0
+        assert time.monotonic() - started < 1
+    finally:
+        release_write.set()
+        writer.join()
+
+    with engine.connect() as conn:
+        assert conn.execute(text("SELECT COUNT(*) FROM scan_results")).scalar() == 1
+
+
+def test_rollback_journal_blocks_readers(tmp_path):
+    path = tmp_path / "journal.db"
+    writer = sqlite3.connect(path, isolation_level=None)
+    writer.execute("CREATE TABLE scan_results (id INTEGER PRIMARY KEY)")
+    writer.execute("BEGIN EXCLUSIVE")
+    writer.execute("INSERT INTO scan_results DEFAULT VALUES")
+    try:
+        reader = sqlite3.connect(path, timeout=0.1)
+        try:
+            reader.execute("SELECT COUNT(*) FROM scan_results").fetchone()
+        except sqlite3.OperationalError as e:
+            assert "locked" in str(e)
+        else:
+            raise AssertionError("reader was not blocked by the writer")
+        finally:
+            reader.close()
+    finally:
+        writer.execute("ROLLBACK")
+        writer.close()
+
+
+def test_scan_cache_follower_takes_over_from_cancelled_leader():
+    runs = []
+
+    async def run():
+        runs.append(1)
+        await asyncio.sleep(0.1)
+        return 0, "output", []
+
+    async def scenario():
+        cache = ScanResultCache(max_bytes=1024)
+        leader = asyncio.create_task(cache.get_or_run("key", 60, run))
+        await asyncio.sleep(0.01)
+        follower = asyncio.create_task(cache.get_or_run("key", 60, run))
+        await asyncio.sleep(0.01)
+        leader.cancel()
+        return await follower
+
+    # The follower runs the tool itself instead of inheriting the cancellation
+    assert asyncio.run(scenario()) == (0, "output", [], False)
+    assert len(runs) == 2
+
+
+def test_scan_cache_followers_share_leader_errors():
+    async def run():
+        await asyncio.sleep(0.05)
+        raise RuntimeError("tool crashed")
+
+    async def scenario():
+        cache = ScanResultCache(max_bytes=1024)
+        leader = asyncio.create_task(cache.get_or_run("key", 60, run))
+        await asyncio.sleep(0.01)
+        follower = asyncio.create_task(cache.get_or_run("key", 60, run))
+        return await asyncio.gather(leader, follower, return_exceptions=True)
+
+    assert [str(e) for e in asyncio.run(scenario())] == ["tool crashed", "tool crashed"]
+
+
+REPORT = "".join(f"line {i} of the scan report\n" for i in range(10))
+
+# (keyframe, output) pairs with changes at the very start and end
+DELTA_CASES = [
+    (REPORT, REPORT),
+    (REPORT, "new first line\n" + REPORT),
+    (REPORT, REPORT + "new last line\n"),
+    (REPORT, REPORT.split("\n", 1)[1]),
+    (REPORT, REPORT.rsplit("\n", 2)[0] + "\n"),
+    (REPORT, "replaced first line\n" + REPORT.split("\n", 1)[1]),
+    (REPORT, REPORT.rsplit("\n", 2)[0] + "\nreplaced last line\n"),
+    (REPORT, REPORT.replace("line 4 ", "port 4 ").replace("line 7 ", "port 7 ")),
+    (REPORT, REPORT.rstrip("\n")),
+    (REPORT, ""),
+    ("", REPORT),
+    ("", "")
+]
+
+
+@pytest.mark.parametrize("base, output", DELTA_CASES)
+def test_delta_round_trip(base, output):
+    codec, data = compress(json.dumps(make_delta(base, output)).encode())
+    assert apply_delta(base, decode_delta(codec, data)) == output
+
+
+@pytest.mark.parametrize("base, output", DELTA_CASES)
+def test_delta_opcodes_match_difflib(base, output):
+    base_lines = base.splitlines(keepends=True)
+    lines = output.splitlines(keepends=True)
+    expected = difflib.SequenceMatcher(None, base_lines, lines).get_opcodes()
+    assert delta_opcodes(make_delta(base, output), len(base_lines)) == expected
+
+
+def test_delta_opcodes_reject_reordered_copies():
+    assert delta_opcodes([[5, 10], [0, 5]], 10) is None
+
+
+def test_deltas_roll_over_to_a_new_keyframe(tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, "SCAN_DELTA_KEYFRAME_INTERVAL", 2)
+    Base.metadata.create_all(bind=build_engine(f"sqlite:///{tmp_path}/blobs.db"))
+    engine = build_async_engine(f"sqlite:///{tmp_path}/blobs.db")
+    report = "".join(f"static line {i} of a long scan report\n" for i in range(500))
+
+    async def store_runs(count):
+        blobs = []
+        previous = None
+        async with async_sessionmaker(engine)() as db:
+            for run in range(count):
+                digest, _, _, blob = await encode_output(db, report + f"run {run}\n", previous)
+                await insert_blobs(db, [blob])
+                await db.commit()
+                blobs.append(blob)
+                previous = digest
+        await engine.dispose()
+        return blobs
+
+    blobs = asyncio.run(store_runs(5))
+    # A full keyframe, two deltas against it, then the next keyframe
+    assert [(blob["base_digest"], blob["delta_index"]) for blob in blobs] == [
+        (None, None),
+        (blobs[0]["digest"], 1),
+        (blobs[0]["digest"], 2),
+        (None, None),
+        (blobs[3]["digest"], 1)
+    ]
+    assert blobs[1]["stored_size"] < blobs[0]["stored_size"]
+
+
+def _unified(from_text, to_text):
+    from_lines = from_text.splitlines(keepends=True)
+    to_lines = to_text.splitlines(keepends=True)
+    opcodes = difflib.SequenceMatcher(None, from_lines, to_lines).get_opcodes()
+    hunks = build_hunks(opcodes, from_text.splitlines(), to_text.splitlines(), 3)
+    scan = {"id": 1, "scan_time": datetime(2024, 1, 1)}
+    return unified_diff({"from_scan": scan, "to_scan": {**scan, "id": 2}, "hunks": hunks}).splitlines()
+
+
+@pytest.mark.parametrize("from_text, to_text", [
+    (REPORT, REPORT),
+    ("", ""),
+    ("", REPORT),
+    (REPORT, ""),
+    (REPORT, REPORT.replace("line 5 ", "port 5 "))
+])
+def test_unified_diff_matches_difflib(from_text, to_text):
+    lines = _unified(from_text, to_text)
+    assert lines[:2] == ["--- scan 1 2024-01-01T00:00:00", "+++ scan 2 2024-01-01T00:00:00"]
+    assert lines[2:] == list(difflib.unified_diff(
+        from_text.splitlines(), to_text.splitlines(), lineterm=""
+    ))[2:]
+
+
+@pytest.fixture
+def writer_db(tmp_path, monkeypatch):
+    """Point the group-commit writer at a fresh database; returns (sync engine, async engine)"""
+    url = f"sqlite:///{tmp_path}/writer.db"
+    sync_engine = build_engine(url)
+    Base.metadata.create_all(bind=sync_engine)
+    with sync_engine.begin() as conn:
+        conn.execute(text("INSERT INTO api_keys (apikey, api_type, count) VALUES ('key', 'free', 0)"))
+    async_engine = build_async_engine(url)
+    monkeypatch.setattr(writer, "AsyncSessionLocal", async_sessionmaker(async_engine, expire_on_commit=False))
+    monkeypatch.setattr(writer, "FAILURE_BACKOFF", 0)
+    return sync_engine, async_engine
+
+
+def _queued_scan(output):
+    return ScanResult(
+        apikey="key", domain="example.com", tool="dig", status="completed",
+        result_digest=hashlib.sha256(output.encode()).hexdigest()
+    )
+
+
+def _counts(sync_engine):
+    with sync_engine.connect() as conn:
+        return conn.execute(text(
+            "SELECT (SELECT count FROM api_keys WHERE apikey = 'key'), (SELECT COUNT(*) FROM scan_results)"
+        )).first()
+
+
+def test_writer_merges_usage_increments(writer_db):
+    sync_engine, async_engine = writer_db
+    updates = []
+    event.listen(async_engine.sync_engine, "before_cursor_execute",
+                 lambda conn, cursor, statement, *args: updates.append(statement)
+                 if statement.startswith("UPDATE api_keys") else None)
+
+    async def scenario():
+        db_writer = GroupCommitWriter(flush_interval=0.05, max_batch=100)
+
+        async def request():
+            db_writer.add_usage("key")
+            await asyncio.sleep(0)
+
+        await asyncio.gather(*(request() for _ in range(5)))
+        assert db_writer.pending_usage("key") == 5
+        await asyncio.sleep(0.3)
+        assert db_writer.pending_usage("key") == 0
+        await db_writer.stop()
+        await async_engine.dispose()
+        return db_writer.batches
+
+    assert asyncio.run(scenario()) == 1
+    assert len(updates) == 1 and "count + ?" in updates[0]
+    assert _counts(sync_engine) == (5, 0)
+
+
+def test_writer_requeues_usage_when_a_batch_fails(writer_db, monkeypatch):
+    sync_engine, async_engine = writer_db
+    failures = []
+
+    async def insert_blobs_once_failing(db, blobs):
+        if not failures:
+            failures.append(blobs)
+            raise RuntimeError("disk I/O error")
+
+    monkeypatch.setattr(writer, "insert_blobs", insert_blobs_once_failing)
+
+    async def scenario():
+        db_writer = GroupCommitWriter(flush_interval=0.01, max_batch=100)
+        db_writer.add_usage("key", 2)
+        with pytest.raises(RuntimeError):
+            await db_writer.add_scan_result(_queued_scan("output"), None, "output")
+        # The usage goes in with the next batch; the failed scan is not retried
+        await asyncio.sleep(0.3)
+        assert db_writer.pending_usage("key") == 0
+        await db_writer.stop()
+        await async_engine.dispose()
+
+    asyncio.run(scenario())
+    assert _counts(sync_engine) == (2, 0)
+
+
+def test_writer_drains_queued_scans_on_stop(writer_db):
+    sync_engine, async_engine = writer_db
+
+    async def scenario():
+        db_writer = GroupCommitWriter(flush_interval=0.05, max_batch=2)
+        pending = [
+            asyncio.create_task(db_writer.add_scan_result(_queued_scan(f"output {i}"), None, f"output {i}"))
+            for i in range(5)
+        ]
+        await asyncio.sleep(0)
+        await db_writer.stop()
+        assert all(task.done() for task in pending)
+        scans = [task.result() for task in pending]
+        await async_engine.dispose()
+        return db_writer.batches, scans
+
+    batches, scans = asyncio.run(scenario())
+    assert batches == 3
+    assert all(scan.id is not None for scan in scans)
+    assert _counts(sync_engine) == (0, 5)
+
+
+def test_writer_usage_reads_retry_across_a_commit(writer_db):
+    sync_engine, async_engine = writer_db
+    loads = []
+
+    async def scenario():
+        db_writer = GroupCommitWriter(flush_interval=0.02, max_batch=100)
+
+        # The retry reuses the request's session, as lookup_api_key does
+        async with async_sessionmaker(async_engine)() as db:
+            async def load():
+                key_record = await _load_api_key("key", db)
+                loads.append(key_record.count)
+                if len(loads) == 1:
+                    # The batch commits while this read is still in flight
+                    await asyncio.sleep(0.2)
+                return key_record
+
+            db_writer.add_usage("key", 3)
+            key_record, pending = await db_writer.read_usage("key", load)
+        await db_writer.stop()
+        await async_engine.dispose()
+        return key_record.count + pending
+
+    assert asyncio.run(scenario()) == 3
+    assert loads == [0, 3]
+
+
+def test_archive_reads_survive_concurrent_appends(tmp_path):
+    # One open segment at a time, so reads of the second segment also evict readers
+    store = ArchiveStore(str(tmp_path), max_open=1)
+
+    def records(first, count):
+        return [
+            (scan_id, None, "zlib", zlib.compress(f"output of scan {scan_id}".encode()))
+            for scan_id in range(first, first + count)
+        ]
+
+    store.append(1, records(1, 50))
+    store.append(2, records(1001, 50))
+    failures = []
+    appending = threading.Event()
+    appending.set()
+
+    def read_scans():
+        while appending.is_set():
+            for segment_id, scan_id in ((1, 25), (2, 1025)):
+                try:
+                    codec, data = store.read(segment_id, scan_id)
+                    assert zlib.decompress(data) == f"output of scan {scan_id}".encode()
+                except Exception as e:
+                    failures.append(e)
+
+    readers = [threading.Thread(target=read_scans) for _ in range(4)]
+    for thread in readers:
+        thread.start()
+    try:
+        for batch in range(200):
+            store.append(1, records(100 + batch, 1))
+    finally:
+        appending.clear()
+        for thread in readers:
+            thread.join()
+    store.close()
+
+    assert failures == []
@@ -34,6 +34,30 @@ const ScanService = {
     }
   },
 
+  // Full-text search over the output of an API key's scans
+  searchScans: async (apiKey, query, filters = {}) => {
+    try {
+      const response = await api.get('/scans/search', {
+        params: { api_key: apiKey, q: query, ...filters }
+      });
+      return response.data;
+    } catch (error) {
+      throw error;
+    }
+  },
+
+  // Compare two results of the same tool and domain
+  diffScans: async (fromScanId, toScanId, apiKey, context = 3) => {
+    try {
+      const response = await api.get('/scans/diff', {
+        params: { api_key: apiKey, from: fromScanId, to: toScanId, context }
+      });
+      return response.data;
+    } catch (error) {
+      throw error;
+    }
+  },
+
   // Get detailed scan result
   getScanResult: async (scanId, apiKey) => {
     try {
@@ -42,6 +66,57 @@ const ScanService = {
     } catch (error) {
       throw error;
     }
+  },
+
+  // Get the recurring scan schedules of an API key
+  getSchedules: async (apiKey) => {
+    try {
+      const response = await api.get('/scans/schedules', {
+        params: { api_key: apiKey }
+      });
+      return response.data;
+    } catch (error) {
+      throw error;
+    }
+  },
+
+  // Run a scan every intervalSeconds
+  createSchedule: async (toolName, domain, intervalSeconds, apiKey) => {
+    try {
+      const response = await api.post('/scans/schedules', {
+        tool: toolName,
+        domain,
+        interval_seconds: intervalSeconds,
+        api_key: apiKey
+      });
+      return response.data;
+    } catch (error) {
+      throw error;
+    }
+  },
+
+  // Change a schedule's interval or pause/resume it ({ interval_seconds, enabled })
+  updateSchedule: async (scheduleId, changes, apiKey) => {
+    try {
+      const response = await api.patch(`/scans/schedules/${scheduleId}`, {
+        ...changes,
+        api_key: apiKey
+      });
+      return response.data;
+    } catch (error) {
+      throw error;
+    }
+  },
+
+  // Delete a schedule; scans it already ran stay in the history
+  deleteSchedule: async (scheduleId, apiKey) => {
+    try {
+      await api.delete(`/scans/schedules/${scheduleId}`, {
+        params: { api_key: apiKey }
+      });
+    } catch (error) {
+      throw error;
+    }
   }
 };
 
@@ -56,6 +56,18 @@ const UserService = {
     } catch (error) {
       throw error;
     }
+  },
+
+  // Admin: Get a page of users with total/paid/free counts; pass nextCursor back for the next page
+  listUsers: async (adminSecretKey, { cursor, limit = 100, ...filters } = {}) => {
+    try {
+      const response = await api.get('/users/list', {
+        params: { admin_secret_key: adminSecretKey, cursor, limit, ...filters }
+      });
+      return { ...response.data, nextCursor: response.headers['x-next-cursor'] || null };
+    } catch (error) {
+      throw error;
+    }
   }
 };
 